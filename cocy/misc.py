@@ -19,25 +19,74 @@
 .. codeauthor:: mnl
 """
 from cocy.soaplib.soap import from_soap
-from xml.etree.ElementTree import ElementTree, Element, SubElement, QName
+from xml.etree.ElementTree import ElementTree, Element, SubElement, QName, \
+    XMLParser, ParseError
 import cocy.soaplib
-from six.moves.StringIO import StringIO
+from xml.sax.saxutils import escape
+from io import BytesIO
 
 def splitQTag (tag):
     tag_ns, tag_name = tag.split("}", 1)
     tag_ns = tag_ns[1:]
     return (tag_ns, tag_name)
 
+_ENVELOPE = "{%s}Envelope" % cocy.soaplib.ns_soap_env
+_HEADER = "{%s}Header" % cocy.soaplib.ns_soap_env
+_BODY = "{%s}Body" % cocy.soaplib.ns_soap_env
+
+def _fast_path_applies(content_type):
+    content_type = content_type.lower().replace('"', "").replace(" ", "")
+    if "multipart/" in content_type:
+        return False
+    return "charset=" not in content_type or "charset=utf-8" in content_type
+
+def _parse_soap_envelope(body):
+    """
+    Parses the SOAP envelope from the raw bytes of the request's body.
+    Returns the header and payload or ``None`` if the envelope must be
+    processed by the full parser (because it uses hrefs or isn't 
+    well-formed).
+    """
+    parser = XMLParser()
+    try:
+        parser.feed(body)
+        envelope = parser.close()
+    except ParseError:
+        return None
+    if envelope.tag != _ENVELOPE:
+        return None
+    header = None
+    payload = None
+    for child in envelope:
+        if child.tag == _BODY and len(child) > 0:
+            payload = child[0]
+        elif child.tag == _HEADER and len(child) > 0 and header is None:
+            header = child[0]
+    if payload is None:
+        return None
+    for elem in payload.iter():
+        if elem.get("href") is not None:
+            return None
+    return header, payload
+
 def parseSoapRequest(request):
     # Test if this is a SOAP request. SOAP 1.1 specifies special
     # header, SOAP 1.2 special Content-Type
     soapAction = request.headers["SOAPAction"];
-    import cgi
-    contentType = cgi.parse_header(request.headers["Content-Type"]);
-    if (not soapAction and contentType[0] != "application/soap+xml"):
+    contentType = request.headers.get("Content-Type", "")
+    if (not soapAction 
+        and not contentType.startswith("application/soap+xml")):
         return
     # Get body data of request
     body = request.body.read()
+    if _fast_path_applies(contentType):
+        # UPnP control requests neither use hrefs nor attachments,
+        # parse the raw bytes without soaplib
+        result = _parse_soap_envelope(body)
+        if result is not None:
+            return (result[1].tag,) + result
+    import cgi
+    contentType = cgi.parse_header(contentType);
     # Use soaplib to separate header and payload
     charset = contentType[1].get('charset',None)
     if charset is None:
@@ -55,16 +104,79 @@ def parseSoapRequest(request):
 
 def buildSoapResponse(response, body):
     # construct the soap response, and serialize it
+    response.headers["Content-Type"] = "text/xml; charset=utf-8"
+    return serializeSoapEnvelope(body)
+
+
+def serializeSoapEnvelope(body):
+    """
+    Returns the SOAP envelope with *body* as content of the SOAP body,
+    serialized with an XML declaration.
+    """
     envelope = Element('{%s}Envelope' % cocy.soaplib.ns_soap_env)
     # body
     soap_body = SubElement(envelope, '{%s}Body' % cocy.soaplib.ns_soap_env)
     soap_body.append(body)
 
-    writer = StringIO()
-    response.headers["Content-Type"] = "text/xml; charset=utf-8"
-    writer.write("<?xml version='1.0' encoding='utf-8'?>")
+    writer = BytesIO()
+    writer.write(b"<?xml version='1.0' encoding='utf-8'?>")
     ElementTree(envelope).write(writer, encoding="utf-8")
-    return writer.getvalue()
+    return writer.getvalue().decode("utf-8")
+
+
+class _ActionResponseTemplate(object):
+    """
+    The serialized response of an action with the given out arguments,
+    split at the positions where the values are filled in.
+    """
+
+    __slots__ = ("empty", "head", "args", "tail")
+
+    def __init__(self, action_ns, action, names):
+        result = Element("{%s}%sResponse" % (action_ns, action))
+        if len(names) == 0:
+            self.empty = serializeSoapEnvelope(result)
+            return
+        self.empty = None
+        # Serialize once with a marker in place of the arguments
+        result.text = "\0"
+        self.head, self.tail = serializeSoapEnvelope(result).split("\0")
+        self.args = [("<%s>" % name, "</%s>" % name, "<%s />" % name)
+                     for name in names]
+
+    def render(self, values):
+        if self.empty is not None:
+            return self.empty
+        parts = [self.head]
+        for (start, end, empty), value in zip(self.args, values):
+            text = escape(str(value))
+            if text:
+                parts.append(start)
+                parts.append(text)
+                parts.append(end)
+            else:
+                parts.append(empty)
+        parts.append(self.tail)
+        return "".join(parts)
+
+
+_action_response_templates = dict()
+
+def buildSoapActionResponse(response, action_ns, action, out_args):
+    """
+    Returns the same as :func:`buildSoapResponse` for a response 
+    element ``{action_ns}actionResponse`` with the *out_args* 
+    ((name, value) pairs) as children. The serialization is done 
+    once for every action and list of names, the values are filled 
+    into the result.
+    """
+    names = tuple([name for name, value in out_args])
+    template = _action_response_templates.get((action_ns, action, names))
+    if template is None:
+        template = _ActionResponseTemplate(action_ns, action, names)
+        _action_response_templates[(action_ns, action, names)] = template
+    response.headers["Content-Type"] = "text/xml; charset=utf-8"
+    return template.render([value for name, value in out_args])
 
 
 def set_ns_prefixes(elem, prefix_map):
@@ -77,7 +189,7 @@ def set_ns_prefixes(elem, prefix_map):
 
     # fixup all elements in the tree
     memo = {}
-    for elem in elem.getiterator():
+    for elem in elem.iter():
         _fixup_element_prefixes(elem, uri_map, memo)
         
 
@@ -96,11 +96,11 @@ def from_soap(xml_string, http_charset):
         raise Fault('Client.SoapError', 'Soap envelope is empty!' % cocy.soaplib.ns_soap_env)
     body=None
     if len(body_envelope) > 0 and len(body_envelope[0]) > 0:
-        body = body_envelope[0].getchildren()[0]
+        body = body_envelope[0][0]
 
     header=None
     if len(header_envelope) > 0 and len(header_envelope[0]) > 0:
-        header = header_envelope[0].getchildren()[0]
+        header = header_envelope[0][0]
 
     return body, header
 
@@ -121,7 +121,7 @@ def resolve_hrefs(element, xmlids):
             [e.set(k, v) for k, v in resolved_element.items()]
 
             # copies the children
-            [e.append(child) for child in resolved_element.getchildren()]
+            [e.append(child) for child in list(resolved_element)]
 
             # copies the text
             e.text = resolved_element.text
@@ -19,24 +19,27 @@
 from circuits.core.components import BaseComponent
 from circuits_bricks.misc.compquery import Queryable
 from uuid import uuid4
-from xml.etree.ElementTree import ElementTree, Element, SubElement, QName
+from xml.etree.ElementTree import ElementTree, Element, SubElement, QName, \
+    XML
 from circuits_bricks.web.dispatchers.dispatcher import ScopedChannel
 from cocy.upnp import SSDP_DEVICE_SCHEMA, SSDP_SCHEMAS, UPNP_EVENT_NS,\
     UPNP_SERVICE_ID_PREFIX, SERVER_HELLO
 from circuits.web.controllers import Controller, expose, BaseController
-from cocy.misc import parseSoapRequest, splitQTag, buildSoapResponse
+from cocy.misc import parseSoapRequest, splitQTag, buildSoapActionResponse
 from cocy.upnp.device_server import UPnPError
 from email.utils import formatdate
 from circuits_bricks.core.timers import Timer
 from circuits.core.events import Event
 from circuits.core.handlers import handler
 from inspect import getmembers, ismethod
-from six.moves.StringIO import StringIO
-from circuits_bricks.web.client import Client, Request
+from six.moves import http_client
+from io import BytesIO
+from collections import deque, OrderedDict
 from cocy.upnp.service import UPnPService
 from circuits_bricks.app.logger import Log
 import logging
 from cocy import misc
+import time
 import six
 
 class UPnPServiceError(Exception):
@@ -108,6 +111,8 @@ class UPnPDeviceAdapter(BaseComponent, Queryable):
         self._provider = provider
         # Remember port
         self._web_server_port = port
+        # Remember the pool for event delivery
+        self._notify_pool = server.notify_pool
         # Get instance information about the provider
         manifest = provider.provider_manifest
         if manifest.unique_id and manifest.unique_id in uuid_map:
@@ -157,6 +162,10 @@ class UPnPDeviceAdapter(BaseComponent, Queryable):
     def web_server_port(self):
         return getattr(self, "_web_server_port", None)
 
+    @property
+    def notify_pool(self):
+        return getattr(self, "_notify_pool", None)
+
     @property
     def uuid(self):
         return getattr(self, "_uuid", None)
@@ -187,10 +196,10 @@ class UPnPDeviceController(Controller):
         desc = getattr(self, props.desc_gen)\
             (adapter, config_id, props, service_insts)
         misc.set_ns_prefixes(desc, { "": SSDP_DEVICE_SCHEMA })
-        writer = StringIO()
-        writer.write("<?xml version='1.0' encoding='utf-8'?>")
+        writer = BytesIO()
+        writer.write(b"<?xml version='1.0' encoding='utf-8'?>")
         ElementTree(desc).write(writer, encoding="utf-8")
-        self.description = writer.getvalue()
+        self.description = writer.getvalue().decode("utf-8")
 
     def _common_device_desc(self, adapter, config_id, props, services):
         root = Element("{%s}root" % SSDP_DEVICE_SCHEMA,
@@ -242,21 +251,127 @@ class UPnPDeviceController(Controller):
         return self.description
 
 
+def build_propertyset(state_vars):
+    """
+    Returns the body (as utf-8 encoded bytes) of the GENA event message
+    that reports the given values of the state variables.
+    """
+    root = Element(QName(UPNP_EVENT_NS, "propertyset"))
+    for name, value in state_vars.items():
+        prop = SubElement(root, QName(UPNP_EVENT_NS, "property"))
+        val = SubElement(prop, QName(UPNP_EVENT_NS, name))
+        if isinstance(value, bool):
+            val.text = "1" if value else "0"
+        else:
+            val.text = str(value)
+    misc.set_ns_prefixes(root, { "": UPNP_EVENT_NS })
+    writer = BytesIO()
+    writer.write(b"<?xml version='1.0' encoding='utf-8'?>")
+    ElementTree(root).write(writer, encoding="utf-8")
+    return writer.getvalue()
+
+
+def _merge_last_change(old, new):
+    """
+    Merges the changes reported by the ``LastChange`` value *new* into
+    the ``LastChange`` value *old*. Returns the merged value and the
+    number of changes in *old* that have been superseded.
+    """
+    root = XML(old)
+    superseded = 0
+    instances = dict((instance.get("val"), instance) for instance in root)
+    for instance in XML(new):
+        target = instances.get(instance.get("val"))
+        if target is None:
+            root.append(instance)
+            instances[instance.get("val")] = instance
+            continue
+        # Variables such as Volume have a value per channel
+        variables = dict(((var.tag, var.get("channel")), var)
+                         for var in target)
+        for var in instance:
+            key = (var.tag, var.get("channel"))
+            if key in variables:
+                variables[key].attrib = dict(var.attrib)
+                superseded += 1
+            else:
+                target.append(var)
+                variables[key] = var
+    misc.set_ns_prefixes(root, { "": misc.splitQTag(root.tag)[0] })
+    writer = BytesIO()
+    ElementTree(root).write(writer, encoding="utf-8")
+    return writer.getvalue().decode("utf-8"), superseded
+
+
+class PropertysetBody(object):
+    """
+    The body of a GENA event message, serialized with
+    :func:`build_propertyset` when it is called for the first time.
+    """
+
+    __slots__ = ("_state_vars", "_body")
+
+    def __init__(self, state_vars):
+        self._state_vars = state_vars
+        self._body = None
+
+    def __call__(self):
+        if self._body is None:
+            self._body = build_propertyset(self._state_vars)
+        return self._body
+
+
 class Notification(Event):
-    pass
+    """
+    Fired on a service's notification channel when evented state
+    variables have changed. The event message is serialized when
+    it is sent to the first subscriber and then shared by all
+    subscribers (see :class:`PropertysetBody`). If there are no
+    subscribers, it isn't serialized at all.
+    """
+
+    def __init__(self, state_vars):
+        super(Notification, self).__init__\
+            (state_vars, PropertysetBody(state_vars))
 
 
 class UPnPSubscription(BaseController):
+    """
+    A subscription for the events of a service. The event messages are
+    delivered using the *notify_pool* shared by all subscriptions (see
+    :class:`cocy.upnp.http_pool.HTTPClientPool`). If the delivery to
+    a callback URL fails, the next callback URL is tried. The
+    subscription is cancelled when *max_failures* event messages
+    in a row could not be delivered to any callback URL or when
+    the subscriber rejects an event message.
     
-    def __init__(self, callbacks, timeout, protocol):
+    Only one event message is delivered at a time, so the subscriber
+    receives the messages in the order of their SEQ numbers. Messages
+    that become due while a delivery is in progress are queued. When
+    the delivery has completed, the queued messages are combined into
+    one with the latest values of the state variables. If the 
+    queue grows beyond *max_queued* messages, they are combined 
+    immediately.
+    """
+    
+    max_failures = 3
+    max_queued = 16
+    
+    def __init__(self, callbacks, timeout, protocol, notify_pool):
         self._uuid = str(uuid4())
         super(UPnPSubscription, self).__init__(channel="subs:" + self._uuid)
         self._callbacks = callbacks
         self._used_callback = 0
-        self._client = Client(self._callbacks[self._used_callback], 
-                              self.channel).register(self)
+        self._notify_pool = notify_pool
         self._protocol = protocol
         self._seq = 0
+        self._failures = 0
+        self._cancelled = False
+        # Messages waiting for delivery, (state_vars, body or None)
+        self._outbox = deque()
+        self._delivery = None
+        self._coalesced = 0
+        self._dropped = 0
         if timeout > 0:
             self._expiry_timer = Timer \
                 (timeout, Event.create("upnp_subs_end"), self).register(self)
@@ -266,46 +381,118 @@ class UPnPSubscription(BaseController):
         if component != self:
             return
         @handler("notification", channel=parent.notification_channel)
-        def _on_notification_handler(self, state_vars):
-            self._on_notification(state_vars)
+        def _on_notification_handler(self, state_vars, body):
+            self._on_notification(state_vars, body)
         self.addHandler(_on_notification_handler)
         state_vars = dict()
         for name, method in getmembers \
             (self.parent, lambda x: ismethod(x) and hasattr(x, "_evented_by")):
             state_vars[name] = method()
         if len(state_vars) > 0:
-            self._on_notification(state_vars)
+            self._on_notification(state_vars, None)
         self.fire(Log(logging.DEBUG, "Subscribtion for " + str(self._callbacks)
                       + " on " + self.parent.notification_channel 
                       + " created"), "logger")
 
-    def _on_notification(self, state_vars):
-        root = Element(QName(UPNP_EVENT_NS, "propertyset"))
-        for name, value in state_vars.items():
-            prop = SubElement(root, QName(UPNP_EVENT_NS, "property"))
-            val = SubElement(prop, QName(UPNP_EVENT_NS, name))
-            if isinstance(value, bool):
-                val.text = "1" if value else "0"
-            else:
-                val.text = str(value)
-        misc.set_ns_prefixes(root, { "": UPNP_EVENT_NS })
-        writer = StringIO()
-        writer.write("<?xml version='1.0' encoding='utf-8'?>")
-        ElementTree(root).write(writer, encoding="utf-8")
-        body = writer.getvalue()
+    def _on_notification(self, state_vars, body):
+        if self._cancelled:
+            return
+        if self._delivery is None:
+            self._send(state_vars, body)
+            return
+        if len(self._outbox) >= self.max_queued:
+            self._coalesce()
+        self._outbox.append((state_vars, body))
+
+    def _coalesce(self):
+        if len(self._outbox) < 2:
+            return
+        state_vars = OrderedDict()
+        for queued_vars, body in self._outbox:
+            for name, value in queued_vars.items():
+                if name not in state_vars:
+                    state_vars[name] = value
+                elif name == "LastChange":
+                    state_vars[name], superseded \
+                        = _merge_last_change(state_vars[name], value)
+                    self._dropped += superseded
+                else:
+                    state_vars[name] = value
+                    self._dropped += 1
+        self._coalesced += len(self._outbox) - 1
+        self._outbox.clear()
+        self._outbox.append((state_vars, None))
+
+    def _send(self, state_vars, body):
+        body = body() if body is not None else build_propertyset(state_vars)
         self.fire(Log(logging.DEBUG, "Notifying " 
                       + self._callbacks[self._used_callback]
                       + " about " + str(state_vars)), "logger")
-        self.fire(Request("NOTIFY", self._callbacks[self._used_callback], body,
-                          { "CONTENT-TYPE": "text/xml; charset=\"utf-8\"",
-                            "NT": "upnp:event",
-                            "NTS": "upnp:propchange",
-                            "SID": self.sid,
-                            "SEQ": self._seq }))
+        # Delivery state: body, headers, callback URL used, URLs tried
+        self._delivery \
+            = [body, { "CONTENT-TYPE": "text/xml; charset=\"utf-8\"",
+                       "NT": "upnp:event",
+                       "NTS": "upnp:propchange",
+                       "SID": self.sid,
+                       "SEQ": str(self._seq) }, None, 0]
         self._seq += 1
+        self._deliver(self._delivery)
+
+    def _deliver(self, delivery):
+        delivery[2] = self._callbacks[self._used_callback]
+        self._notify_pool.submit("NOTIFY", delivery[2], channel=self.channel,
+                                 tag=delivery, body=delivery[0],
+                                 headers=delivery[1])
+
+    def _send_next(self):
+        self._delivery = None
+        self._coalesce()
+        if len(self._outbox) > 0:
+            self._send(*self._outbox.popleft())
+
+    @handler("pooled_response")
+    def _on_pooled_response(self, delivery, response):
+        if self._cancelled or delivery is not self._delivery:
+            return
+        if response.status == http_client.PRECONDITION_FAILED:
+            # Subscriber doesn't know the SID (any more)
+            self._evict("event message rejected")
+            return
+        if response.status >= 300:
+            self._on_pooled_request_failed(delivery, response.status)
+            return
+        self._failures = 0
+        self._send_next()
+
+    @handler("pooled_request_failed")
+    def _on_pooled_request_failed(self, delivery, error):
+        if self._cancelled or delivery is not self._delivery:
+            return
+        delivery[3] += 1
+        if delivery[3] < len(self._callbacks):
+            # Fail over to the next callback URL
+            self._used_callback \
+                = (self._used_callback + 1) % len(self._callbacks)
+            self._deliver(delivery)
+            return
+        self._failures += 1
+        self.fire(Log(logging.DEBUG, "Event message for " + self.sid
+                      + " could not be delivered: " + str(error)), "logger")
+        if self._failures >= self.max_failures:
+            self._evict(str(error))
+            return
+        self._send_next()
+
+    def _evict(self, reason):
+        self._cancelled = True
+        self._outbox.clear()
+        self.unregister()
+        self.fire(Log(logging.INFO, "Subscribtion for " + str(self._callbacks)
+                      + " evicted (" + reason + ")"), "logger")
 
     @handler("upnp_subs_end")
     def _on_subs_end(self):
+        self._cancelled = True
         self.unregister()
         self.fire(Log(logging.DEBUG, "Subscribtion for " + str(self._callbacks)
                       + " on " + self.parent.notification_channel
@@ -323,29 +510,294 @@ class UPnPSubscription(BaseController):
     def sid(self):
         return "uuid:" + self._uuid
 
+    @property
+    def queue_length(self):
+        """The number of event messages waiting for delivery."""
+        return len(self._outbox)
+
+    @property
+    def coalesced(self):
+        """The number of event messages combined with others."""
+        return self._coalesced
+
+    @property
+    def dropped(self):
+        """The number of values superseded before being delivered."""
+        return self._dropped
+
     @classmethod
     def sid2chan(cls, sid):
         return "subs:" + sid[5:]
 
 
+class Moderation(object):
+    """
+    Describes how the events for a state variable are moderated.
+    
+    Events are sent at most *max_rate* times per second. A value that
+    arrives earlier is held back and sent when the interval has
+    passed, unless it is replaced by a newer value before. A numeric
+    value is sent only if it differs by at least *min_delta* from
+    the value sent before.
+    """
+    
+    __slots__ = ("max_rate", "min_delta")
+    
+    def __init__(self, max_rate=None, min_delta=None):
+        self.max_rate = max_rate
+        self.min_delta = min_delta
+
+
+class _ModeratedVariable(object):
+
+    __slots__ = ("value", "sent_at", "pending", "due")
+    
+    def __init__(self):
+        self.value = None
+        self.sent_at = None
+        self.pending = None
+        self.due = None
+
+
+def _differs(value, previous, min_delta):
+    try:
+        return abs(float(value) - float(previous)) >= min_delta
+    except (TypeError, ValueError):
+        return value != previous
+
+
+class EventModerator(object):
+    """
+    Keeps track of the values sent for moderated state variables
+    (see :class:`Moderation`).
+    """
+    
+    def __init__(self):
+        self._variables = dict()
+        self._dropped = 0
+
+    def offer(self, name, rule, value, now):
+        """
+        Returns ``True`` if *value* may be sent now. Else the value is
+        either dropped or held back until :meth:`due` returns it.
+        """
+        var = self._variables.get(name)
+        if var is None:
+            var = self._variables[name] = _ModeratedVariable()
+        if var.due is not None:
+            # Superseded by this value
+            self._dropped += 1
+            var.due = None
+        if var.sent_at is not None:
+            if rule.min_delta is not None \
+                and not _differs(value, var.value, rule.min_delta):
+                self._dropped += 1
+                return False
+            if rule.max_rate is not None \
+                and now < var.sent_at + 1.0 / rule.max_rate:
+                var.pending = value
+                var.due = var.sent_at + 1.0 / rule.max_rate
+                return False
+        var.value = value
+        var.sent_at = now
+        return True
+
+    def due(self, now):
+        """
+        Returns the (name, value) pairs of the values held back that
+        may be sent now. The values must be offered again.
+        """
+        result = []
+        for name, var in self._variables.items():
+            if var.due is not None and var.due <= now:
+                result.append((name, var.pending))
+                var.pending = None
+                var.due = None
+        return result
+
+    def next_due(self):
+        """Returns the time when the next held back value becomes due."""
+        times = [var.due for var in self._variables.values()
+                 if var.due is not None]
+        return min(times) if len(times) > 0 else None
+
+    @property
+    def dropped(self):
+        """The number of values that have been dropped."""
+        return self._dropped
+
+
+_INTEGER_TYPES = ("ui1", "ui2", "ui4", "ui8", "i1", "i2", "i4", "i8", "int")
+_FLOAT_TYPES = ("r4", "r8", "number", "float", "fixed.14.4")
+
+def _to_boolean(text):
+    text = text.lower()
+    if text in ("1", "true", "yes"):
+        return True
+    if text in ("0", "false", "no"):
+        return False
+    raise ValueError(text)
+
+def _converter(data_type):
+    if data_type in _INTEGER_TYPES:
+        return int
+    if data_type in _FLOAT_TYPES:
+        return float
+    if data_type == "boolean":
+        return _to_boolean
+    return None
+
+
+class _ArgumentSpec(object):
+    """
+    An in argument of an action with the information from the related
+    state variable that is needed to validate and convert its value.
+    """
+
+    __slots__ = ("name", "convert", "allowed_values", "minimum", "maximum",
+                 "invalid_code")
+
+    def __init__(self, name, variable, invalid_code=600):
+        self.name = name
+        self.convert = None
+        self.allowed_values = None
+        self.invalid_code = invalid_code
+        self.minimum = None
+        self.maximum = None
+        if variable is None:
+            return
+        self.convert = _converter(variable.data_type)
+        if variable.allowed_values:
+            self.allowed_values = frozenset(variable.allowed_values)
+        if variable.allowed_range is not None and self.convert is not None:
+            minimum, maximum = variable.allowed_range[:2]
+            try:
+                self.minimum = self.convert(minimum) \
+                    if minimum is not None else None
+                self.maximum = self.convert(maximum) \
+                    if maximum is not None else None
+            except ValueError:
+                pass
+
+    def parse(self, text):
+        if self.allowed_values is not None \
+            and text not in self.allowed_values:
+            raise UPnPServiceError(self.invalid_code)
+        if self.convert is None:
+            return text
+        try:
+            value = self.convert(text)
+        except ValueError:
+            raise UPnPServiceError(600)
+        if self.minimum is not None and value < self.minimum \
+            or self.maximum is not None and value > self.maximum:
+            raise UPnPServiceError(601)
+        return value
+
+
+def _action_args(payload, specs):
+    """
+    Returns the arguments of the action invoked with *payload* as
+    keyword arguments for the handler. If *specs* is ``None``, the
+    values are passed as found in the request.
+    """
+    if specs is None:
+        return dict((node.tag, node.text) for node in payload)
+    if len(payload) != len(specs):
+        raise UPnPServiceError(402)
+    args = dict()
+    for spec, node in zip(specs, payload):
+        if node.tag != spec.name:
+            # Not in the order of the description, look it up
+            node = payload.find(spec.name)
+            if node is None:
+                raise UPnPServiceError(402)
+        args[spec.name] = spec.parse(node.text or "")
+    return args
+
+
 class UPnPServiceController(BaseController):
+    """
+    Makes a service of a device available for control and eventing.
+    
+    The actions are implemented by methods decorated with
+    :func:`upnp_service`. When the controller is registered, the
+    invoked actions are bound to these methods using a table that is 
+    built only once for each class and service. The table also holds
+    the in arguments from the service description, so arguments are
+    validated and converted (according to the data types of the
+    related state variables) before the methods are called.
+    """
+
+    # Dispatch tables indexed by (class, service type)
+    _dispatch_tables = dict()
 
     def __init__ \
         (self, adapter, device_path, service, service_id):
         super(UPnPServiceController, self).__init__ \
             (channel=ScopedChannel("upnp-web", device_path + "/" + service_id));
         self._service = service
+        self._notify_pool = adapter.notify_pool
         self._notification_channel = adapter.uuid + "/" \
             + service_id + "/notifications"
+        self._moderator = EventModerator()
+        self._moderations = dict()
+        for name, method in getmembers \
+            (type(self), lambda x: hasattr(x, "_moderation")):
+            self._moderations[name] = method._moderation
 
     @property
     def notification_channel(self):
         return getattr(self, "_notification_channel", None)
 
+    @property
+    def subscriptions(self):
+        """The current subscriptions for this service's events."""
+        return [c for c in self.components if isinstance(c, UPnPSubscription)]
+
+    @classmethod
+    def _dispatch_table(cls, service):
+        """
+        Returns the table that maps the QNames of the actions to
+        the implementing functions and the specifications of their 
+        in arguments.
+        """
+        service_type = getattr(service, "type_ver", None)
+        table = UPnPServiceController._dispatch_tables.get \
+            ((cls, service_type))
+        if table is not None:
+            return table
+        table = dict()
+        scpd = getattr(service, "scpd", None)
+        for name, function in getmembers \
+            (cls, lambda x: getattr(x, "_is_upnp_service", False)):
+            specs = None
+            action = scpd.actions.get(name) if scpd is not None else None
+            if action is not None:
+                invalid_codes = getattr(function, "_invalid_values", {})
+                specs = [_ArgumentSpec(arg.name, scpd.state_variables.get
+                                       (arg.related_state_variable),
+                                       invalid_codes.get(arg.name, 600))
+                         for arg in action.in_arguments]
+            table["{%s:service:%s}%s" % (SSDP_SCHEMAS, service_type, name)] \
+                = (function, specs)
+        UPnPServiceController._dispatch_tables[(cls, service_type)] = table
+        return table
+
+    def _bind_actions(self):
+        self._actions = dict()
+        self._actions_by_name = dict()
+        for qname, (function, specs) \
+            in six.iteritems(self._dispatch_table(self._service)):
+            entry = (function.__get__(self, type(self)), specs)
+            self._actions[qname] = entry
+            self._actions_by_name[splitQTag(qname)[1]] = entry
+
     @handler("registered")
     def _on_registered(self, component, parent):
         if component != self:
             return
+        self._bind_actions()
         @handler("provider_updated", channel=self.parent.provider.channel)
         def _on_provider_updated_handler(self, provider, changed):
             if provider != self.parent.provider:
@@ -355,34 +807,70 @@ class UPnPServiceController(BaseController):
             
     def _on_provider_updated(self, changed):
         state_vars = dict()
+        now = time.time()
         for name, method in getmembers \
             (self, lambda x: ismethod(x) and hasattr(x, "_evented_by")):
-            if method._evented_by is not None:
-                state_vars[name] = changed[method._evented_by]
+            if method._evented_by is None \
+                or method._evented_by not in changed:
+                continue
+            value = changed[method._evented_by]
+            rule = self._moderations.get(name)
+            if rule is None or self._moderator.offer(name, rule, value, now):
+                state_vars[name] = value
+        if len(state_vars) > 0:
+            self.fire(Notification(state_vars), self.notification_channel)
+
+    @handler("generate_events")
+    def _on_generate_events(self, event):
+        due = self._moderator.next_due()
+        if due is None:
+            return
+        now = time.time()
+        if due <= now:
+            self._on_moderated_due(self._moderator.due(now), now)
+            due = self._moderator.next_due()
+        if due is not None:
+            event.reduce_time_left(max(due - now, 0))
+
+    def _on_moderated_due(self, values, now):
+        """
+        Sends the values of moderated state variables that have been
+        held back.
+        """
+        state_vars = dict()
+        for name, value in values:
+            if self._moderator.offer(name, self._moderations[name],
+                                     value, now):
+                state_vars[name] = value
         if len(state_vars) > 0:
             self.fire(Notification(state_vars), self.notification_channel)
 
+    @property
+    def moderator(self):
+        return self._moderator
+
     @expose("control")
     def _control(self, *args):
         payload = parseSoapRequest(self.request)[2]
         action_ns, action = splitQTag(payload.tag)
-        action_args = dict()
-        for node in payload:
-            action_args[node.tag] = node.text
-        method = getattr(self, action, None)
-        if method is None or not getattr(method, "_is_upnp_service", False):
-            self.fire(Log(logging.INFO, 'Action ' + action 
-                          + " not implemented"), "logger")
-            return UPnPError(self.request, self.response, 401)
         try:
-            out_args = method(**action_args)
+            out_args = self._invoke(payload)
         except UPnPServiceError as error:
             return UPnPError(self.request, self.response, error.code)
-        result = Element("{%s}%sResponse" % (action_ns, action))
-        for name, value in out_args:
-            arg = SubElement(result, name)
-            arg.text = str(value)
-        return buildSoapResponse(self.response, result)
+        return buildSoapActionResponse(self.response, action_ns, action, 
+                                       out_args)
+
+    def _invoke(self, payload):
+        entry = self._actions.get(payload.tag)
+        if entry is None:
+            # Accept requests for other versions of the service type
+            entry = self._actions_by_name.get(splitQTag(payload.tag)[1])
+        if entry is None:
+            self.fire(Log(logging.INFO, 'Action ' + splitQTag(payload.tag)[1]
+                          + " not implemented"), "logger")
+            raise UPnPServiceError(401)
+        method, specs = entry
+        return method(**_action_args(payload, specs))
 
     @expose("sub")
     def _sub(self, *args):
@@ -406,8 +894,8 @@ class UPnPServiceController(BaseController):
             callbacks = []
             for cb in self.request.headers["CALLBACK"].split("<")[1:]:
                 callbacks.append(cb[:cb.rindex(">")])
-            subs = UPnPSubscription(callbacks, timeout, 
-                                    self.request.protocol).register(self)
+            subs = UPnPSubscription(callbacks, timeout, self.request.protocol,
+                                    self._notify_pool).register(self)
             self.response.headers["SID"] = subs.sid
             return ""
         elif self.request.method == "UNSUBSCRIBE":
@@ -417,17 +905,51 @@ class UPnPServiceController(BaseController):
             return ""
 
 
-def upnp_service(f):
-    setattr(f, "_is_upnp_service", True)
-    return f
+def upnp_service(*args, **kwargs):
+    """
+    Marks a method as implementation of an action. The in arguments
+    are validated before the method is invoked. A value that is not
+    in the allowed value list of the argument's state variable is 
+    reported with error code 600, unless *invalid_values* maps the
+    argument's name to the error code defined for this case by the
+    service.
+    """
+    if len(args) == 0 or not hasattr(args[0], "__call__"):
+        # function to be wrapped isn't first parameter, re-wrap
+        def wrapper(f):
+            setattr(f, "_is_upnp_service", True)
+            if "invalid_values" in kwargs:
+                setattr(f, "_invalid_values", kwargs["invalid_values"])
+            return f
+        return wrapper
+    else:
+        # function to be wrapped is first parameter
+        f = args[0]
+        setattr(f, "_is_upnp_service", True)
+        return f
 
 def upnp_state(*args, **kwargs):
+    """
+    Marks a method as provider of a state variable's value. If
+    *evented_by* is given, changes of the provider's property with
+    this name are sent as events.
+    
+    Events can be moderated by specifying *max_rate* and/or *min_delta*
+    (see :class:`Moderation`). For variables such as ``LastChange``
+    that combine the changes of other variables, *moderated* may map
+    the names of these variables to their :class:`Moderation`.
+    """
     if len(args) == 0 or not hasattr(args[0], "__call__"):
         # function to be wrapped isn't first parameter, re-wrap
         def wrapper(f):
             setattr(f, "_is_upnp_state", True)
             if "evented_by" in kwargs:
                 setattr(f, "_evented_by", kwargs["evented_by"])
+            if "max_rate" in kwargs or "min_delta" in kwargs:
+                setattr(f, "_moderation", Moderation \
+                        (kwargs.get("max_rate"), kwargs.get("min_delta")))
+            if "moderated" in kwargs:
+                setattr(f, "_moderated", kwargs["moderated"])
             return f
         return wrapper
     else:
@@ -17,56 +17,84 @@
    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 from cocy.upnp.adapters.adapter import upnp_service, UPnPServiceController,\
-    upnp_state, Notification, UPnPServiceError
+    upnp_state, Notification, UPnPServiceError, Moderation
 from circuits_bricks.app.logger import Log
 import logging
 from time import time
-from circuits_bricks.core.timers import Timer
 from circuits.core.events import Event
 from circuits.core.handlers import handler
-from six.moves.StringIO import StringIO
-from xml.etree.ElementTree import Element, QName, ElementTree, SubElement
+from xml.sax.saxutils import escape
 from cocy.upnp import UPNP_AVT_EVENT_NS, UPNP_RCS_EVENT_NS
-from cocy import misc
+
+_ATTRIBUTE_ENTITIES = { '"': "&quot;", "\r": "&#13;", "\n": "&#10;",
+                        "\t": "&#09;" }
+
+def build_last_change(event_ns, changes, instance_id="0"):
+    """
+    Returns the value of a ``LastChange`` state variable that reports
+    the *changes* (a dict that maps the names of the changed variables
+    to their values as strings) for the given instance. The result
+    is the same as serializing the corresponding element tree.
+    """
+    parts = ['<Event xmlns="', escape(event_ns, _ATTRIBUTE_ENTITIES),
+             '"><InstanceID val="', escape(instance_id, _ATTRIBUTE_ENTITIES)]
+    if len(changes) == 0:
+        parts.append('" /></Event>')
+        return "".join(parts)
+    parts.append('">')
+    for name, value in changes.items():
+        parts.append('<%s val="%s" />' 
+                     % (name, escape(value, _ATTRIBUTE_ENTITIES)))
+    parts.append("</InstanceID></Event>")
+    return "".join(parts)
+
 
 class UPnPCombinedEventsServiceController(UPnPServiceController):
+    """
+    Base class for services that report the changes of their state 
+    variables with the ``LastChange`` variable. Like the other state
+    variables, ``LastChange`` is moderated as declared with
+    :func:`upnp_state`. Moderation rules for the variables reported 
+    by ``LastChange`` are declared with the *moderated* argument.
+    """
     
     def __init__(self, adapter, device_path, service, service_id, event_ns):
         super(UPnPCombinedEventsServiceController, self).__init__\
             (adapter, device_path, service, service_id)
         self._event_ns = event_ns
         self._changes = dict()
-        self._updates_locked = False
+        self._change_moderations = getattr(self.LastChange, "_moderated", {})
         
-    @upnp_state(evented_by=None)
+    @upnp_state(evented_by=None, max_rate=5)
     def LastChange(self):
-        root = Element(QName(self._event_ns, "Event"))
-        inst = SubElement(root, QName(self._event_ns, "InstanceID"), 
-                                      { "val": "0" })
-        for name, value in self._changes.items():
-            SubElement(inst, QName(self._event_ns, name), { "val": value })
-        misc.set_ns_prefixes(root, { "": self._event_ns })
-        writer = StringIO()
-        ElementTree(root).write(writer, encoding="utf-8")
-        return writer.getvalue()
+        return build_last_change(self._event_ns, self._changes)
 
     def addChange(self, variable, value, auto_flush=True):
-        self._changes[variable] = str(value)
+        rule = self._change_moderations.get(variable)
+        if rule is None \
+            or self.moderator.offer(variable, rule, value, time()):
+            self._changes[variable] = str(value)
         if auto_flush:
             self.flushChanges()
 
     def flushChanges(self):
-        if self._updates_locked or len(self._changes) == 0:
+        if len(self._changes) == 0:
+            return
+        rule = self._moderations.get("LastChange")
+        if rule is not None \
+            and not self.moderator.offer("LastChange", rule, None, time()):
             return
-        self._updates_locked = True
         self.fire(Notification({ "LastChange": self.LastChange() }),
                   self.notification_channel)
         self._changes.clear()
-        Timer(0.2, Event.create("UnlockUpdates"), self).register(self)
 
-    @handler("unlock_updates")
-    def _on_unlock_updates(self, *args):
-        self._updates_locked = False
+    def _on_moderated_due(self, values, now):
+        super(UPnPCombinedEventsServiceController, self)._on_moderated_due \
+            ([(name, value) for name, value in values 
+              if name in self._moderations and name != "LastChange"], now)
+        for name, value in values:
+            if name in self._change_moderations:
+                self.addChange(name, value, auto_flush=False)
         self.flushChanges()
 
 
@@ -84,6 +112,13 @@ class RenderingController(UPnPCombinedEventsServiceController):
             self._map_changes(changed)
         self.addHandler(_on_provider_updated_handler)
 
+    # Volume changes in small steps while the user turns the knob,
+    # send at most two of them per second.
+    @upnp_state(evented_by=None, max_rate=5,
+                moderated={ "Volume": Moderation(max_rate=2) })
+    def LastChange(self):
+        return super(RenderingController, self).LastChange()
+
     def _map_changes(self, changed):
         for name, value in changed.items():
             if name == "volume":
@@ -98,7 +133,7 @@ class RenderingController(UPnPCombinedEventsServiceController):
     @upnp_service
     def SetVolume(self, **kwargs):
         self.fire(Log(logging.DEBUG, 'SetVolume to '
-                      + kwargs["DesiredVolume"]), "logger")
+                      + str(kwargs["DesiredVolume"])), "logger")
         self.fire(Event.create("SetVolume", 
                                int(kwargs["DesiredVolume"]) / 100.0),
                   self.parent.provider.channel)
@@ -288,7 +323,9 @@ class AVTransportController(UPnPCombinedEventsServiceController):
                   self.parent.provider.channel)
         return []
     
-    @upnp_service
+    # Seek modes that aren't supported are reported with the error
+    # code defined by the service, not as invalid argument
+    @upnp_service(invalid_values={ "Unit": 710 })
     def Seek(self, **kwargs):
         if not (self._transport_state == "PLAYING" 
                 or self._transport_state == "STOPPED"):
@@ -36,8 +36,7 @@ class BinarySwitchPowerController(UPnPServiceController):
 
     @upnp_service
     def SetTarget(self, **kwargs):
-        self._target \
-            = (kwargs["newTargetValue"].lower() in ["1", "yes", "true"])
+        self._target = kwargs["newTargetValue"]
         self.parent.provider.state = self._target 
         return []
 
@@ -0,0 +1,299 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.core.events import Event
+from cocy.upnp.http_pool import HTTPClientPool
+from cocy.upnp import UPNP_CONTROL_NS
+from cocy.soaplib import ns_soap_env
+from xml.etree.ElementTree import XML
+from xml.sax.saxutils import escape
+from collections import OrderedDict
+from itertools import count
+from six.moves import http_client
+import six
+
+class UPnPActionError(Exception):
+    """
+    Reports a failed action invocation. *code* is the UPnP error code
+    from the SOAP fault or, if the response isn't a SOAP fault, the
+    HTTP status.
+    """
+
+    def __init__(self, code, description=None):
+        super(UPnPActionError, self).__init__(code, description)
+        self._code = code
+        self._description = description
+
+    @property
+    def code(self):
+        return self._code
+
+    @property
+    def description(self):
+        return self._description
+
+
+class ActionResult(Event):
+    """
+    Fired on the requester's channel when an action has been
+    invoked successfully. *out_args* is an ordered dict with the
+    out arguments in the order of the service description.
+    """
+    name = "action_result"
+
+    def __init__(self, tag, out_args):
+        super(ActionResult, self).__init__(tag, out_args)
+
+
+class ActionFailed(Event):
+    """
+    Fired on the requester's channel when an action invocation
+    has failed. *error* is usually a :class:`UPnPActionError`.
+    """
+    name = "action_failed"
+
+    def __init__(self, tag, error):
+        super(ActionFailed, self).__init__(tag, error)
+
+
+_ENVELOPE_START = '<?xml version="1.0" encoding="utf-8"?>' \
+    '<s:Envelope xmlns:s="%s" ' \
+    's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">' \
+    '<s:Body>' % ns_soap_env
+
+_ENVELOPE_END = '</s:Body></s:Envelope>'
+
+def _arg_value(value):
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if not isinstance(value, six.string_types):
+        value = str(value)
+    return escape(value)
+
+def build_action_request(service_type, action, args):
+    """
+    Returns the SOAP body (as utf-8 encoded bytes) that invokes the
+    action with the given arguments. *args* is a sequence of
+    (name, value) pairs.
+    """
+    parts = [_ENVELOPE_START, '<u:%s xmlns:u="%s">' % (action, service_type)]
+    for name, value in args:
+        parts.append("<%s>%s</%s>" % (name, _arg_value(value), name))
+    parts.append("</u:%s>" % action)
+    parts.append(_ENVELOPE_END)
+    return "".join(parts).encode("utf-8")
+
+def _local_name(tag):
+    return tag[tag.index("}") + 1:] if tag.startswith("{") else tag
+
+def parse_action_response(body):
+    """
+    Returns the out arguments from a SOAP action response as an
+    ordered dict. Raises :class:`UPnPActionError` if the response is
+    a SOAP fault.
+    """
+    envelope = XML(body)
+    soap_body = envelope.find("{%s}Body" % ns_soap_env)
+    if soap_body is None or len(soap_body) == 0:
+        raise UPnPActionError(http_client.INTERNAL_SERVER_ERROR,
+                              "Invalid response")
+    payload = soap_body[0]
+    if payload.tag == "{%s}Fault" % ns_soap_env:
+        error = payload.find("detail/{%s}UPnPError" % UPNP_CONTROL_NS)
+        if error is None:
+            raise UPnPActionError(http_client.INTERNAL_SERVER_ERROR,
+                                  payload.findtext("faultstring")
+                                  or payload.findtext("{%s}faultstring"
+                                                      % ns_soap_env))
+        code = error.findtext("{%s}errorCode" % UPNP_CONTROL_NS)
+        raise UPnPActionError(int(code) if code else None,
+                              error.findtext("{%s}errorDescription"
+                                             % UPNP_CONTROL_NS))
+    result = OrderedDict()
+    for arg in payload:
+        result[_local_name(arg.tag)] = arg.text or ""
+    return result
+
+
+class _ActionCall(object):
+
+    __slots__ = ("device", "service", "action", "args", "channel", "tag",
+                 "out_args")
+
+    def __init__(self, device, service, action, args, channel, tag):
+        self.device = device
+        self.service = service
+        self.action = action
+        self.args = args
+        self.channel = channel
+        self.tag = tag
+        self.out_args = None
+
+
+class UPnPControlPoint(BaseComponent):
+    """
+    This component invokes actions on remote devices. The actions
+    and their arguments are taken from the service descriptions
+    provided by the *directory* (a
+    :class:`cocy.upnp.device_directory.UPnPDeviceDirectory`).
+
+    The requests are sent using a :class:`cocy.upnp.http_pool.HTTPClientPool`,
+    i.e. over a persistent connection for each host. Calls for a
+    host that has a call in progress are queued. Actions need not be
+    idempotent, so failed calls are by default not repeated (*retries*
+    is 0). The pool still resends a call once if it failed on a
+    connection that may have been closed by the host while idle.
+
+    The service descriptions are kept for each service of a device
+    until the device leaves the network or changes its configuration.
+    """
+
+    channel = "upnp-control"
+
+    def __init__(self, directory, channel=channel, max_connections=16,
+                 retries=0, timeout=30):
+        super(UPnPControlPoint, self).__init__(channel=channel)
+        self._directory = directory
+        self._pool = HTTPClientPool(channel=channel + "-pool",
+                                    max_connections=max_connections,
+                                    retries=retries, timeout=timeout) \
+                                    .register(self)
+        # Calls waiting for the SCPD, indexed by (USN, service id)
+        self._waiting = dict()
+        # (configuration id, SCPD) indexed by USN and service id
+        self._scpds = dict()
+        # Calls in progress, indexed by call id
+        self._calls = dict()
+        self._call_ids = count()
+
+    def invoke(self, device, service, action, args, channel, tag=None):
+        """
+        Invokes the *action* of the *service* (a
+        :class:`cocy.upnp.description.ServiceDescription`) of the
+        *device* (a :class:`cocy.upnp.device_directory.UPnPRootDevice`).
+        *args* is a dict with the in arguments. The result is reported by
+        firing an :class:`ActionResult` or :class:`ActionFailed` event
+        with the given *tag* on *channel*.
+        """
+        call = _ActionCall(device, service, action, args, channel, tag)
+        entry = self._scpds.get(device.usn, {}).get(service.service_id)
+        if entry is not None and entry[0] == device.config_id:
+            scpd = entry[1]
+        else:
+            scpd = self._directory.scpd(device, service, self.channel)
+            if scpd is not None:
+                self._keep(device, service.service_id, scpd)
+        if scpd is None:
+            self._waiting.setdefault((device.usn, service.service_id), []) \
+                .append(call)
+            return
+        self._send(call, scpd)
+
+    def _keep(self, device, service_id, scpd):
+        self._scpds.setdefault(device.usn, dict())[service_id] \
+            = (device.config_id, scpd)
+
+    @handler("scpd_available")
+    def _on_scpd_available(self, usn, service_id, scpd):
+        calls = self._waiting.pop((usn, service_id), [])
+        if len(calls) > 0:
+            self._keep(calls[0].device, service_id, scpd)
+        for call in calls:
+            self._send(call, scpd)
+
+    @handler("scpd_failed")
+    def _on_scpd_failed(self, usn, service_id, error):
+        for call in self._waiting.pop((usn, service_id), []):
+            self.fire(ActionFailed(call.tag, error), call.channel)
+
+    def _send(self, call, scpd):
+        action = scpd.actions.get(call.action)
+        if action is None:
+            self.fire(ActionFailed(call.tag, UPnPActionError
+                                   (401, "Invalid Action")), call.channel)
+            return
+        try:
+            args = [(arg.name, call.args[arg.name])
+                    for arg in action.in_arguments]
+        except KeyError:
+            self.fire(ActionFailed(call.tag, UPnPActionError
+                                   (402, "Invalid Args")), call.channel)
+            return
+        call.out_args = [arg.name for arg in action.out_arguments]
+        service_type = call.service.service_type
+        call_id = next(self._call_ids)
+        self._calls[call_id] = call
+        self._pool.submit \
+            ("POST", call.device.url(call.service.control_url),
+             channel=self.channel, tag=call_id,
+             body=build_action_request(service_type, action.name, args),
+             headers={ "Content-Type": 'text/xml; charset="utf-8"',
+                       "SOAPACTION": '"%s#%s"' % (service_type,
+                                                   action.name) })
+
+    @handler("upnp_device_bye_bye", channel="*")
+    def _on_device_bye_bye(self, usn):
+        self._scpds.pop(usn, None)
+
+    @handler("pooled_response")
+    def _on_pooled_response(self, call_id, response):
+        call = self._calls.pop(call_id, None)
+        if call is None:
+            return
+        try:
+            out_args = parse_action_response(response.read())
+        except UPnPActionError as error:
+            self.fire(ActionFailed(call.tag, error), call.channel)
+            return
+        except Exception:
+            self.fire(ActionFailed(call.tag, UPnPActionError
+                                   (response.status, "Invalid response")),
+                      call.channel)
+            return
+        if response.status != http_client.OK:
+            self.fire(ActionFailed(call.tag, UPnPActionError
+                                   (response.status)), call.channel)
+            return
+        # Return the out arguments in the order of the description
+        result = OrderedDict()
+        for name in call.out_args:
+            if name in out_args:
+                result[name] = out_args.pop(name)
+        result.update(out_args)
+        self.fire(ActionResult(call.tag, result), call.channel)
+
+    @handler("pooled_request_failed")
+    def _on_pooled_request_failed(self, call_id, error):
+        call = self._calls.pop(call_id, None)
+        if call is None:
+            return
+        self.fire(ActionFailed(call.tag, error), call.channel)
+
+    @property
+    def pool(self):
+        return self._pool
+
+    @property
+    def pending(self):
+        """The number of calls waiting for a result."""
+        return len(self._calls) \
+            + sum([len(calls) for calls in self._waiting.values()])
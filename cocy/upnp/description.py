@@ -0,0 +1,372 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp import SSDP_DEVICE_SCHEMA, UPNP_SERVICE_SCHEMA
+from xml.etree.ElementTree import iterparse
+from collections import OrderedDict
+from io import BytesIO
+
+class IconDescription(object):
+    """
+    An icon from a device description.
+    """
+
+    __slots__ = ("mime_type", "width", "height", "depth", "url")
+
+    def __init__(self, mime_type=None, width=None, height=None, depth=None,
+                 url=None):
+        self.mime_type = mime_type
+        self.width = width
+        self.height = height
+        self.depth = depth
+        self.url = url
+
+    def to_data(self):
+        return [self.mime_type, self.width, self.height, self.depth,
+                self.url]
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(*data)
+
+
+class ServiceDescription(object):
+    """
+    A service from a device description. The URLs are kept as found in
+    the description, i.e. they may be relative.
+    """
+
+    __slots__ = ("service_type", "service_id", "scpd_url", "control_url",
+                 "event_sub_url")
+
+    def __init__(self, service_type=None, service_id=None, scpd_url=None,
+                 control_url=None, event_sub_url=None):
+        self.service_type = service_type
+        self.service_id = service_id
+        self.scpd_url = scpd_url
+        self.control_url = control_url
+        self.event_sub_url = event_sub_url
+
+    def to_data(self):
+        return [self.service_type, self.service_id, self.scpd_url,
+                self.control_url, self.event_sub_url]
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(*data)
+
+
+class DeviceDescription(object):
+    """
+    A device from a device description with its icons, services and
+    embedded devices. The *url_base* is only set for a root device
+    (and only if the description has a ``URLBase`` element).
+    """
+
+    __slots__ = ("device_type", "friendly_name", "manufacturer",
+                 "model_name", "model_number", "udn", "icons", "services",
+                 "devices", "url_base")
+
+    _fields = ("device_type", "friendly_name", "manufacturer",
+               "model_name", "model_number", "udn", "url_base")
+
+    def __init__(self):
+        for field in self._fields:
+            setattr(self, field, None)
+        self.icons = []
+        self.services = []
+        self.devices = []
+
+    def all_devices(self):
+        """
+        Yields this device and all embedded devices (depth first).
+        """
+        yield self
+        for device in self.devices:
+            for embedded in device.all_devices():
+                yield embedded
+
+    def all_services(self):
+        """
+        Yields the services of this device and all embedded devices.
+        """
+        for device in self.all_devices():
+            for service in device.services:
+                yield service
+
+    def to_data(self):
+        """
+        Returns the description as nested lists, e.g. for storing
+        it as JSON.
+        """
+        return [[getattr(self, field) for field in self._fields],
+                [icon.to_data() for icon in self.icons],
+                [service.to_data() for service in self.services],
+                [device.to_data() for device in self.devices]]
+
+    @classmethod
+    def from_data(cls, data):
+        device = cls()
+        fields, icons, services, devices = data
+        for field, value in zip(cls._fields, fields):
+            setattr(device, field, value)
+        device.icons = [IconDescription.from_data(d) for d in icons]
+        device.services = [ServiceDescription.from_data(d) for d in services]
+        device.devices = [cls.from_data(d) for d in devices]
+        return device
+
+
+_NS = "{%s}" % SSDP_DEVICE_SCHEMA
+
+_device_fields = dict([(_NS + tag, field) for tag, field in [
+    ("deviceType", "device_type"), ("friendlyName", "friendly_name"),
+    ("manufacturer", "manufacturer"), ("modelName", "model_name"),
+    ("modelNumber", "model_number"), ("UDN", "udn")]])
+
+_service_fields = dict([(_NS + tag, field) for tag, field in [
+    ("serviceType", "service_type"), ("serviceId", "service_id"),
+    ("SCPDURL", "scpd_url"), ("controlURL", "control_url"),
+    ("eventSubURL", "event_sub_url")]])
+
+_icon_fields = dict([(_NS + tag, field) for tag, field in [
+    ("mimetype", "mime_type"), ("width", "width"), ("height", "height"),
+    ("depth", "depth"), ("url", "url")]])
+
+_int_icon_fields = set(["width", "height", "depth"])
+
+_DEVICE = _NS + "device"
+_SERVICE = _NS + "service"
+_ICON = _NS + "icon"
+_URL_BASE = _NS + "URLBase"
+
+def parse_description(source):
+    """
+    Parses a device description in a single pass. *source* may be
+    the description's content or a file like object. Returns the
+    root device's :class:`DeviceDescription`.
+    """
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    elif not hasattr(source, "read"):
+        source = BytesIO(source.encode("utf-8"))
+    devices = []
+    root = None
+    url_base = None
+    # The icon or service being parsed
+    item = None
+    for event, elem in iterparse(source, ("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == _DEVICE:
+                device = DeviceDescription()
+                if len(devices) > 0:
+                    devices[-1].devices.append(device)
+                elif root is None:
+                    root = device
+                devices.append(device)
+            elif len(devices) > 0:
+                if tag == _SERVICE:
+                    item = ServiceDescription()
+                    devices[-1].services.append(item)
+                elif tag == _ICON:
+                    item = IconDescription()
+                    devices[-1].icons.append(item)
+            continue
+        if tag == _DEVICE:
+            devices.pop()
+        elif tag == _SERVICE or tag == _ICON:
+            item = None
+        elif item is not None:
+            field = (_service_fields if isinstance(item, ServiceDescription)
+                     else _icon_fields).get(tag)
+            if field is not None:
+                value = (elem.text or "").strip()
+                if field in _int_icon_fields:
+                    value = int(value) if value else None
+                setattr(item, field, value)
+        elif len(devices) > 0:
+            field = _device_fields.get(tag)
+            if field is not None:
+                setattr(devices[-1], field, (elem.text or "").strip())
+        elif tag == _URL_BASE:
+            url_base = (elem.text or "").strip()
+        # Elements are no longer needed once they have been evaluated
+        elem.clear()
+    if root is None:
+        raise ValueError("Description has no device element")
+    root.url_base = url_base or None
+    return root
+
+
+class ArgumentDescription(object):
+    """
+    An argument of an action from a service description.
+    """
+
+    __slots__ = ("name", "direction", "related_state_variable")
+
+    def __init__(self, name=None, direction=None,
+                 related_state_variable=None):
+        self.name = name
+        self.direction = direction
+        self.related_state_variable = related_state_variable
+
+
+class ActionDescription(object):
+    """
+    An action from a service description.
+    """
+
+    __slots__ = ("name", "arguments")
+
+    def __init__(self, name=None):
+        self.name = name
+        self.arguments = []
+
+    @property
+    def in_arguments(self):
+        return [arg for arg in self.arguments if arg.direction == "in"]
+
+    @property
+    def out_arguments(self):
+        return [arg for arg in self.arguments if arg.direction == "out"]
+
+
+class StateVariableDescription(object):
+    """
+    A state variable from a service description. *allowed_range* is
+    a tuple (minimum, maximum, step) with the values as found in
+    the description.
+    """
+
+    __slots__ = ("name", "data_type", "send_events", "multicast",
+                 "default_value", "allowed_values", "allowed_range")
+
+    def __init__(self, name=None):
+        self.name = name
+        self.data_type = None
+        self.send_events = True
+        self.multicast = False
+        self.default_value = None
+        self.allowed_values = None
+        self.allowed_range = None
+
+
+class SCPD(object):
+    """
+    A service description (SCPD) with its actions and state variables,
+    both indexed by name.
+    """
+
+    __slots__ = ("config_id", "actions", "state_variables")
+
+    def __init__(self, config_id=None):
+        self.config_id = config_id
+        self.actions = OrderedDict()
+        self.state_variables = OrderedDict()
+
+
+_SNS = "{%s}" % UPNP_SERVICE_SCHEMA
+
+_SCPD = _SNS + "scpd"
+_ACTION = _SNS + "action"
+_ARGUMENT = _SNS + "argument"
+_STATE_VARIABLE = _SNS + "stateVariable"
+_NAME = _SNS + "name"
+_ALLOWED_VALUE = _SNS + "allowedValue"
+_ALLOWED_VALUE_LIST = _SNS + "allowedValueList"
+_ALLOWED_VALUE_RANGE = _SNS + "allowedValueRange"
+
+_argument_fields = dict([(_SNS + tag, field) for tag, field in [
+    ("name", "name"), ("direction", "direction"),
+    ("relatedStateVariable", "related_state_variable")]])
+
+_state_variable_fields = dict([(_SNS + tag, field) for tag, field in [
+    ("name", "name"), ("dataType", "data_type"),
+    ("defaultValue", "default_value")]])
+
+_range_fields = [_SNS + "minimum", _SNS + "maximum", _SNS + "step"]
+
+def parse_scpd(source):
+    """
+    Parses a service description (SCPD) in a single pass. *source* may
+    be the description's content or a file like object. Returns 
+    a :class:`SCPD`.
+    """
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    elif not hasattr(source, "read"):
+        source = BytesIO(source.encode("utf-8"))
+    scpd = SCPD()
+    action = None
+    argument = None
+    variable = None
+    allowed_range = None
+    for event, elem in iterparse(source, ("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == _ACTION:
+                action = ActionDescription()
+            elif tag == _ARGUMENT and action is not None:
+                argument = ArgumentDescription()
+                action.arguments.append(argument)
+            elif tag == _STATE_VARIABLE:
+                variable = StateVariableDescription()
+                variable.send_events = elem.get("sendEvents", "yes") == "yes"
+                variable.multicast = elem.get("multicast", "no") == "yes"
+            elif tag == _ALLOWED_VALUE_LIST and variable is not None:
+                variable.allowed_values = []
+            elif tag == _ALLOWED_VALUE_RANGE and variable is not None:
+                allowed_range = [None, None, None]
+            elif tag == _SCPD:
+                scpd.config_id = elem.get("configId")
+            continue
+        text = (elem.text or "").strip()
+        if argument is not None:
+            if tag == _ARGUMENT:
+                argument = None
+            else:
+                field = _argument_fields.get(tag)
+                if field is not None:
+                    setattr(argument, field, text)
+        elif action is not None:
+            if tag == _ACTION:
+                scpd.actions[action.name] = action
+                action = None
+            elif tag == _NAME:
+                action.name = text
+        elif variable is not None:
+            if tag == _STATE_VARIABLE:
+                scpd.state_variables[variable.name] = variable
+                variable = None
+            elif tag == _ALLOWED_VALUE:
+                variable.allowed_values.append(text)
+            elif allowed_range is not None:
+                if tag == _ALLOWED_VALUE_RANGE:
+                    variable.allowed_range = tuple(allowed_range)
+                    allowed_range = None
+                elif tag in _range_fields:
+                    allowed_range[_range_fields.index(tag)] = text
+            else:
+                field = _state_variable_fields.get(tag)
+                if field is not None:
+                    setattr(variable, field, text)
+        elem.clear()
+    return scpd
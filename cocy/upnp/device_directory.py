@@ -22,34 +22,172 @@ from circuits.core.components import BaseComponent
 from circuits.core.handlers import handler
 from cocy.upnp.ssdp import SSDPTranceiver, UPnPSearchRequest, UPnPDeviceByeBye
 from circuits.core.utils import findroot, flatten
-from cocy.upnp import UPNP_ROOTDEVICE, SSDP_DEVICE_SCHEMA
-from circuits_bricks.web import Client
-from circuits_bricks.core.timers import Timer
-from circuits.web.client import Request
+from cocy.upnp import UPNP_ROOTDEVICE
+from circuits_bricks.app.logger import Log
+from cocy.upnp.http_pool import HTTPClientPool
+from cocy.upnp.gena import GENASubscriber
+from cocy.upnp.description import DeviceDescription, parse_description, \
+    parse_scpd
+from circuits.core.events import Event
 from six.moves import http_client
-from xml.etree.ElementTree import XML
 from six.moves.urllib.parse import urljoin
 from copy import copy
-from six.moves import filter
+from heapq import heappush, heappop, heapify
+from bisect import bisect_left, insort
+from collections import deque, namedtuple, OrderedDict
+from six.moves.urllib.parse import urlparse
+import weakref
+import hashlib
+import logging
+import time
+import json
+import dbm
+import os
 
 class UPnPDeviceDirectory(BaseComponent):
+    """
+    This component keeps track of the UPnP root devices in the network.
+    
+    If a *path* is given, the parsed device descriptions are kept
+    in a database in this directory. Descriptions of devices that
+    announce a configuration id are then taken from the database
+    as long as the configuration id doesn't change.
+    """
 
     channel = "upnp"
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, path=None, *args, **kwargs):
         super(UPnPDeviceDirectory, self).__init__(*args, **kwargs)
+        # Device descriptions are fetched using a common pool, else
+        # we'd open a connection for every device that answers our
+        # initial search request at once.
+        self._fetch_pool = HTTPClientPool(channel="upnp-fetch",
+                                          max_connections=8,
+                                          retries=3).register(self)
+        self._scpd_cache = SCPDCache(self._fetch_pool).register(self)
+        # Created when needed, runs its own HTTP server
+        self._subscriber = None
+        # Expiry times of the root devices indexed by USN, and a heap
+        # with (expiry time, USN) for finding the expired devices. 
+        # Entries in the heap that don't match the expiry time in the
+        # index are outdated and simply dropped.
+        self._expiry = dict()
+        self._expiry_heap = []
+        # All root devices indexed by USN, and the index of the 
+        # devices that have been initialized
+        self._root_devices = dict()
+        self._index = DeviceIndex()
+        self._description_db = None
+        if path is not None:
+            db_path = os.path.join(path, 'upnp_descriptions')
+            try:
+                self._description_db = dbm.open(db_path, 'c')
+            except:
+                self.fire(Log(logging.WARN, "Could not determine type db "
+                              "type of " + db_path), "logger")
+                try:
+                    os.remove(db_path)
+                    self._description_db = dbm.open(db_path, 'c')
+                except:
+                    self.fire(Log(logging.WARN, "Giving up on " + db_path),
+                              "logger")
 
     @handler("started", channel="application")
     def _on_started(self, component):
         self.fire(UPnPSearchRequest(), "ssdp")
 
+    @handler("stopped", channel="*", priority=100)
+    def _on_stopped(self, component):
+        if self._description_db is not None:
+            self._description_db.close()
+            self._description_db = None
+
     @handler("upnp_device_alive", channel="*")
     def _on_device_alive \
-        (self, location, notification_type, max_age, server, usn):
-        if notification_type == UPNP_ROOTDEVICE:
-            if not any([isinstance(c, UPnPRootDevice) \
-                           and c.usn == usn for c in self.components.copy()]):
-                UPnPRootDevice(location, max_age, usn).register(self)
+        (self, location, notification_type, max_age, server, usn,
+         config_id=None):
+        if notification_type != UPNP_ROOTDEVICE:
+            return
+        self._set_expiry(usn, max_age)
+        device = self._root_devices.get(usn)
+        if device is None:
+            device = UPnPRootDevice(location, usn, config_id).register(self)
+            self._root_devices[usn] = device
+        elif config_id is None or config_id == device.config_id:
+            return
+        device.config_id = config_id
+        description = self._cached_description(device.udn, config_id)
+        if description is not None:
+            device._initialize(description)
+        else:
+            self._fetch_pool.submit("GET", location, channel=usn)
+
+    @handler("upnp_device_bye_bye", channel="*")
+    def _on_device_bye_bye(self, usn):
+        self._expiry.pop(usn, None)
+
+    def _set_expiry(self, usn, max_age):
+        expiry = time.time() + max_age
+        self._expiry[usn] = expiry
+        heappush(self._expiry_heap, (expiry, usn))
+        # Drop outdated entries if they make up most of the heap
+        if len(self._expiry_heap) > 4 * len(self._expiry) + 64:
+            self._expiry_heap = [(e, u) for e, u in self._expiry_heap
+                                 if self._expiry.get(u) == e]
+            heapify(self._expiry_heap)
+
+    @handler("generate_events")
+    def _on_generate_events(self, event):
+        if len(self._expiry_heap) == 0:
+            return
+        now = time.time()
+        expired = []
+        while len(self._expiry_heap) > 0 and self._expiry_heap[0][0] <= now:
+            expiry, usn = heappop(self._expiry_heap)
+            if self._expiry.get(usn) == expiry:
+                del self._expiry[usn]
+                expired.append(usn)
+        for usn in expired:
+            self.fire(UPnPDeviceByeBye(usn))
+        if len(self._expiry_heap) > 0:
+            event.reduce_time_left(self._expiry_heap[0][0] - now)
+
+    def valid_until(self, usn):
+        """
+        Returns the time when the device with the given USN expires
+        unless it is announced again.
+        """
+        return self._expiry.get(usn)
+
+    def _device_ready(self, device):
+        self._index.add(device)
+
+    def _device_removed(self, device):
+        if self._root_devices.get(device.usn) is device:
+            del self._root_devices[device.usn]
+        self._index.remove(device)
+        self._scpd_cache.forget(device.usn)
+
+    def _cached_description(self, udn, config_id):
+        if self._description_db is None or config_id is None:
+            return None
+        try:
+            entry = json.loads(self._description_db[udn])
+            if entry.get("config_id") != config_id:
+                return None
+            return DeviceDescription.from_data(entry["description"])
+        except KeyError:
+            return None
+        except (ValueError, TypeError):
+            del self._description_db[udn]
+            return None
+
+    def _cache_description(self, udn, config_id, description):
+        if self._description_db is None or config_id is None:
+            return
+        self._description_db[udn] = json.dumps \
+            ({ "config_id": config_id, 
+               "description": description.to_data() })
 
     def register(self, parent):
         super(UPnPDeviceDirectory, self).register(parent)
@@ -60,9 +198,374 @@ class UPnPDeviceDirectory(BaseComponent):
         return self
 
     @property
+    def fetch_pool(self):
+        return self._fetch_pool
+
+    @property
+    def index(self):
+        """
+        The :class:`DeviceIndex` with the root devices that have been
+        initialized.
+        """
+        return self._index
+
+    @property
+    def devices(self):
+        """
+        The root devices that have been initialized, sorted by 
+        friendly name.
+        """
+        return self._index.devices()
+
+    def change_feed(self):
+        """
+        Returns a new :class:`DeviceChangeFeed`.
+        """
+        return self._index.change_feed()
+
+    def scpd(self, device, service, channel):
+        """
+        Returns the :class:`cocy.upnp.description.SCPD` of the given
+        service of the device if it is available from the cache. Else
+        the SCPD is retrieved and a :class:`SCPDAvailable` 
+        (or :class:`SCPDFailed`) event is fired on *channel* later.
+        """
+        return self._scpd_cache.get(device, service, channel)
+
+    @property
+    def scpd_cache(self):
+        return self._scpd_cache
+
+    def subscribe(self, device, service, channel):
+        """
+        Subscribes to the events of the given service of the device.
+        See :meth:`cocy.upnp.gena.GENASubscriber.subscribe`.
+        """
+        return self.subscriber.subscribe(device, service, channel)
+
+    def unsubscribe(self, subscription):
+        self.subscriber.unsubscribe(subscription)
+
+    @property
+    def subscriber(self):
+        if self._subscriber is None:
+            self._subscriber = GENASubscriber().register(self)
+        return self._subscriber
+
+
+class SCPDAvailable(Event):
+    """
+    Fired when a requested service description has become available.
+    """
+    name = "scpd_available"
+
+    def __init__(self, usn, service_id, scpd):
+        super(SCPDAvailable, self).__init__(usn, service_id, scpd)
+
+
+class SCPDFailed(Event):
+    """
+    Fired when a requested service description could not be retrieved.
+    """
+    name = "scpd_failed"
+
+    def __init__(self, usn, service_id, error):
+        super(SCPDFailed, self).__init__(usn, service_id, error)
+
+
+class SCPDCache(BaseComponent):
+    """
+    Retrieves service descriptions (SCPDs) on demand and caches
+    them. SCPDs are cached with the absolute SCPD URL and the
+    configuration id announced by the device as key, so a new
+    configuration causes the SCPD to be retrieved again. The entries
+    of a device are dropped when the device is removed from the
+    directory. Retrieved SCPDs are only parsed if no SCPD with the
+    same content has been parsed before, so devices of the same
+    kind share the parsed SCPD.
+    """
+
+    channel = "upnp-scpd"
+
+    def __init__(self, fetch_pool, channel=channel, max_entries=256):
+        super(SCPDCache, self).__init__(channel=channel)
+        self._fetch_pool = fetch_pool
+        self._max_entries = max_entries
+        self._by_key = OrderedDict()
+        self._by_digest = OrderedDict()
+        # Requests in progress with their waiters, indexed by key
+        self._pending = dict()
+        # The keys used for a device, indexed by USN
+        self._keys = dict()
+        self._fetched = 0
+        self._parsed = 0
+
+    def get(self, device, service, channel):
+        key = self._key(device, service)
+        scpd = self._lookup(self._by_key, key)
+        if scpd is not None:
+            return scpd
+        self._keys.setdefault(device.usn, set()).add(key)
+        waiter = (device.usn, service.service_id, channel)
+        if key in self._pending:
+            self._pending[key].append(waiter)
+            return None
+        self._pending[key] = [waiter]
+        self._fetch_pool.submit("GET", key[0], channel=self.channel, tag=key)
+        return None
+
+    def _key(self, device, service):
+        return (device.url(service.scpd_url), device.config_id)
+
+    def forget(self, usn):
+        """
+        Drops the SCPDs retrieved for the device with the given USN.
+        Called by the directory when the device has left the network
+        or has expired.
+        """
+        for key in self._keys.pop(usn, ()):
+            self._by_key.pop(key, None)
+
+    def _lookup(self, cache, key):
+        value = cache.pop(key, None)
+        if value is not None:
+            cache[key] = value
+        return value
+
+    def _store(self, cache, key, value):
+        cache.pop(key, None)
+        cache[key] = value
+        while len(cache) > self._max_entries:
+            cache.popitem(last=False)
+
+    @handler("pooled_response")
+    def _on_pooled_response(self, key, response):
+        if key not in self._pending:
+            return
+        waiters = self._pending.pop(key)
+        if response.status != http_client.OK:
+            for usn, service_id, channel in waiters:
+                self.fire(SCPDFailed(usn, service_id, response.status),
+                          channel)
+            return
+        self._fetched += 1
+        body = response.read()
+        digest = hashlib.sha1(body).digest()
+        scpd = self._lookup(self._by_digest, digest)
+        if scpd is None:
+            try:
+                scpd = parse_scpd(body)
+            except Exception as error:
+                for usn, service_id, channel in waiters:
+                    self.fire(SCPDFailed(usn, service_id, error), channel)
+                return
+            self._parsed += 1
+            self._store(self._by_digest, digest, scpd)
+        self._store(self._by_key, key, scpd)
+        for usn, service_id, channel in waiters:
+            self.fire(SCPDAvailable(usn, service_id, scpd), channel)
+
+    @handler("pooled_request_failed")
+    def _on_pooled_request_failed(self, key, error):
+        if key not in self._pending:
+            return
+        waiters = self._pending.pop(key)
+        for usn, service_id, channel in waiters:
+            self.fire(SCPDFailed(usn, service_id, error), channel)
+
+    @property
+    def fetched(self):
+        """The number of SCPDs retrieved."""
+        return self._fetched
+
+    @property
+    def parsed(self):
+        """The number of SCPDs parsed."""
+        return self._parsed
+
+
+DeviceChange = namedtuple("DeviceChange", "kind device")
+"""
+A change of the directory's content. *kind* is one of "added",
+"updated" or "removed".
+"""
+
+
+class DeviceChangeFeed(object):
+    """
+    Collects the changes of a :class:`DeviceIndex` that happen
+    after its creation. Iterating over the feed yields (and consumes)
+    the :class:`DeviceChange` instances collected since the last
+    iteration.
+
+    At most *max_changes* changes are kept. If more changes occur
+    before they are consumed, the oldest changes are dropped and
+    :attr:`overflowed` is set. The consumer should then reset it
+    and re-read the complete index.
+    """
+
+    def __init__(self, max_changes=1024):
+        self._changes = deque(maxlen=max_changes)
+        self.overflowed = False
+
+    def _append(self, change):
+        if len(self._changes) == self._changes.maxlen:
+            self.overflowed = True
+        self._changes.append(change)
+
+    def __len__(self):
+        return len(self._changes)
+
+    def __iter__(self):
+        while len(self._changes) > 0:
+            yield self._changes.popleft()
+
+
+class DeviceIndex(object):
+    """
+    An index of root devices that supports looking up devices by USN,
+    UDN (of the root device or any embedded device), device type, 
+    service type, friendly name prefix and location host. Types
+    must match exactly.
+    """
+
+    def __init__(self):
+        self._by_usn = dict()
+        self._by_udn = dict()
+        self._by_device_type = dict()
+        self._by_service_type = dict()
+        self._by_host = dict()
+        # (lower case friendly name, USN), sorted
+        self._names = []
+        # The keys used for a device, indexed by USN
+        self._keys = dict()
+        self._feeds = weakref.WeakSet()
+
+    def add(self, device):
+        """
+        Add the device to the index or update its entries. 
+        """
+        usn = device.usn
+        if usn in self._by_usn:
+            self._remove_keys(usn)
+            kind = "updated"
+        else:
+            kind = "added"
+        description = device.description or DeviceDescription()
+        udns = set([usn.split("::")[0]] 
+                   + [d.udn for d in description.all_devices()
+                      if d.udn is not None])
+        device_types = set([d.device_type 
+                            for d in description.all_devices()])
+        service_types = set([s.service_type 
+                             for s in description.all_services()])
+        host = urlparse(device.location).hostname
+        name = ((device.friendly_name or "").lower(), usn)
+        self._by_usn[usn] = device
+        for udn in udns:
+            self._by_udn[udn] = device
+        for device_type in device_types:
+            self._by_device_type.setdefault(device_type, set()).add(usn)
+        for service_type in service_types:
+            self._by_service_type.setdefault(service_type, set()).add(usn)
+        self._by_host.setdefault(host, set()).add(usn)
+        insort(self._names, name)
+        self._keys[usn] = (udns, device_types, service_types, host, name)
+        self._notify(kind, device)
+
+    def remove(self, device):
+        """
+        Remove the device from the index.
+        """
+        if self._by_usn.get(device.usn) is not device:
+            return
+        self._remove_keys(device.usn)
+        del self._by_usn[device.usn]
+        self._notify("removed", device)
+
+    def _remove_keys(self, usn):
+        udns, device_types, service_types, host, name = self._keys.pop(usn)
+        device = self._by_usn[usn]
+        for udn in udns:
+            # An embedded device may have moved to another root device
+            if self._by_udn.get(udn) is device:
+                del self._by_udn[udn]
+        for key, index in [(t, self._by_device_type) for t in device_types] \
+            + [(t, self._by_service_type) for t in service_types] \
+            + [(host, self._by_host)]:
+            usns = index[key]
+            usns.discard(usn)
+            if len(usns) == 0:
+                del index[key]
+        del self._names[bisect_left(self._names, name)]
+
+    def _notify(self, kind, device):
+        change = DeviceChange(kind, device)
+        for feed in self._feeds:
+            feed._append(change)
+
+    def change_feed(self, max_changes=1024):
+        """
+        Returns a new :class:`DeviceChangeFeed` for this index. The
+        index keeps only a weak reference to the feed, so 
+        unsubscribing is done by dropping the feed.
+        """
+        feed = DeviceChangeFeed(max_changes)
+        self._feeds.add(feed)
+        return feed
+
+    def __len__(self):
+        return len(self._by_usn)
+
+    def __contains__(self, usn):
+        return usn in self._by_usn
+
     def devices(self):
-        return filter(lambda c: isinstance(c, UPnPRootDevice) \
-                      and c.ready, self.components.copy())
+        """
+        Returns all devices, sorted by friendly name.
+        """
+        return [self._by_usn[usn] for name, usn in self._names]
+
+    def by_usn(self, usn):
+        return self._by_usn.get(usn)
+
+    def by_udn(self, udn):
+        return self._by_udn.get(udn)
+
+    def by_device_type(self, device_type):
+        return [self._by_usn[usn] 
+                for usn in self._by_device_type.get(device_type, ())]
+
+    def by_service_type(self, service_type):
+        return [self._by_usn[usn] 
+                for usn in self._by_service_type.get(service_type, ())]
+
+    def services_by_type(self, service_type):
+        """
+        Returns all services of the given type as a list of
+        (root device, :class:`cocy.upnp.description.ServiceDescription`).
+        """
+        return [(device, service) 
+                for device in self.by_service_type(service_type)
+                for service in device.description.all_services()
+                if service.service_type == service_type]
+
+    def by_host(self, host):
+        return [self._by_usn[usn] for usn in self._by_host.get(host, ())]
+
+    def by_name_prefix(self, prefix):
+        """
+        Returns the devices with a friendly name that starts with
+        the given prefix (compared case-insensitively), sorted by 
+        friendly name.
+        """
+        prefix = prefix.lower()
+        result = []
+        for name, usn in self._names[bisect_left(self._names, (prefix,)):]:
+            if not name.startswith(prefix):
+                break
+            result.append(self._by_usn[usn])
+        return result
 
 
 class IconInfo(object):
@@ -74,59 +577,66 @@ class IconInfo(object):
 
 class UPnPRootDevice(BaseComponent):
 
-    def __init__(self, location, max_age, usn):
+    def __init__(self, location, usn, config_id=None):
         super(UPnPRootDevice, self).__init__(channel=usn)
         self._location = location
         self._usn = usn
+        self.config_id = config_id
         self._ready = False
-        self._comm_chan = "client." + usn
-        self._client = Client(location, channel=self._comm_chan).register(self)
-        @handler("response", channel=self._comm_chan)
-        def _on_response(self, response):
-            if response.status == http_client.OK:
-                self._initialize(response.read())
-        self.addHandler(_on_response)
-        @handler("error", channel=self._comm_chan)
-        def _on_error(self, *args, **kwargs):
-            self._client.close()
-            self.unregister()
-        self.addHandler(_on_error)
-        self.fire(Request("GET", self._location), self._client)
-        self._expiry_timer \
-            = Timer(max_age, UPnPDeviceByeBye(usn)).register(self)
-
-    def _initialize(self, xml_src):
-        data = XML(xml_src)
-        self._friendly_name = data.findtext \
-            ("{%s}device/{%s}friendlyName" \
-             % (SSDP_DEVICE_SCHEMA, SSDP_DEVICE_SCHEMA))
-        icons = data.findall \
-            ("{%s}device/{%s}iconList/{%s}icon" \
-             % (SSDP_DEVICE_SCHEMA, SSDP_DEVICE_SCHEMA, SSDP_DEVICE_SCHEMA))
-        self._icons = []
-        for icon in icons:
-            width = int(icon.findtext("{%s}width" % SSDP_DEVICE_SCHEMA))
-            height = int(icon.findtext("{%s}height" % SSDP_DEVICE_SCHEMA))
-            url = urljoin(self._location,
-                          icon.findtext("{%s}url" % SSDP_DEVICE_SCHEMA))
-            self._icons.append(IconInfo(width, height, url))
+        self._directory = None
+
+    def register(self, parent):
+        super(UPnPRootDevice, self).register(parent)
+        if isinstance(parent, UPnPDeviceDirectory):
+            self._directory = parent
+        return self
+
+    def _initialize(self, description):
+        self._description = description
+        self._friendly_name = description.friendly_name
+        self._icons = [IconInfo(icon.width, icon.height, self.url(icon.url))
+                       for icon in description.icons]
         self._ready = True
+        if self._directory is not None:
+            self._directory._device_ready(self)
 
-    @handler("upnp_device_alive")
-    def _on_device_alive \
-        (self, location, notification_type, max_age, server, usn):
-        self._expiry_timer.interval = max_age
-        self._expiry_timer.reset()
+    def _remove(self):
+        if self._directory is not None:
+            self._directory._device_removed(self)
+        self.unregister()
+
+    @handler("pooled_response")
+    def _on_pooled_response(self, tag, response):
+        if response.status != http_client.OK:
+            self._remove()
+            return
+        try:
+            description = parse_description(response.read())
+        except Exception:
+            self._remove()
+            return
+        self._initialize(description)
+        if self._directory is not None:
+            self._directory._cache_description \
+                (self.udn, self.config_id, description)
+
+    @handler("pooled_request_failed")
+    def _on_pooled_request_failed(self, tag, error):
+        self._remove()
 
     @handler("upnp_device_bye_bye")
     def _on_device_bye_bye (self, usn):
-        self._client.close()
-        self.unregister()
+        self._remove()
 
     @property
     def usn(self):
         return getattr(self, "_usn", None)
         
+    @property
+    def udn(self):
+        usn = getattr(self, "_usn", None)
+        return usn.split("::")[0] if usn is not None else None
+
     @property
     def location(self):
         return getattr(self, "_location", None)
@@ -143,8 +653,26 @@ class UPnPRootDevice(BaseComponent):
     def icons(self):
         return copy(getattr(self, "_icons", None))
     
+    @property
+    def description(self):
+        """
+        The :class:`cocy.upnp.description.DeviceDescription` of the
+        root device.
+        """
+        return getattr(self, "_description", None)
+
+    def url(self, url):
+        """
+        Returns the absolute URL for a URL from the description.
+        """
+        description = getattr(self, "_description", None)
+        return urljoin(description.url_base 
+                       if description is not None and description.url_base
+                       else self._location, url)
+
     @property
     def valid_until(self):
-        return self._expiry_timer._eTime \
-            if hasattr(self, "_expiry_timer") else None
-        
\ No newline at end of file
+        if self._directory is None:
+            return None
+        return self._directory.valid_until(self._usn)
+        
@@ -26,7 +26,8 @@ from circuits.web.controllers import BaseController, expose
 from circuits.core.events import Event
 from circuits.core.utils import findroot, flatten
 from cocy.upnp.service import UPnPService
-from cocy.upnp.ssdp import SSDPTranceiver
+from cocy.upnp.ssdp import SSDPTranceiver, SearchTargetIndex, UPnPDeviceMatch
+from cocy.upnp.http_pool import HTTPClientPool
 from cocy.providers import Provider
 import dbm
 import os
@@ -34,7 +35,7 @@ from xml.etree.ElementTree import Element, QName, SubElement
 from cocy.upnp import UPNP_CONTROL_NS
 from circuits.web.errors import HTTPError
 from cocy.soaplib import ns_soap_env
-from cocy.misc import buildSoapResponse
+from cocy.misc import serializeSoapEnvelope
 import logging
 from circuits_bricks.app.logger import Log
 
@@ -56,6 +57,11 @@ class UPnPDeviceServer(BaseComponent):
     Notifications are sent when a new device is added 
     (:class:`cocy.upnp.ssdp.DeviceAvailable`) or removed
     (:class:`cocy.upnp.ssdp.DeviceUnavailable`)
+    
+    The devices are also kept in a :class:`cocy.upnp.ssdp.SearchTargetIndex`
+    that is used to answer M-SEARCH requests. A device is removed from
+    the index (and announced as unavailable) as soon as its provider 
+    is unregistered, so that no responses are sent for it afterwards.
     """
     channel = "upnp"
     
@@ -73,8 +79,17 @@ class UPnPDeviceServer(BaseComponent):
         # from failing.
         DummyRoot().register(disp)
         
+        # Pool used by all subscriptions to deliver event messages. 
+        # Subscriptions fail over to their other callback URLs
+        # instead of retrying.
+        self.notify_pool = HTTPClientPool \
+            (channel="upnp-notify", max_connections=16, retries=0, 
+             timeout=10).register(self)
+
         # Initially empty list of providers
         self._devices = []
+        # Index used to answer M-SEARCH requests
+        self._search_index = SearchTargetIndex()
         
         # The configuration id, incremented every time the 
         # configuration changes
@@ -116,14 +131,34 @@ class UPnPDeviceServer(BaseComponent):
             return
         device.register(self)
         self._devices.append(device)
+        self._search_index.add(device)
         if self._started:
             self.fireEvent(DeviceAvailable(device))
 
-    @handler("unregister")
+    @handler("unregister", channel="*")
     def _on_unregister(self, component, manager):
+        """
+        Removes the devices of a provider that is unregistered. They
+        are dropped from the search index, announced as unavailable
+        (if the server has been started) and unregistered.
+        """
         if not isinstance(component, Provider):
             return
-        
+        for device in [d for d in self._devices if d.provider == component]:
+            self._devices.remove(device)
+            self._search_index.remove(device)
+            if self._started:
+                self.fireEvent(DeviceUnavailable(device))
+            device.unregister()
+
+    @handler("upnp_device_search")
+    def _on_device_search(self, inquirer, search_target, mx=0, interface=None):
+        if not self._started:
+            return
+        responses = self._search_index.resolve(search_target)
+        if len(responses) > 0:
+            self.fire(UPnPDeviceMatch(responses, inquirer, search_target, 
+                                      mx, interface), "ssdp")
 
     @handler("started", channel="application")
     def _on_started (self, component):
@@ -148,6 +183,10 @@ class UPnPDeviceServer(BaseComponent):
 
 
 class UPnPError(HTTPError):
+    """
+    The SOAP fault returned for a failed action. The serialized fault
+    bodies are cached for every (error code, description) pair.
+    """
 
     _error_descs = { 401: "Invalid Action",
                      402: "Invalid Args",
@@ -158,11 +197,25 @@ class UPnPError(HTTPError):
                      603: "Out of Memory",
                      604: "Human Intervention Required",
                      605: "String Argument Too Long"}
+    # Serialized faults indexed by (error code, description)
+    _faults = dict()
+    _max_faults = 256
     
     def __init__(self, request, response, error_code, error_desc = None):
         super(UPnPError, self).__init__(request, response, 500)
+        self.response.headers["Content-Type"] = "text/xml; charset=utf-8"
+        self._fault = self.fault(error_code, error_desc)
+    
+    @classmethod
+    def fault(cls, error_code, error_desc=None):
+        """
+        Returns the serialized SOAP fault for the given error.
+        """
         if error_desc is None:
-            error_desc = self._error_descs.get(error_code, "Unknown")
+            error_desc = cls._error_descs.get(error_code, "Unknown")
+        fault = cls._faults.get((error_code, error_desc))
+        if fault is not None:
+            return fault
         result = Element(QName(ns_soap_env, "Fault"))
         SubElement(result, QName(ns_soap_env, "faultcode")).text \
             = str(QName(ns_soap_env, "Client"))
@@ -174,11 +227,20 @@ class UPnPError(HTTPError):
             = str(error_code)
         SubElement(upnp_error, QName(UPNP_CONTROL_NS, "errorDescription")) \
             .text = error_desc
-        self._fault = buildSoapResponse(self.response, result)
+        fault = serializeSoapEnvelope(result)
+        # Descriptions may be arbitrary, don't let the cache grow unbounded
+        if len(cls._faults) < cls._max_faults:
+            cls._faults[(error_code, error_desc)] = fault
+        return fault
     
     def __str__(self):
         return self._fault 
 
+# Pre-warm the cache with the standard errors
+for error_code in UPnPError._error_descs:
+    UPnPError.fault(error_code)
+del error_code
+
 
 class DummyRoot(BaseController):
     
@@ -0,0 +1,392 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.core.events import Event
+from circuits.web.servers import BaseServer
+from circuits.web.controllers import BaseController, expose
+from circuits_bricks.web import ScopeDispatcher, ScopedChannel
+from circuits_bricks.app.logger import Log
+from cocy.upnp.http_pool import HTTPClientPool
+from cocy.upnp import UPNP_EVENT_NS, SSDP_PORT
+from xml.etree.ElementTree import XML
+from six.moves.urllib.parse import urlparse
+from six.moves import http_client
+from collections import OrderedDict, deque
+from heapq import heappush, heappop
+from itertools import count
+import logging
+import socket
+import time
+
+class PropertiesChanged(Event):
+    """
+    Fired on the subscriber's channel when an event message has been
+    received for a subscription. *properties* is an ordered dict
+    that maps the names of the state variables to their values.
+    The value of a ``LastChange`` variable is decoded
+    (see :func:`parse_last_change`).
+    """
+    name = "properties_changed"
+
+    def __init__(self, subscription, properties):
+        super(PropertiesChanged, self).__init__(subscription, properties)
+
+
+class SubscriptionFailed(Event):
+    """
+    Fired on the subscriber's channel when a subscription could not
+    be established or renewed.
+    """
+    name = "subscription_failed"
+
+    def __init__(self, subscription, error):
+        super(SubscriptionFailed, self).__init__(subscription, error)
+
+
+def _local_name(tag):
+    return tag[tag.index("}") + 1:] if tag.startswith("{") else tag
+
+def parse_propertyset(body):
+    """
+    Returns the properties from a GENA event message as an ordered
+    dict.
+    """
+    result = OrderedDict()
+    for prop in XML(body).findall("{%s}property" % UPNP_EVENT_NS):
+        for var in prop:
+            result[_local_name(var.tag)] = var.text or ""
+    return result
+
+def parse_last_change(text):
+    """
+    Decodes the value of a ``LastChange`` state variable. Returns a
+    dict that maps the instance ids to ordered dicts with the changed
+    variables and their values.
+    """
+    result = dict()
+    for instance in XML(text.encode("utf-8")
+                        if not isinstance(text, bytes) else text):
+        changes = result.setdefault(instance.get("val"), OrderedDict())
+        for var in instance:
+            changes[_local_name(var.tag)] = var.get("val")
+    return result
+
+
+class GENASubscription(object):
+    """
+    A subscription for the events of a remote service. :attr:`sid` is
+    ``None`` until the subscription has been confirmed.
+    """
+
+    __slots__ = ("device", "service", "channel", "sid", "expires",
+                 "renew_at", "seq", "active")
+
+    def __init__(self, device, service, channel):
+        self.device = device
+        self.service = service
+        self.channel = channel
+        self.sid = None
+        self.expires = None
+        self.renew_at = None
+        self.seq = None
+        self.active = True
+
+
+class _NotifyController(BaseController):
+
+    channel = ScopedChannel("upnp-gena", "/")
+
+    def __init__(self, subscriber):
+        super(_NotifyController, self).__init__()
+        self._subscriber = subscriber
+
+    @expose("notify")
+    def notify(self, *args):
+        if self.request.method != "NOTIFY":
+            self.response.status = http_client.METHOD_NOT_ALLOWED
+            return ""
+        headers = self.request.headers
+        if headers.get("NT") != "upnp:event" \
+            or headers.get("NTS") != "upnp:propchange":
+            self.response.status = http_client.PRECONDITION_FAILED
+            return ""
+        try:
+            seq = int(headers.get("SEQ"))
+        except (TypeError, ValueError):
+            seq = None
+        if not self._subscriber._on_notify_received \
+            (headers.get("SID"), seq, self.request.body.read()):
+            self.response.status = http_client.PRECONDITION_FAILED
+        return ""
+
+
+class GENASubscriber(BaseComponent):
+    """
+    This component subscribes to the events of remote services and
+    receives the event messages with its own HTTP server.
+
+    Subscriptions are renewed by a single scheduler. When the first
+    subscription is due for renewal, all subscriptions that become
+    due within the next *renewal_window* seconds are renewed as well,
+    so renewals are sent in batches.
+
+    An event message may arrive before the response to the
+    subscription request has been handled. Event messages for
+    unknown SIDs are therefore kept while subscriptions are pending
+    (at most *max_early* messages for at most *max_early* SIDs) and
+    delivered once the SID is known.
+    """
+
+    channel = "upnp-subscriber"
+
+    def __init__(self, channel=channel, timeout=1800, renewal_window=60,
+                 max_early=16):
+        super(GENASubscriber, self).__init__(channel=channel)
+        self._timeout = timeout
+        self._renewal_window = renewal_window
+        self._pool = HTTPClientPool(channel=channel + "-pool",
+                                    max_connections=8).register(self)
+        self._server = BaseServer(("", 0), channel="upnp-gena") \
+            .register(self)
+        ScopeDispatcher(channel="upnp-gena").register(self._server)
+        _NotifyController(self).register(self)
+        # Confirmed subscriptions indexed by SID
+        self._subscriptions = dict()
+        # All subscriptions that are active
+        self._active = set()
+        # Subscriptions waiting for their SID, and the event messages
+        # received for unknown SIDs meanwhile, as queues of (seq, body)
+        # indexed by SID
+        self._unconfirmed = set()
+        self._early = OrderedDict()
+        self._max_early = max_early
+        # Heap with (renewal time, seq, subscription)
+        self._renewals = []
+        self._sequence = count()
+        self._local_addresses = dict()
+        self._renewed = 0
+
+    def subscribe(self, device, service, channel):
+        """
+        Subscribe to the events of the *service* (a
+        :class:`cocy.upnp.description.ServiceDescription`) of the
+        *device*. Returns a :class:`GENASubscription`. The events are
+        reported by firing :class:`PropertiesChanged` on *channel*.
+        """
+        subscription = GENASubscription(device, service, channel)
+        self._active.add(subscription)
+        self._send_subscribe(subscription)
+        return subscription
+
+    def _send_subscribe(self, subscription):
+        self._unconfirmed.add(subscription)
+        url = subscription.device.url(subscription.service.event_sub_url)
+        self._pool.submit \
+            ("SUBSCRIBE", url, channel=self.channel,
+             tag=("subscribe", subscription),
+             headers={ "CALLBACK": "<%s>" % self._callback_url(url),
+                       "NT": "upnp:event",
+                       "TIMEOUT": "Second-%d" % self._timeout })
+
+    def unsubscribe(self, subscription):
+        if not subscription.active:
+            return
+        subscription.active = False
+        self._active.discard(subscription)
+        if subscription.sid is None:
+            self._settled(subscription)
+            return
+        del self._subscriptions[subscription.sid]
+        self._pool.submit \
+            ("UNSUBSCRIBE", subscription.device.url
+             (subscription.service.event_sub_url), channel=self.channel,
+             tag=("unsubscribe", subscription), retries=0,
+             headers={ "SID": subscription.sid })
+
+    @handler("upnp_device_bye_bye", channel="*")
+    def _on_device_bye_bye(self, usn):
+        for subscription in [s for s in self._active
+                             if s.device.usn == usn]:
+            subscription.active = False
+            self._active.discard(subscription)
+            if subscription.sid is not None:
+                del self._subscriptions[subscription.sid]
+            else:
+                self._settled(subscription)
+
+    def _callback_url(self, url):
+        host = urlparse(url).hostname
+        address = self._local_addresses.get(host)
+        if address is None:
+            # Find the address of the interface used to reach the host
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                sock.connect((host, SSDP_PORT))
+                address = sock.getsockname()[0]
+            finally:
+                sock.close()
+            self._local_addresses[host] = address
+        return "http://%s:%d/notify" % (address, self._server.port)
+
+    def _renew(self, subscription):
+        self._renewed += 1
+        self._pool.submit \
+            ("SUBSCRIBE", subscription.device.url
+             (subscription.service.event_sub_url), channel=self.channel,
+             tag=("renew", subscription),
+             headers={ "SID": subscription.sid,
+                       "TIMEOUT": "Second-%d" % self._timeout })
+
+    def _schedule_renewal(self, subscription, timeout):
+        now = time.time()
+        subscription.expires = now + timeout
+        # Renew when 80% of the time has passed, but at least
+        # the renewal window before expiry. Short timeouts are
+        # renewed when half of the time has passed, else we'd 
+        # renew again immediately.
+        subscription.renew_at = now + max(min(timeout * 0.8, timeout
+                                              - self._renewal_window),
+                                          timeout * 0.5)
+        heappush(self._renewals, (subscription.renew_at,
+                                  next(self._sequence), subscription))
+
+    @handler("generate_events")
+    def _on_generate_events(self, event):
+        if len(self._renewals) == 0:
+            return
+        now = time.time()
+        if self._renewals[0][0] <= now:
+            # Renew all that become due within the window
+            limit = now + self._renewal_window
+            while len(self._renewals) > 0 and self._renewals[0][0] <= limit:
+                renew_at, seq, subscription = heappop(self._renewals)
+                # Skip outdated entries
+                if not subscription.active \
+                    or subscription.renew_at != renew_at:
+                    continue
+                subscription.renew_at = None
+                self._renew(subscription)
+        if len(self._renewals) > 0:
+            event.reduce_time_left(self._renewals[0][0] - now)
+
+    @handler("pooled_response")
+    def _on_pooled_response(self, tag, response):
+        kind, subscription = tag
+        if kind == "unsubscribe" or not subscription.active:
+            return
+        if response.status != http_client.OK:
+            if kind == "renew" \
+                and response.status == http_client.PRECONDITION_FAILED:
+                # Subscription has been lost, subscribe again
+                self._subscriptions.pop(subscription.sid, None)
+                subscription.sid = None
+                subscription.seq = None
+                self._send_subscribe(subscription)
+                return
+            self._failed(subscription, response.status)
+            return
+        early = ()
+        if kind == "subscribe":
+            subscription.sid = response.headers.get("SID")
+            if subscription.sid is None:
+                self._failed(subscription, "No SID")
+                return
+            self._subscriptions[subscription.sid] = subscription
+            early = self._early.pop(subscription.sid, ())
+            self._settled(subscription)
+        timeout = response.headers.get("TIMEOUT", "")
+        try:
+            timeout = int(timeout[len("Second-"):])
+        except ValueError:
+            # "Second-infinite" or missing
+            timeout = self._timeout
+        self._schedule_renewal(subscription, timeout)
+        for seq, body in early:
+            self._on_notify(subscription, seq, body)
+
+    def _settled(self, subscription):
+        self._unconfirmed.discard(subscription)
+        if len(self._unconfirmed) == 0:
+            # Nobody waits for these any more
+            self._early.clear()
+
+    @handler("pooled_request_failed")
+    def _on_pooled_request_failed(self, tag, error):
+        kind, subscription = tag
+        if kind == "unsubscribe" or not subscription.active:
+            return
+        self._failed(subscription, error)
+
+    def _failed(self, subscription, error):
+        subscription.active = False
+        self._active.discard(subscription)
+        if subscription.sid is not None:
+            self._subscriptions.pop(subscription.sid, None)
+        else:
+            self._settled(subscription)
+        self.fire(SubscriptionFailed(subscription, error),
+                  subscription.channel)
+
+    def _on_notify_received(self, sid, seq, body):
+        """
+        Called by the controller for every event message. Returns
+        ``False`` if the message is to be rejected.
+        """
+        subscription = self._subscriptions.get(sid)
+        if subscription is not None:
+            self._on_notify(subscription, seq, body)
+            return True
+        if sid is None or len(self._unconfirmed) == 0:
+            return False
+        if sid not in self._early and len(self._early) >= self._max_early:
+            self._early.popitem(last=False)
+        self._early.setdefault(sid, deque(maxlen=self._max_early)) \
+            .append((seq, body))
+        return True
+
+    def _on_notify(self, subscription, seq, body):
+        if subscription.seq is not None and seq is not None \
+            and seq != subscription.seq + 1 and seq != 0:
+            self.fire(Log(logging.DEBUG, "Missed events for "
+                          + subscription.sid), "logger")
+        subscription.seq = seq
+        try:
+            properties = parse_propertyset(body)
+            if "LastChange" in properties:
+                properties["LastChange"] \
+                    = parse_last_change(properties["LastChange"])
+        except Exception as error:
+            self.fire(Log(logging.WARN, "Invalid event message for "
+                          + subscription.sid + ": " + str(error)), "logger")
+            return
+        self.fire(PropertiesChanged(subscription, properties),
+                  subscription.channel)
+
+    @property
+    def subscriptions(self):
+        """The number of active subscriptions."""
+        return len(self._active)
+
+    @property
+    def renewed(self):
+        """The number of renewals sent."""
+        return self._renewed
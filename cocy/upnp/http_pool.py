@@ -0,0 +1,307 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.core.events import Event
+from circuits_bricks.web.client import Client, Request
+from six.moves.urllib.parse import urlparse
+from collections import deque, OrderedDict
+from heapq import heappush, heappop
+from itertools import count
+from errno import ETIMEDOUT
+import time
+
+
+class PooledResponse(Event):
+    """
+    Fired on the channel given with the request when the response
+    has been received.
+    """
+    name = "pooled_response"
+
+    def __init__(self, tag, response):
+        super(PooledResponse, self).__init__(tag, response)
+
+
+class PooledRequestFailed(Event):
+    """
+    Fired on the channel given with the request when the request has
+    failed and no retries are left.
+    """
+    name = "pooled_request_failed"
+
+    def __init__(self, tag, error):
+        super(PooledRequestFailed, self).__init__(tag, error)
+
+
+class PooledRequest(object):
+    """
+    The information about a request submitted to a :class:`HTTPClientPool`.
+    """
+
+    __slots__ = ("method", "url", "body", "headers", "channel", "tag",
+                 "retries", "timeout", "attempts", "resent", "host")
+
+    def __init__(self, method, url, body, headers, channel, tag,
+                 retries, timeout):
+        self.method = method
+        self.url = url
+        self.body = body
+        self.headers = headers
+        self.channel = channel
+        self.tag = tag
+        self.retries = retries
+        self.timeout = timeout
+        self.attempts = 0
+        self.resent = False
+        parsed = urlparse(url)
+        self.host = "%s:%s" % (parsed.hostname,
+                               parsed.port or (443 if parsed.scheme == "https"
+                                               else 80))
+
+
+class HTTPClientPool(BaseComponent):
+    """
+    This component sends HTTP requests using a pool of
+    persistent connections, one for each host (and port). A connection
+    is used for one request at a time, requests for a host that
+    has a request in progress are queued. The number of connections
+    with requests in progress is limited by *max_connections*, the
+    number of idle connections that are kept open is limited by
+    *max_idle*.
+
+    Failed requests are retried up to *retries* times with an
+    exponential backoff that starts with *backoff* seconds. A request
+    that fails on a connection that has been used before is resent
+    once immediately (and independent of *retries*), because the
+    host may have closed the idle connection just when the request
+    was sent. Idle connections closed by the host are dropped from
+    the pool.
+
+    The result of a request is reported with a :class:`PooledResponse`
+    or :class:`PooledRequestFailed` event fired on the channel that
+    was specified when the request was submitted.
+    """
+
+    channel = "http-pool"
+
+    def __init__(self, channel=channel, max_connections=8, max_idle=16,
+                 retries=2, backoff=1.0, timeout=30):
+        super(HTTPClientPool, self).__init__(channel=channel)
+        self._max_connections = max_connections
+        self._max_idle = max_idle
+        self._retries = retries
+        self._backoff = backoff
+        self._timeout = timeout
+        # Requests waiting to be sent
+        self._pending = deque()
+        # Requests waiting for a retry, heap with (due, seq, request)
+        self._delayed = []
+        self._sequence = count()
+        # Connections indexed by host, least recently used first
+        self._connections = OrderedDict()
+        self._in_flight = 0
+        self._completed = 0
+        self._retried = 0
+        self._failed = 0
+
+    def submit(self, method, url, channel, tag=None, body=None, headers={},
+               retries=None, timeout=None):
+        """
+        Submit a request. The result is fired on *channel*, with
+        *tag* as first argument.
+        """
+        self._pending.append(PooledRequest \
+            (method, url, body, headers, channel, tag,
+             self._retries if retries is None else retries,
+             self._timeout if timeout is None else timeout))
+        self._dispatch()
+
+    def _dispatch(self):
+        if len(self._pending) == 0 \
+            or self._in_flight >= self._max_connections:
+            return
+        waiting = deque()
+        while len(self._pending) > 0 \
+            and self._in_flight < self._max_connections:
+            request = self._pending.popleft()
+            connection = self._connections.get(request.host)
+            if connection is not None and connection.busy:
+                waiting.append(request)
+                continue
+            if connection is None:
+                connection = _HostConnection \
+                    (self, request.url, request.host).register(self)
+                self._connections[request.host] = connection
+                self._close_idle()
+            else:
+                # Move to end (most recently used)
+                del self._connections[request.host]
+                self._connections[request.host] = connection
+            self._in_flight += 1
+            request.attempts += 1
+            connection.send(request)
+        waiting.extend(self._pending)
+        self._pending = waiting
+
+    def _close_idle(self):
+        idle = [host for host, connection in self._connections.items()
+                if not connection.busy]
+        for host in idle[:max(0, len(idle) - self._max_idle)]:
+            self._connections.pop(host).close()
+
+    def _on_completed(self, connection, request, response):
+        self._in_flight -= 1
+        self._completed += 1
+        self.fire(PooledResponse(request.tag, response), request.channel)
+        self._dispatch()
+
+    def _on_failed(self, connection, request, error):
+        self._in_flight -= 1
+        # The connection is in an undefined state, don't reuse it.
+        self._on_closed(connection)
+        if connection.reused and not request.resent:
+            # Probably closed by the host while idle, try again on
+            # a new connection without counting it as an attempt
+            request.resent = True
+            request.attempts -= 1
+            self._retried += 1
+            self._pending.appendleft(request)
+        elif request.attempts <= request.retries:
+            self._retried += 1
+            heappush(self._delayed,
+                     (time.time() + self._backoff
+                      * 2 ** (request.attempts - 1),
+                      next(self._sequence), request))
+        else:
+            self._failed += 1
+            self.fire(PooledRequestFailed(request.tag, error),
+                      request.channel)
+        self._dispatch()
+
+    def _on_closed(self, connection):
+        if self._connections.get(connection.host) is connection:
+            del self._connections[connection.host]
+        connection.close()
+
+    @handler("generate_events")
+    def _on_generate_events(self, event):
+        if len(self._delayed) == 0:
+            return
+        now = time.time()
+        if self._delayed[0][0] <= now:
+            while len(self._delayed) > 0 and self._delayed[0][0] <= now:
+                self._pending.append(heappop(self._delayed)[2])
+            self._dispatch()
+            event.reduce_time_left(0)
+        if len(self._delayed) > 0:
+            event.reduce_time_left(self._delayed[0][0] - now)
+
+    @property
+    def queue_depth(self):
+        """The number of requests waiting to be sent or retried."""
+        return len(self._pending) + len(self._delayed)
+
+    @property
+    def in_flight(self):
+        """The number of requests in progress."""
+        return self._in_flight
+
+    @property
+    def connections(self):
+        """The number of open connections."""
+        return len(self._connections)
+
+    @property
+    def completed(self):
+        return self._completed
+
+    @property
+    def retried(self):
+        return self._retried
+
+    @property
+    def failed(self):
+        return self._failed
+
+
+class _HostConnection(BaseComponent):
+    """
+    A persistent connection to a host, used by :class:`HTTPClientPool`.
+    """
+
+    def __init__(self, pool, url, host):
+        super(_HostConnection, self).__init__ \
+            (channel="%s.%s" % (pool.channel, id(self)))
+        self._pool = pool
+        self.host = host
+        self._client = Client(url, channel=self.channel).register(self)
+        self._request = None
+        self._sent = 0
+
+    @property
+    def busy(self):
+        return self._request is not None
+
+    @property
+    def reused(self):
+        """Whether the current request is not the first one sent."""
+        return self._sent > 1
+
+    def send(self, request):
+        self._request = request
+        self._sent += 1
+        self.fire(Request(request.method, request.url, request.body,
+                          request.headers, request.timeout), self._client)
+
+    def close(self):
+        if self._client.connected:
+            self._client.close()
+        if self._pool is not None:
+            self._pool = None
+            self.unregister()
+
+    @handler("response")
+    def _on_response(self, response):
+        request = self._request
+        if request is None:
+            return
+        self._request = None
+        self._pool._on_completed(self, request, response)
+
+    @handler("socket_error")
+    def _on_socket_error(self, *args):
+        self._fail(args[-1] if args else ETIMEDOUT)
+
+    @handler("disconnected")
+    def _on_disconnected(self):
+        self._fail("disconnected")
+
+    def _fail(self, error):
+        if self._pool is None:
+            return
+        request = self._request
+        if request is None:
+            # Closed while idle
+            self._pool._on_closed(self)
+            return
+        self._request = None
+        self._pool._on_failed(self, request, error)
@@ -24,6 +24,7 @@ from circuits_bricks.web import ScopedChannel
 from xml.etree import ElementTree
 from cocy.upnp import UPNP_SERVICE_SCHEMA
 from cocy.misc import set_ns_prefixes
+from cocy.upnp.description import parse_scpd
 
 
 class UPnPService(BaseController):
@@ -59,12 +60,15 @@ class UPnPService(BaseController):
         # Now call super as only now the channel is known and this classes
         # handlers will be registered properly
         super(UPnPService, self).__init__();
-        sfile = open(os.path.join(self._service_dir, 
-                                  "%s_%s.xml" % (self._type, self._ver)))
-        sd = ElementTree.parse(sfile).getroot()
+        with open(os.path.join(self._service_dir, "%s_%s.xml" 
+                               % (self._type, self._ver)), "rb") as sfile:
+            content = sfile.read()
+        # Parsed description, used e.g. for validating arguments
+        self._scpd = parse_scpd(content)
+        sd = ElementTree.fromstring(content)
         sd.set("configId", str(config_id))
         # Some Android clients have problems with white spaces
-        for el in sd.getiterator():
+        for el in sd.iter():
             if el.text:
                 el.text = el.text.strip()
             if el.tail:
@@ -80,6 +84,11 @@ class UPnPService(BaseController):
     def type_ver(self):
         return "%s:%s" % (self._type, str(self._ver))
 
+    @property
+    def scpd(self):
+        """The service description as :class:`cocy.upnp.description.SCPD`."""
+        return self._scpd
+
     @property
     def description_url(self):
         return self._path + "/service.xml" 
@@ -22,14 +22,19 @@ from circuits.core.components import BaseComponent
 from circuits.core.handlers import handler
 from circuits_bricks.net.sockets import UDPMCastServer
 import os
-from circuits.io.events import Write
-import platform
-from socket import gethostname, gethostbyname
+from circuits.net.sockets import Read, SocketError
+import socket
+import struct
+from errno import EWOULDBLOCK, EAGAIN
 import time
+import random
+import math
+from heapq import heappush, heappop
+from itertools import count
+from collections import namedtuple, OrderedDict
 from circuits_bricks.core.timers import Timer
 from cocy.upnp import SSDP_ADDR, SSDP_PORT, SSDP_SCHEMAS, UPNP_ROOTDEVICE,\
     SERVER_HELLO
-from circuits_bricks.misc import ComponentQuery
 from circuits.core.events import Event
 from circuits.web.controllers import Controller
 from email.utils import formatdate
@@ -37,31 +42,175 @@ from circuits_bricks.app.logger import Log
 import logging
 
 
+def send_datagrams(sock, datagrams):
+    '''
+    Send the datagrams, given as a list of (address, data) tuples, on the
+    non-blocking socket *sock*. Returns the number of datagrams sent, which
+    is less than the number of datagrams if the socket's buffer is full. 
+    '''
+    for sent, (address, data) in enumerate(datagrams):
+        try:
+            sock.sendto(data, address)
+        except socket.error as e:
+            if e.args[0] in (EWOULDBLOCK, EAGAIN):
+                return sent
+            raise
+    return len(datagrams)
+
+
+# ioctl that gets an interface's address (Linux) 
+_SIOCGIFADDR = 0x8915
+# Socket option that restricts multicast reception to the groups joined on
+# the socket (Linux)
+_IP_MULTICAST_ALL = 49
+
+
+def ssdp_interfaces():
+    '''
+    Return the IPv4 addresses of the network interfaces that are to be
+    used for SSDP. The loopback interface is only used if no other 
+    interface is found.
+    '''
+    addresses = []
+    try:
+        import fcntl
+        for index, name in socket.if_nameindex():
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                addr = fcntl.ioctl(sock.fileno(), _SIOCGIFADDR,
+                                   struct.pack('256s', 
+                                               name[:15].encode("ascii")))
+                addresses.append(socket.inet_ntoa(addr[20:24]))
+            except (IOError, OSError):
+                pass
+            finally:
+                sock.close()
+    except (ImportError, AttributeError, OSError):
+        pass
+    if len(addresses) == 0:
+        try:
+            hostaddr = socket.gethostbyname(socket.gethostname())
+            if hostaddr.startswith("127.") \
+                and not "." in socket.gethostname():
+                try:
+                    hostaddr = socket.gethostbyname \
+                        (socket.gethostname() + ".")
+                except:
+                    pass
+            addresses.append(hostaddr)
+        except (IOError, OSError):
+            pass
+    non_local = [addr for addr in addresses if not addr.startswith("127.")]
+    return non_local or addresses
+
+class SSDPInterfaceServer(UDPMCastServer):
+    '''
+    The multicast server for a single network interface. The interface
+    is specified by its IPv4 address. The server joins the SSDP
+    multicast group on the interface, sends multicast messages out 
+    on the interface and uses ``ssdp:`` followed by the interface address
+    as channel.
+    
+    Received datagrams are fired as ``read`` event on the ``ssdp`` 
+    channel with the interface address as additional argument. 
+    '''
+
+    def __init__(self, interface, **kwargs):
+        self._interface = interface
+        kwargs["channel"] = "ssdp:" + interface
+        super(SSDPInterfaceServer, self).__init__((SSDP_ADDR, SSDP_PORT),
+                                                  **kwargs)
+
+    def _create_socket(self):
+        self._addrinfo = socket.getaddrinfo(SSDP_ADDR, None)[0]
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # There's one socket for every interface
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Multicast datagrams are only received if bound to INADDR_ANY
+        sock.bind(('', SSDP_PORT))
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, _IP_MULTICAST_ALL, 0)
+        except (IOError, OSError):
+            pass
+        interface = socket.inet_aton(self._interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                        socket.inet_aton(SSDP_ADDR) + interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+        sock.setblocking(False)
+        return sock
+
+    def _read(self):
+        try:
+            data, address = self._sock.recvfrom(self._bufsize)
+            if data:
+                self.fire(Read(address, data, self._interface), 
+                          "ssdp").notify = True
+        except socket.error as e:
+            if e.args[0] in (EWOULDBLOCK, EAGAIN):
+                return
+            self.fire(SocketError(self._sock, e))
+            self._close(self._sock)
+
+    @handler("write_batch")
+    def write_batch(self, datagrams):
+        '''
+        Send all datagrams (a list of (address, data) tuples) at once. 
+        Datagrams that cannot be sent immediately are queued like
+        datagrams from ``write`` events.
+        '''
+        sent = 0
+        if not self._buffers[self._sock]:
+            try:
+                sent = send_datagrams(self._sock, datagrams)
+            except socket.error as e:
+                self.fire(SocketError(self._sock, e))
+                return
+        for address, data in datagrams[sent:]:
+            self.write(address, data)
+
+    @property
+    def interface(self):
+        return self._interface
+
+
 class SSDPTranceiver(BaseComponent):
     '''The SSDP protocol server component
     '''
 
     channel = "ssdp"
 
-    def __init__(self, **kwargs):
+    def __init__(self, interfaces=None, **kwargs):
         '''
         Constructor
+        
+        :param interfaces: the IPv4 addresses of the network interfaces
+            to use. Defaults to the result of :func:`ssdp_interfaces`.
         '''
         kwargs.setdefault("channel", self.channel)
         super(SSDPTranceiver, self).__init__(**kwargs)
+        if interfaces is None:
+            interfaces = ssdp_interfaces()
+        if len(interfaces) == 0:
+            self.fire(Log(logging.ERROR, "No network interface for SSDP"),
+                      "logger")
 
-        # The underlying network connection, used by both the sender
-        # and the receiver 
-        self._server = UDPMCastServer((SSDP_ADDR, SSDP_PORT),
-                                     **kwargs).register(self)
-        self._server.setTTL(2)
+        # The underlying network connections (one for each interface), 
+        # used by both the sender and the receiver 
+        self._servers = []
+        for interface in interfaces:
+            server = SSDPInterfaceServer(interface, **kwargs).register(self)
+            server.setTTL(2)
+            self._servers.append(server)
 
         # Our associated SSDP message sender
-        SSDPSender().register(self)
+        SSDPSender(interfaces).register(self)
         
         # Our associated SSDP message receiver
         SSDPReceiver().register(self)
 
+    @property
+    def interfaces(self):
+        return [server.interface for server in self._servers]
 
 
 class SSDPSender(BaseComponent):
@@ -71,33 +220,33 @@ class SSDPSender(BaseComponent):
     channel = "ssdp"
     _template_dir = os.path.join(os.path.dirname(__file__), "templates")
     _template_cache = {}
-    _message_env = {}
     _message_expiry = 1800
     _boot_id = int(time.time())
-    _timers = dict()
+    _dynamic_fields = ("DATE", "BOOTID")
 
-    def __init__(self, channel=channel):
+    def __init__(self, interfaces, channel=channel):
         '''
         Constructor
+        
+        :param interfaces: the IPv4 addresses of the network interfaces
+            that the messages are sent on
         '''
         super(SSDPSender, self).__init__(channel=channel)
-
-        # Setup the common entries in the dictionary that will be usd to
-        # fill the UPnP templates.
-        self._message_env['BOOTID'] = self._boot_id
-        self._message_env['SERVER'] = SERVER_HELLO
-        try:
-            self.hostaddr = gethostbyname(gethostname())
-            if self.hostaddr.startswith("127.") and not "." in gethostname():
-                try:
-                    self.hostaddr = gethostbyname(gethostname() + ".")
-                except:
-                    pass
-        except Exception as e:
-            self.fire(Log(logging.ERROR, "Failed to get host address: %s(%s)" \
-                          % (type(e), str(e))),
-                      "logger")
-            
+        self._interfaces = list(interfaces)
+
+        # The fully encoded datagrams, indexed by device uuid. Each
+        # entry is a tuple with the values that the datagrams depend 
+        # on and a dictionary that maps (NT, template, interface) to 
+        # the datagram. 
+        self._datagram_cache = dict()
+        # Responses to searches are not sent immediately
+        self._response_scheduler = SSDPResponseScheduler().register(self)
+        # Announcements of available devices are repeated
+        self._announcement_wheel = SSDPAnnouncementWheel().register(self)
+        self._repeats = dict()
+        # The datagrams to send, collected during a handler invocation
+        # and indexed by interface
+        self._output = dict()
 
     @handler("config_value", channel="configuration")
     def _on_config_value(self, section, option, value):
@@ -105,127 +254,171 @@ class SSDPSender(BaseComponent):
             return
         if option == "max-age":
             self._message_expiry = int(value)
+            self._datagram_cache.clear()
 
     @handler("mgmt_controller_query")
     def _on_controller_query(self):
         return Controller()
 
     @handler("device_available", channel="upnp")
-    def _on_device_available(self, event, upnp_device):
-        self._update_message_env(upnp_device)
-        self._send_device_messages(upnp_device, "available")
-        # Service announcements
-        for service in upnp_device.services:
-            self._send_service_message(upnp_device, service, "available")
-        # Handle repeats
-        if getattr(event, 'times_sent', 0) < 3:
-            self._timers[upnp_device.uuid] \
-                = Timer(0.25, event, *event.channels).register(self)
-            event.times_sent = getattr(event, 'times_sent', 0) + 1
-        else:
-            self._timers[upnp_device.uuid] \
-                = Timer(self._message_expiry / 4,
-                        event, *event.channels).register(self)
+    def _on_device_available(self, upnp_device):
+        self._send_notifications(upnp_device, "available", 
+                                 self._field_values())
+        self._flush_output()
+        self._repeats[upnp_device.uuid] = 0
+        self._announcement_wheel.schedule(upnp_device, 0.25)
+
+    @handler("announcements_due")
+    def _on_announcements_due(self, devices):
+        fields = self._field_values()
+        for upnp_device in devices:
+            if not upnp_device.uuid in self._repeats:
+                continue
+            self._send_notifications(upnp_device, "available", fields)
+            # Handle repeats
+            if self._repeats[upnp_device.uuid] < 3:
+                self._repeats[upnp_device.uuid] += 1
+                self._announcement_wheel.schedule(upnp_device, 0.25)
+            else:
+                # Spread refreshes, else they would happen in bursts 
+                # for devices that became available at the same time
+                self._announcement_wheel.schedule \
+                    (upnp_device, self._message_expiry / 4 
+                     * random.uniform(0.5, 1.5))
+        self._flush_output()
    
     @handler("device_unavailable", channel="upnp")
-    def _on_device_unavailable(self, event, upnp_device):
-        if upnp_device.uuid in self._timers:
-            self._timers[upnp_device.uuid].unregister()
-            del self._timers[upnp_device.uuid]
-        self._update_message_env(upnp_device)
-        self._send_device_messages(upnp_device, "unavailable")
-        # Service announcements
-        for service in upnp_device.services:
-            self._send_service_message(upnp_device, service, "unavailable")
+    def _on_device_unavailable(self, upnp_device):
+        self._announcement_wheel.cancel(upnp_device.uuid)
+        self._repeats.pop(upnp_device.uuid, None)
+        self._send_notifications(upnp_device, "unavailable", 
+                                 self._field_values())
+        self._flush_output()
+        self._datagram_cache.pop(upnp_device.uuid, None)
    
     @handler("device_match")
-    def _on_device_match(self, upnp_device, inquirer, search_target):
-        self._update_message_env(upnp_device)
-        if search_target == "ssdp:all":
-            self._send_device_messages(upnp_device, "result", inquirer)
-        else:
-            if search_target == "upnp:rootdevice":
-                self._send_root_message(upnp_device, "notify-result", inquirer)
-            elif search_target.startswith("uuid:"):
-                self._send_uuid_message(upnp_device, "notify-result", inquirer)
-            elif search_target.startswith(SSDP_SCHEMAS + ":device:"):
-                self._send_device_message \
-                    (upnp_device, "notify-result", inquirer)
-            elif search_target.startswith(SSDP_SCHEMAS + ":service:"):
-                for service in upnp_device.services:
-                    if not search_target.startswith \
-                        (SSDP_SCHEMAS + ":service:" + service.type + ":"):
-                        continue
-                    self._send_service_message \
-                        (upnp_device, service, "result", inquirer)
+    def _on_device_match(self, responses, inquirer, search_target, mx=0,
+                         interface=None):
+        self._response_scheduler.schedule(responses, inquirer, mx, interface)
+
+    @handler("search_responses_due")
+    def _on_search_responses_due(self, responses):
+        fields = self._field_values()
+        for upnp_device, nt, inquirer, interface in responses:
+            if interface not in self._interfaces:
+                if len(self._interfaces) == 0:
+                    continue
+                interface = self._interfaces[0]
+            self._send_datagram(upnp_device, "notify-result", nt, fields,
+                                interface, inquirer)
+        self._flush_output()
             
     @handler("upnp_search_request")
     def _on_search_request(self, event, search_target=UPNP_ROOTDEVICE, mx=1):
-        self._send_template("m-search-request", 
-                            { "ST": search_target, "MX": mx })
+        for interface in self._interfaces:
+            self._send_template("m-search-request", 
+                                { "ST": search_target, "MX": mx },
+                                interface)
+        self._flush_output()
         # Handle repeats
         if getattr(event, 'times_sent', 0) < 3:
             Timer(mx, event, *event.channels).register(self)
             event.times_sent = getattr(event, 'times_sent', 0) + 1
             
-    def _update_message_env(self, upnp_device):
-        self._message_env['CACHE-CONTROL'] = self._message_expiry
-        self._message_env['CONFIGID'] = upnp_device.config_id
-        self._message_env['DATE'] = formatdate(usegmt=True)
-        self._message_env['LOCATION'] = "http://" + self.hostaddr + ":" \
-            + str(upnp_device.web_server_port) + "/" + upnp_device.uuid \
-            + "/description.xml"
-        
-    def _send_device_messages(self, upnp_device, msg_type, 
-                              to=(SSDP_ADDR, SSDP_PORT)):
+    def _field_values(self):
+        '''
+        Return the values of the fields that change with every
+        message sent (and are therefore not part of the cached datagrams).
+        '''
+        return { b"DATE": formatdate(usegmt=True).encode("ascii"),
+                 b"BOOTID": str(self._boot_id).encode("ascii") }
+
+    def _send_notifications(self, upnp_device, msg_type, fields):
+        '''
+        Send the notifications of the given type for the device and
+        its services on all interfaces.
+        '''
         template = "notify-%s" % msg_type
         # There is an extra announcement for root devices
-        if upnp_device.root_device:
-            self._send_root_message(upnp_device, template, to)
-        # Device UUID announcement
-        self._send_uuid_message(upnp_device, template, to)
-        # Device type announcement
-        self._send_device_message(upnp_device, template, to)
-        
-    def _send_root_message(self, upnp_device, template, 
-                           to=(SSDP_ADDR, SSDP_PORT)):
-        self._message_env['NT'] = 'upnp:rootdevice'
-        self._message_env['USN'] = 'uuid:' + upnp_device.uuid \
-            + '::upnp:rootdevice'
-        self._send_template(template, self._message_env, to)
-
-    def _send_uuid_message(self, upnp_device, template, 
-                           to=(SSDP_ADDR, SSDP_PORT)):
-        self._message_env['NT'] = 'uuid:' + upnp_device.uuid
-        self._message_env['USN'] = 'uuid:' + upnp_device.uuid
-        self._send_template(template, self._message_env, to)
-
-    def _send_device_message(self, upnp_device, template, 
-                           to=(SSDP_ADDR, SSDP_PORT)):
-        self._message_env['NT'] = SSDP_SCHEMAS + ":device:" \
-            + upnp_device.type_ver
-        self._message_env['USN'] = 'uuid:' + upnp_device.uuid \
-            + "::" + self._message_env['NT']
-        self._send_template(template, self._message_env, to)
-
-    def _send_service_message(self, upnp_device, service, msg_type, \
-                              to=(SSDP_ADDR, SSDP_PORT)):
-        template = "notify-%s" % msg_type
-        self._message_env['NT'] = SSDP_SCHEMAS + ":service:" \
-            + service.type_ver
-        self._message_env['USN'] = 'uuid:' + upnp_device.uuid \
-            + "::" + self._message_env['NT']
-        self._send_template(template, self._message_env, to)
+        nts = [UPNP_ROOTDEVICE] if upnp_device.root_device else []
+        # Device UUID and device type announcement 
+        nts.append("uuid:" + upnp_device.uuid)
+        nts.append(SSDP_SCHEMAS + ":device:" + upnp_device.type_ver)
+        # Service announcements
+        for service in upnp_device.services:
+            nts.append(SSDP_SCHEMAS + ":service:" + service.type_ver)
+        for interface in self._interfaces:
+            for nt in nts:
+                self._send_datagram(upnp_device, template, nt, fields, 
+                                    interface)
         
-    def _send_template(self, template_name, data, to=(SSDP_ADDR, SSDP_PORT)):
+    def _send_datagram(self, upnp_device, template_name, nt, fields, 
+                       interface, to=(SSDP_ADDR, SSDP_PORT)):
+        parts = self._get_datagram(upnp_device, template_name, nt, interface)
+        if len(parts) > 1:
+            parts = [fields[part] if i % 2 else part
+                     for i, part in enumerate(parts)]
+        self._output.setdefault(interface, []).append((to, b"".join(parts)))
+
+    def _get_datagram(self, upnp_device, template_name, nt, interface):
+        '''
+        Return the datagram for the given device, template,
+        notification type and interface as a list of byte strings. 
+        The items at odd positions are the names of the fields that 
+        must be replaced with their current values when the datagram 
+        is sent. 
+        '''
+        depends_on = (upnp_device.config_id, self._message_expiry, 
+                      upnp_device.web_server_port)
+        entry = self._datagram_cache.get(upnp_device.uuid)
+        if entry is None or entry[0] != depends_on:
+            entry = (depends_on, dict())
+            self._datagram_cache[upnp_device.uuid] = entry
+        datagrams = entry[1]
+        datagram = datagrams.get((nt, template_name, interface))
+        if datagram is not None:
+            return datagram
+        usn = 'uuid:' + upnp_device.uuid
+        if nt != usn:
+            usn += "::" + nt
+        # The location must be reachable via the interface used
+        location = "http://" + interface + ":" \
+            + str(upnp_device.web_server_port) + "/" + upnp_device.uuid \
+            + "/description.xml"
+        data = { 'CACHE-CONTROL': self._message_expiry,
+                 'CONFIGID': upnp_device.config_id,
+                 'LOCATION': location,
+                 'SERVER': SERVER_HELLO,
+                 'NT': nt,
+                 'USN': usn }
+        # Have the dynamic fields rendered as separators
         template = self._get_template(template_name)
-        message = template % data
-        headers = ""
-        for line in message.splitlines():
-            headers = headers + line + "\r\n"
-        headers += "\r\n"
-        self.fireEvent(Write(to, headers))
+        for name in self._dynamic_fields:
+            data[name] = "\0%s\0" % name
+            template = template.replace("%%(%s)i" % name, "%%(%s)s" % name)
+        datagram = self._render(template, data).split(b"\0")
+        datagrams[(nt, template_name, interface)] = datagram
+        return datagram
+
+    def _send_template(self, template_name, data, interface,
+                       to=(SSDP_ADDR, SSDP_PORT)):
+        self._output.setdefault(interface, []).append \
+            ((to, self._render(self._get_template(template_name), data)))
+
+    def _flush_output(self):
+        '''
+        Send the datagrams collected during the current handler invocation 
+        with one event per interface.
+        '''
+        for interface, datagrams in self._output.items():
+            self.fire(WriteBatch(datagrams), "ssdp:" + interface)
+        self._output = dict()
                     
+    def _render(self, template, data):
+        message = template % data
+        return ("\r\n".join(message.splitlines()) + "\r\n\r\n") \
+            .encode("utf-8")
+
     def _get_template(self, name):
         if name in self._template_cache:
             return self._template_cache[name]
@@ -235,35 +428,306 @@ class SSDPSender(BaseComponent):
         return template
 
 
+class SSDPAnnouncementWheel(BaseComponent):
+    '''
+    This component keeps track of the points in time at which the
+    announcements of the available devices must be repeated. A single
+    hashed timing wheel is used for all devices. On every tick, the 
+    devices with due announcements are reported with one
+    :class:`AnnouncementsDue` event. 
+    '''
+
+    channel = "ssdp"
+    _tick = 0.25
+    _slots = 256
+
+    def __init__(self, channel=channel):
+        super(SSDPAnnouncementWheel, self).__init__(channel=channel)
+        # Every slot maps uuids to [remaining rounds, device]
+        self._wheel = [dict() for i in range(self._slots)]
+        # Maps uuids to slot numbers
+        self._entries = dict()
+        self._cursor = 0
+        self._cursor_time = time.time()
+
+    def schedule(self, upnp_device, delay):
+        '''
+        Schedule the announcement of *upnp_device* after *delay* seconds,
+        replacing any announcement already scheduled for the device.
+        '''
+        self.cancel(upnp_device.uuid)
+        now = time.time()
+        if len(self._entries) == 0:
+            self._cursor_time = now
+        ticks = max(1, int(math.ceil \
+                           ((now - self._cursor_time + delay) / self._tick)))
+        slot = (self._cursor + ticks) % self._slots
+        self._wheel[slot][upnp_device.uuid] \
+            = [(ticks - 1) // self._slots, upnp_device]
+        self._entries[upnp_device.uuid] = slot
+
+    def cancel(self, uuid):
+        slot = self._entries.pop(uuid, None)
+        if slot is not None:
+            del self._wheel[slot][uuid]
+
+    @handler("generate_events")
+    def _on_generate_events(self, event):
+        if len(self._entries) == 0:
+            return
+        now = time.time()
+        due = []
+        while self._cursor_time + self._tick <= now:
+            self._cursor_time += self._tick
+            self._cursor = (self._cursor + 1) % self._slots
+            slot = self._wheel[self._cursor]
+            for uuid, entry in list(slot.items()):
+                if entry[0] > 0:
+                    entry[0] -= 1
+                    continue
+                del slot[uuid]
+                del self._entries[uuid]
+                due.append(entry[1])
+        if len(due) > 0:
+            self.fire(AnnouncementsDue(due))
+            event.reduce_time_left(0)
+        if len(self._entries) > 0:
+            event.reduce_time_left(self._cursor_time + self._tick - now)
+
+
+class WriteBatch(Event):
+    name = "write_batch"
+    
+    def __init__(self, datagrams):
+        super(WriteBatch, self).__init__(datagrams)
+
+
+class AnnouncementsDue(Event):
+    name = "announcements_due"
+    
+    def __init__(self, devices):
+        super(AnnouncementsDue, self).__init__(devices)
+
+
+class SSDPResponseScheduler(BaseComponent):
+    '''
+    This component schedules the responses to M-SEARCH requests. As 
+    required by the UPnP specification, the responses are delayed by a 
+    random interval between 0 and the MX value of the request. This 
+    spreads the responses to searches that have been sent by several 
+    control points at the same time. Responses that are already scheduled
+    are not scheduled again if a control point repeats its search.
+    
+    The number of responses sent per second is limited by the option
+    ``search-response-rate`` of the ``upnp`` configuration section. 
+    Responses that exceed the limit are deferred to the next second, 
+    or dropped if this would violate the MX interval.
+    '''
+
+    channel = "ssdp"
+    _max_mx = 5
+    _rate_limit = 100
+
+    def __init__(self, channel=channel):
+        super(SSDPResponseScheduler, self).__init__(channel=channel)
+        # Heap with (due time, sequence number, key) 
+        self._due = []
+        self._sequence = count()
+        # Maps (inquirer, uuid, NT) to 
+        # (device, NT, inquirer, interface, deadline) 
+        self._scheduled = dict()
+        self._window_end = 0
+        self._budget = 0
+        self._deferred = 0
+        self._dropped = 0
+        self._merged = 0
+
+    @handler("config_value", channel="configuration")
+    def _on_config_value(self, section, option, value):
+        if not section == "upnp":
+            return
+        if option == "search-response-rate":
+            self._rate_limit = int(value)
+
+    def schedule(self, responses, inquirer, mx, interface=None):
+        '''
+        Schedule the (device, NT) pairs in *responses* to be sent to 
+        *inquirer* within *mx* seconds, using the network interface
+        with address *interface*.
+        '''
+        mx = max(0, min(mx, self._max_mx))
+        now = time.time()
+        for upnp_device, nt in responses:
+            key = (inquirer, upnp_device.uuid, nt)
+            if key in self._scheduled:
+                self._merged += 1
+                continue
+            self._scheduled[key] \
+                = (upnp_device, nt, inquirer, interface, now + mx)
+            heappush(self._due, (now + random.uniform(0, mx), 
+                                 next(self._sequence), key))
+
+    @handler("generate_events")
+    def _on_generate_events(self, event):
+        if len(self._due) == 0:
+            return
+        now = time.time()
+        if now >= self._window_end:
+            self._window_end = now + 1
+            self._budget = self._rate_limit
+        ready = []
+        while len(self._due) > 0 and self._due[0][0] <= now:
+            key = heappop(self._due)[2]
+            upnp_device, nt, inquirer, interface, deadline \
+                = self._scheduled[key]
+            if self._budget > 0:
+                self._budget -= 1
+                del self._scheduled[key]
+                ready.append((upnp_device, nt, inquirer, interface))
+            elif self._window_end <= deadline:
+                self._deferred += 1
+                heappush(self._due, (random.uniform \
+                                     (self._window_end, deadline),
+                                     next(self._sequence), key))
+            else:
+                self._dropped += 1
+                del self._scheduled[key]
+        if len(ready) > 0:
+            self.fire(SearchResponsesDue(ready))
+            event.reduce_time_left(0)
+        if len(self._due) > 0:
+            event.reduce_time_left(max(0, self._due[0][0] - now))
+
+    @property
+    def pending(self):
+        return len(self._scheduled)
+
+    @property
+    def deferred(self):
+        '''The number of responses deferred due to the rate limit.'''
+        return self._deferred
+
+    @property
+    def dropped(self):
+        '''The number of responses dropped due to the rate limit.'''
+        return self._dropped
+
+    @property
+    def merged(self):
+        '''The number of responses already scheduled by a previous search.'''
+        return self._merged
+
+
+class SearchTargetIndex(object):
+    '''
+    This class maps the search targets of M-SEARCH requests to the
+    (device, NT) pairs that must be sent as responses. Device and service
+    types are indexed without their version, because a search for a
+    given version must be answered by all devices or services with the
+    same or a higher version.
+    '''
+
+    def __init__(self):
+        # Maps the uuid of every indexed device to its (device, targets)
+        self._devices = dict()
+        # Maps a search target without version to a list of 
+        # (version, device, NT) tuples
+        self._index = dict()
+
+    def add(self, upnp_device):
+        if upnp_device.uuid in self._devices:
+            self.remove(upnp_device)
+        targets = self._targets(upnp_device)
+        self._devices[upnp_device.uuid] = (upnp_device, targets)
+        for key, version, nt in targets:
+            self._index.setdefault(key, []).append((version, upnp_device, nt))
+
+    def remove(self, upnp_device):
+        entry = self._devices.pop(upnp_device.uuid, None)
+        if entry is None:
+            return
+        for key, version, nt in entry[1]:
+            matches = [match for match in self._index.get(key, [])
+                       if match[1] is not upnp_device]
+            if matches:
+                self._index[key] = matches
+            else:
+                self._index.pop(key, None)
+
+    def resolve(self, search_target):
+        '''
+        Return the list of (device, NT) pairs that match the search target.
+        '''
+        if search_target == "ssdp:all":
+            return [(upnp_device, nt) 
+                    for upnp_device, targets in self._devices.values()
+                    for key, version, nt in targets]
+        key, version = self._split(search_target)
+        return [(upnp_device, nt) 
+                for match_version, upnp_device, nt in self._index.get(key, [])
+                if version is None or match_version is None
+                or match_version >= version]
+
+    def _targets(self, upnp_device):
+        targets = []
+        if upnp_device.root_device:
+            targets.append((UPNP_ROOTDEVICE, None, UPNP_ROOTDEVICE))
+        targets.append(("uuid:" + upnp_device.uuid, None, 
+                        "uuid:" + upnp_device.uuid))
+        nts = [SSDP_SCHEMAS + ":device:" + upnp_device.type_ver]
+        for service in upnp_device.services:
+            nts.append(SSDP_SCHEMAS + ":service:" + service.type_ver)
+        for nt in nts:
+            key, version = self._split(nt)
+            targets.append((key, version, nt))
+        return targets
+
+    def _split(self, search_target):
+        if not search_target.startswith(SSDP_SCHEMAS + ":"):
+            return (search_target, None)
+        key, version = search_target.rsplit(":", 1)
+        try:
+            return (key, float(version))
+        except ValueError:
+            return (search_target, None)
+
+
+class UPnPDeviceSearch(Event):
+    '''
+    This event is fired on the ``upnp`` channel when an M-SEARCH request
+    has been received.
+    '''
+    name = "upnp_device_search"
+    
+    def __init__(self, inquirer, search_target, mx=0, interface=None):
+        super(UPnPDeviceSearch, self).__init__\
+            (inquirer, search_target, mx, interface)
+
+
 class UPnPDeviceMatch(Event):
     name = "device_match"
     
-    def __init__(self, component, inquirer, search_target):
+    def __init__(self, responses, inquirer, search_target, mx=0,
+                 interface=None):
         super(UPnPDeviceMatch, self)\
-            .__init__(component, inquirer, search_target)
+            .__init__(responses, inquirer, search_target, mx, interface)
 
 
-class UPnPDeviceQuery(ComponentQuery):
+class SearchResponsesDue(Event):
+    name = "search_responses_due"
     
-    def __init__(self, query_function, inquirer, search_target):
-        super(UPnPDeviceQuery, self).__init__(query_function)
-        self.name = super(UPnPDeviceQuery, self).name
-        self._inquirer = inquirer
-        self._search_target = search_target
-
-    def decide(self, component):
-        res = super(UPnPDeviceQuery, self).decide(component)
-        if res != None:
-            component.fire(UPnPDeviceMatch(component, self._inquirer, \
-                                           self._search_target), "ssdp")
+    def __init__(self, responses):
+        super(SearchResponsesDue, self).__init__(responses)
+
 
 class UPnPDeviceAlive(Event):
     
     name = "upnp_device_alive"
     
-    def __init__(self, location, notification_type, max_age, server, usn):
+    def __init__(self, location, notification_type, max_age, server, usn,
+                 config_id=None):
         super(UPnPDeviceAlive, self).__init__ \
-            (location, notification_type, max_age, server, usn)
+            (location, notification_type, max_age, server, usn, config_id)
         self.channels = (usn,)
 
 
@@ -284,74 +748,175 @@ class UPnPSearchRequest(Event):
         super(UPnPSearchRequest, self).__init__(search_target, mx, **kwargs)
 
 
+SSDPMessage = namedtuple("SSDPMessage", 
+                         ["start_line", "max_age", "location", 
+                          "notification_type", "search_target", "sub_type", 
+                          "server", "usn", "mx", "boot_id", "config_id"])
+"""
+The information from a received SSDP message. The start line
+is always available, any other attribute is ``None`` if the
+corresponding header is missing or invalid.
+"""
+
+
+def _text_value(value):
+    return value.decode("utf-8", "replace")
+
+def _int_value(value):
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+def _max_age_value(value):
+    name, sep, max_age = value.partition(b"=")
+    if name.strip().lower() != b"max-age":
+        return None
+    return _int_value(max_age)
+
+# Maps the header names to the index of the field in SSDPMessage
+# and the function that converts the value
+_message_headers = dict([(header, (SSDPMessage._fields.index(field), convert))
+    for header, field, convert in \
+        [(b"CACHE-CONTROL", "max_age", _max_age_value),
+         (b"LOCATION", "location", _text_value),
+         (b"NT", "notification_type", _text_value),
+         (b"ST", "search_target", _text_value),
+         (b"NTS", "sub_type", _text_value),
+         (b"SERVER", "server", _text_value),
+         (b"USN", "usn", _text_value),
+         (b"MX", "mx", _int_value),
+         (b"BOOTID.UPNP.ORG", "boot_id", _int_value),
+         (b"CONFIGID.UPNP.ORG", "config_id", _int_value)]])
+
+def parse_ssdp_message(data):
+    '''
+    Parse the SSDP message *data* (as received from the network) in a 
+    single pass and return it as :class:`SSDPMessage`. ``None`` is 
+    returned if *data* is empty.
+    '''
+    lines = data.splitlines()
+    if len(lines) == 0:
+        return None
+    values = [None] * len(SSDPMessage._fields)
+    values[0] = lines[0].decode("utf-8", "replace")
+    headers = _message_headers
+    for line in lines[1:]:
+        name, sep, value = line.partition(b":")
+        header = headers.get(name.strip().upper())
+        if header is not None:
+            values[header[0]] = header[1](value.strip())
+    return SSDPMessage._make(values)
+
+
 class SSDPReceiver(BaseComponent):
+    '''
+    The SSDP protocol receiver component. 
+    
+    Devices usually send each announcement several times. Repeated 
+    alive messages with the same USN, location and boot id are therefore
+    only forwarded if they change the max-age or if the last forwarded
+    message is older than the number of seconds configured as option 
+    ``notify-window`` in section ``upnp``. The information about
+    forwarded messages is kept for at most ``notify-cache-size`` 
+    entries.
+
+    Alive messages without a location are dropped. If the max-age
+    is missing or invalid, the minimum value recommended by the
+    UPnP Device Architecture (1800 seconds) is assumed.
+    '''
 
     channel = "ssdp"
+    _notify_window = 10
+    _notify_cache_size = 1024
+    _default_max_age = 1800
 
     def __init__(self, channel = channel):
         super(SSDPReceiver, self).__init__(channel=channel)
+        # Maps (USN, location, boot id) to (time forwarded, max age) 
+        self._forwarded = OrderedDict()
+        # The keys in _forwarded indexed by USN
+        self._usn_keys = dict()
+        self._hits = 0
+        self._misses = 0
+
+    @handler("config_value", channel="configuration")
+    def _on_config_value(self, section, option, value):
+        if not section == "upnp":
+            return
+        if option == "notify-window":
+            self._notify_window = float(value)
+        elif option == "notify-cache-size":
+            self._notify_cache_size = int(value)
 
     @handler("read")
-    def _on_read(self, address, data):
-        
-        def istartswith(line, prefix):
-            return line[0:len(prefix)].upper() == prefix
-
-        def parse_lines(lines):
-            ''' Helper function that parses the information and puts it in an
-                anonymous type.'''
-            res = type("", (), {})()
-            for line in lines:
-                if istartswith(line, "CACHE-CONTROL:"):
-                    s = line.split(":", 1)[1].strip()
-                    setattr(res, "max_age", int(s.split("=", 1)[1].strip()))
-                elif istartswith(line, "LOCATION:"):
-                    setattr(res, "location", line.split(":", 1)[1].strip())
-                elif istartswith(line, "NT:"):
-                    setattr(res, "notification_type", 
-                            line.split(":", 1)[1].strip())
-                elif istartswith(line, "ST:"):
-                    # Handle search responses like alive messages
-                    setattr(res, "notification_type", 
-                            line.split(":", 1)[1].strip())
-                elif istartswith(line, "NTS:"):
-                    setattr(res, "sub_type", line.split(":", 1)[1].strip())
-                elif istartswith(line, "SERVER:"):
-                    setattr(res, "server", line.split(":", 1)[1].strip())
-                elif istartswith(line, "USN:"):
-                    setattr(res, "usn", line.split(":", 1)[1].strip())
-            return res
-        
-        lines = data.splitlines()
-        if istartswith(lines[0], "M-SEARCH "):
+    def _on_read(self, address, data, interface=None):
+        message = parse_ssdp_message(data)
+        if message is None:
+            return
+        if message.start_line.startswith("M-SEARCH "):
             # This is a search. It's up to us to repond if we have
             # matching devices
-            search_target = None
-            for line in lines[1:len(lines)-1]:
-                if not line.upper().startswith("ST:"):
-                    continue
-                search_target = line.split(':', 1)[1].strip()
-                f = lambda dev: True
-                # TODO: add criteria
-                if search_target == "upnp:rootdevice":
-                    f = lambda dev: dev.root_device
-                self.fire(UPnPDeviceQuery(f, address, search_target), "upnp")                        
-                return
-        elif istartswith(lines[0], "NOTIFY "):
+            if message.search_target is not None:
+                self.fire(UPnPDeviceSearch(address, message.search_target,
+                                           message.mx or 0, interface), 
+                          "upnp")
+        elif message.usn is None:
+            return
+        elif message.start_line.startswith("NOTIFY "):
             # A status change (or confirmation notification. Translate into
             # an event to inform however is interested in this.
-            data = parse_lines(lines[1:])
-            if data.sub_type == "ssdp:alive":
-                self.fire(UPnPDeviceAlive\
-                          (data.location, data.notification_type, 
-                           data.max_age, data.server, data.usn))
-            elif data.sub_type == "ssdp:byebye":
-                self.fire(UPnPDeviceByeBye(data.usn))
-        elif istartswith(lines[0], "HTTP/1.1 200 OK"):
+            if message.sub_type == "ssdp:alive":
+                self._alive(message, message.notification_type)
+            elif message.sub_type == "ssdp:byebye":
+                for key in self._usn_keys.pop(message.usn, ()):
+                    del self._forwarded[key]
+                self.fire(UPnPDeviceByeBye(message.usn))
+        elif message.start_line.startswith("HTTP/1.1 200 OK"):
             # A response to our own M-SEARCH. This is handled like a 
             # status change/confirmation (can only be an alive notification,
             # of course).
-            data = parse_lines(lines[1:])
-            self.fire(UPnPDeviceAlive\
-                      (data.location, data.notification_type, 
-                       data.max_age, data.server, data.usn))
+            self._alive(message, message.search_target)
+
+    def _alive(self, message, notification_type):
+        if message.location is None:
+            return
+        if message.max_age is None:
+            message = message._replace(max_age=self._default_max_age)
+        if self._is_repeated(message):
+            return
+        self.fire(UPnPDeviceAlive\
+                  (message.location, notification_type, 
+                   message.max_age, message.server, message.usn,
+                   message.config_id))
+
+    def _is_repeated(self, message):
+        key = (message.usn, message.location, message.boot_id)
+        now = time.time()
+        forwarded = self._forwarded.pop(key, None)
+        if forwarded is not None and forwarded[1] == message.max_age \
+            and now - forwarded[0] < self._notify_window:
+            self._forwarded[key] = forwarded
+            self._hits += 1
+            return True
+        if forwarded is None:
+            self._usn_keys.setdefault(message.usn, set()).add(key)
+        self._forwarded[key] = (now, message.max_age)
+        while len(self._forwarded) > self._notify_cache_size:
+            evicted = self._forwarded.popitem(last=False)[0]
+            keys = self._usn_keys[evicted[0]]
+            keys.discard(evicted)
+            if len(keys) == 0:
+                del self._usn_keys[evicted[0]]
+        self._misses += 1
+        return False
+
+    @property
+    def hits(self):
+        '''The number of repeated alive messages that were suppressed.'''
+        return self._hits
+
+    @property
+    def misses(self):
+        '''The number of alive messages that were forwarded.'''
+        return self._misses
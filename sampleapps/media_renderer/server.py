@@ -59,7 +59,7 @@ if __name__ == '__main__':
 #    portal_server = BaseServer(("", port), channel="ui").register(application)
 #    portal = Portal(portal_server, title="CoCy").register(application)
 #    PortletsFactory().register(application)
-#    dev_dir = UPnPDeviceDirectory().register(application)
+#    dev_dir = UPnPDeviceDirectory(application.app_dir).register(application)
 
     # The server    
     upnp_dev_server \
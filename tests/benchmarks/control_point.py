@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Invokes ``GetStatus`` on a local binary light (i.e. on its
+:class:`cocy.upnp.adapters.home_automation.BinarySwitchPowerController`)
+with a :class:`cocy.upnp.control_point.UPnPControlPoint` and reports
+the calls per second. "concurrent" is the number of calls that are
+passed to the control point before waiting for a result.
+
+.. codeauthor:: mnl
+"""
+from circuits.core.manager import Manager
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.core.events import Event
+from cocy.providers import BinarySwitch, Manifest
+from cocy.upnp import UPnPDeviceServer, UPNP_ROOTDEVICE
+from cocy.upnp.device_directory import UPnPDeviceDirectory
+from cocy.upnp.control_point import UPnPControlPoint
+from cocy.upnp.ssdp import UPnPDeviceAlive
+import cocy.upnp.adapters
+import threading
+import tempfile
+import shutil
+import time
+import six
+
+SWITCH_POWER = "urn:schemas-upnp-org:service:SwitchPower:1"
+
+class Light(BinarySwitch):
+
+    def __init__(self):
+        super(Light, self).__init__(Manifest("Benchmark light", "Light"))
+
+
+class Bench(BaseComponent):
+
+    channel = "bench"
+
+    def __init__(self, control_point):
+        super(Bench, self).__init__()
+        self._control_point = control_point
+        self.done = True
+
+    def run(self, device, calls, concurrent):
+        self._device = device
+        self._service = [s for s in device.description.all_services()
+                         if s.service_type == SWITCH_POWER][0]
+        self._calls = calls
+        self._sent = 0
+        self.completed = 0
+        self.failed = 0
+        self.done = False
+        self.started = time.time()
+        self.fire(Event.create("bench_start", concurrent))
+
+    @handler("bench_start")
+    def _on_bench_start(self, concurrent):
+        for i in range(concurrent):
+            self._invoke()
+
+    def _invoke(self):
+        if self._sent >= self._calls:
+            return
+        self._sent += 1
+        self._control_point.invoke(self._device, self._service, "GetStatus",
+                                   {}, self.channel)
+
+    def _finished(self):
+        if self.completed + self.failed == self._calls:
+            self.duration = time.time() - self.started
+            self.done = True
+        else:
+            self._invoke()
+
+    @handler("action_result")
+    def _on_action_result(self, tag, out_args):
+        self.completed += 1
+        self._finished()
+
+    @handler("action_failed")
+    def _on_action_failed(self, tag, error):
+        self.failed += 1
+        self._finished()
+
+
+class StopWaiter(BaseComponent):
+
+    def __init__(self):
+        super(StopWaiter, self).__init__()
+        self.stopped = threading.Event()
+
+    @handler("stopped", channel="*")
+    def _on_stopped(self, component):
+        self.stopped.set()
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise RuntimeError("Timeout")
+        time.sleep(0.01)
+
+def main():
+    path = tempfile.mkdtemp()
+    manager = Manager()
+    server = UPnPDeviceServer(path).register(manager)
+    Light().register(manager)
+    directory = UPnPDeviceDirectory().register(manager)
+    control_point = UPnPControlPoint(directory).register(manager)
+    bench = Bench(control_point).register(manager)
+    waiter = StopWaiter().register(manager)
+    manager.start()
+    try:
+        wait_for(lambda: len(server._devices) > 0)
+        adapter = server._devices[0]
+        usn = "uuid:%s::%s" % (adapter.uuid, UPNP_ROOTDEVICE)
+        manager.fire(UPnPDeviceAlive
+                     ("http://127.0.0.1:%d%s/description.xml"
+                      % (server.web_server.port, adapter.path),
+                      UPNP_ROOTDEVICE, 1800, "Benchmark", usn,
+                      adapter.config_id))
+        wait_for(lambda: directory.index.by_usn(usn) is not None)
+        device = directory.index.by_usn(usn)
+        # Warm up (retrieves the SCPD)
+        bench.run(device, 10, 1)
+        wait_for(lambda: bench.done)
+        for concurrent in [1, 8, 64]:
+            bench.run(device, 2000, concurrent)
+            wait_for(lambda: bench.done, timeout=120)
+            six.print_("%3d concurrent: %7.0f calls/s (%d failed)"
+                       % (concurrent, bench.completed / bench.duration,
+                          bench.failed))
+    finally:
+        manager.stop()
+        # The databases are closed when handling the stopped event
+        waiter.stopped.wait(5)
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Builds the ``LastChange`` value of an AVTransport service after a
+track change (eight changed variables, including the DIDL-Lite
+metadata) and after a volume change (one variable). The "element tree"
+variant is the former implementation that built and serialized an
+element tree, the "streaming" variant is 
+:func:`cocy.upnp.adapters.audio_video.build_last_change`.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.adapters.audio_video import build_last_change
+from cocy.upnp import UPNP_AVT_EVENT_NS
+from cocy import misc
+from xml.etree.ElementTree import Element, QName, ElementTree, SubElement
+from collections import OrderedDict
+from io import BytesIO
+import time
+import six
+
+METADATA = '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" ' \
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" ' \
+    'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/">' \
+    '<item id="1" parentID="0" restricted="1"><dc:title>Track</dc:title>' \
+    '<upnp:class>object.item.audioItem.musicTrack</upnp:class>' \
+    '<res protocolInfo="http-get:*:audio/mpeg:*">http://host/track.mp3</res>' \
+    '</item></DIDL-Lite>'
+
+TRACK_CHANGE = OrderedDict([("TransportState", "PLAYING"),
+                            ("AVTransportURI", "http://host/track.mp3"),
+                            ("CurrentTrackURI", "http://host/track.mp3"),
+                            ("AVTransportURIMetaData", METADATA),
+                            ("CurrentTrackMetaData", METADATA),
+                            ("CurrentTrackDuration", "0:03:45"),
+                            ("CurrentMediaDuration", "0:03:45"),
+                            ("NextAVTransportURI", "")])
+
+VOLUME_CHANGE = { "Volume": "50" }
+
+def build_with_element_tree(event_ns, changes):
+    root = Element(QName(event_ns, "Event"))
+    inst = SubElement(root, QName(event_ns, "InstanceID"), { "val": "0" })
+    for name, value in changes.items():
+        SubElement(inst, QName(event_ns, name), { "val": value })
+    misc.set_ns_prefixes(root, { "": event_ns })
+    writer = BytesIO()
+    ElementTree(root).write(writer, encoding="utf-8")
+    return writer.getvalue().decode("utf-8")
+
+def measure(build, changes, count=20000):
+    started = time.time()
+    for i in range(count):
+        build(UPNP_AVT_EVENT_NS, changes)
+    return count / (time.time() - started)
+
+def main():
+    for changes_name, changes in [("track change", TRACK_CHANGE),
+                                  ("volume change", VOLUME_CHANGE)]:
+        assert build_last_change(UPNP_AVT_EVENT_NS, changes) \
+            == build_with_element_tree(UPNP_AVT_EVENT_NS, changes)
+        for name, build in [("element tree", build_with_element_tree),
+                            ("streaming", build_last_change)]:
+            six.print_("%-14s %-13s %9.0f documents/s" 
+                       % (changes_name + ":", name, measure(build, changes)))
+
+if __name__ == '__main__':
+    main()
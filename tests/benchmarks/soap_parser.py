@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Parses UPnP control requests and reports the requests per second.
+The "full" variant is the former implementation that decoded the
+complete body and used soaplib's ``from_soap``, the "fast path" 
+variant is :func:`cocy.misc.parseSoapRequest` that parses the raw
+bytes directly.
+
+.. codeauthor:: mnl
+"""
+from cocy.misc import parseSoapRequest
+from cocy.soaplib.soap import from_soap, collapse_swa
+from io import BytesIO
+import time
+import six
+
+AVT = "urn:schemas-upnp-org:service:AVTransport:1"
+
+ENVELOPE = '<?xml version="1.0" encoding="utf-8"?>' \
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" ' \
+    's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">' \
+    '<s:Body>%s</s:Body></s:Envelope>'
+
+METADATA = '&lt;DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/' \
+    'DIDL-Lite/" xmlns:dc="http://purl.org/dc/elements/1.1/" ' \
+    'xmlns:upnp="urn:schemas-upnp-org:metadata-1-0/upnp/"&gt;' \
+    '&lt;item id="1" parentID="0" restricted="1"&gt;&lt;dc:title&gt;' \
+    'Track&lt;/dc:title&gt;&lt;upnp:class&gt;' \
+    'object.item.audioItem.musicTrack&lt;/upnp:class&gt;' \
+    '&lt;res protocolInfo="http-get:*:audio/mpeg:*"&gt;' \
+    'http://host/track.mp3&lt;/res&gt;&lt;/item&gt;&lt;/DIDL-Lite&gt;'
+
+REQUESTS = [
+    ("GetPositionInfo",
+     ENVELOPE % ('<u:GetPositionInfo xmlns:u="%s"><InstanceID>0'
+                 '</InstanceID></u:GetPositionInfo>' % AVT)),
+    ("SetAVTransportURI",
+     ENVELOPE % ('<u:SetAVTransportURI xmlns:u="%s"><InstanceID>0'
+                 '</InstanceID><CurrentURI>http://host/track.mp3'
+                 '</CurrentURI><CurrentURIMetaData>%s</CurrentURIMetaData>'
+                 '</u:SetAVTransportURI>' % (AVT, METADATA)))]
+
+class Request(object):
+
+    def __init__(self, body, content_type):
+        self.headers = { "SOAPAction": '"%s#Action"' % AVT,
+                         "Content-Type": content_type }
+        self.body = BytesIO(body)
+
+
+def parse_full(request):
+    import cgi
+    content_type = cgi.parse_header(request.headers["Content-Type"])
+    body = request.body.read()
+    payload, soapheader = from_soap(body, content_type[1]
+                                    .get("charset", "utf-8"))
+    payload = collapse_swa(content_type, payload)
+    return payload.tag, soapheader, payload
+
+def measure(parse, body, count=20000, repeat=5):
+    best = None
+    for run in range(repeat):
+        started = time.time()
+        for i in range(count):
+            parse(Request(body, 'text/xml; charset="utf-8"'))
+        duration = time.time() - started
+        best = duration if best is None else min(best, duration)
+    return count / best
+
+def main():
+    for action, body in REQUESTS:
+        body = body.encode("utf-8")
+        for name, parse in [("full", parse_full),
+                            ("fast path", parseSoapRequest)]:
+            six.print_("%-18s %-10s %9.0f requests/s" 
+                       % (action + ":", name, measure(parse, body)))
+
+if __name__ == '__main__':
+    main()
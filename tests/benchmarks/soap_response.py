@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Builds the responses of the polling actions ``GetPositionInfo`` and
+``GetTransportInfo`` and reports the responses per second. The 
+"element tree" variant is the former implementation that built a
+result element and serialized it with 
+:func:`cocy.misc.buildSoapResponse`, the "template" variant is
+:func:`cocy.misc.buildSoapActionResponse`.
+
+.. codeauthor:: mnl
+"""
+from cocy.misc import buildSoapResponse, buildSoapActionResponse
+from xml.etree.ElementTree import Element, SubElement
+import time
+import six
+
+AVT = "urn:schemas-upnp-org:service:AVTransport:1"
+
+METADATA = '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/" ' \
+    'xmlns:dc="http://purl.org/dc/elements/1.1/"><item id="1" parentID="0" ' \
+    'restricted="1"><dc:title>Track</dc:title></item></DIDL-Lite>'
+
+ACTIONS = [
+    ("GetPositionInfo", [("Track", 1), ("TrackDuration", "0:03:45"),
+                         ("TrackMetaData", METADATA),
+                         ("TrackURI", "http://host/track.mp3"),
+                         ("RelTime", "0:01:12"), ("AbsTime", "NOT_IMPLEMENTED"),
+                         ("RelCount", 2147483647), ("AbsCount", 2147483647)]),
+    ("GetTransportInfo", [("CurrentTransportState", "PLAYING"),
+                          ("CurrentTransportStatus", "OK"),
+                          ("CurrentSpeed", "1")])]
+
+class Response(object):
+
+    def __init__(self):
+        self.headers = dict()
+
+
+def build_with_element_tree(response, action_ns, action, out_args):
+    result = Element("{%s}%sResponse" % (action_ns, action))
+    for name, value in out_args:
+        arg = SubElement(result, name)
+        arg.text = str(value)
+    return buildSoapResponse(response, result)
+
+def measure(build, action, out_args, count=20000, repeat=5):
+    best = None
+    for run in range(repeat):
+        started = time.time()
+        for i in range(count):
+            build(Response(), AVT, action, out_args)
+        duration = time.time() - started
+        best = duration if best is None else min(best, duration)
+    return count / best
+
+def main():
+    for action, out_args in ACTIONS:
+        assert build_with_element_tree(Response(), AVT, action, out_args) \
+            == buildSoapActionResponse(Response(), AVT, action, out_args)
+        for name, build in [("element tree", build_with_element_tree),
+                            ("template", buildSoapActionResponse)]:
+            six.print_("%-17s %-13s %9.0f responses/s" 
+                       % (action + ":", name, 
+                          measure(build, action, out_args)))
+
+if __name__ == '__main__':
+    main()
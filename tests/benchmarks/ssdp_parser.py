@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Compares :func:`cocy.upnp.ssdp.parse_ssdp_message` with the line
+parser previously used by the SSDP receiver.
+
+.. codeauthor:: mnl
+"""
+from timeit import timeit
+from cocy.upnp.ssdp import parse_ssdp_message
+import six
+
+MESSAGE = b"NOTIFY * HTTP/1.1\r\n" \
+    b"Host: 239.255.255.250:1900\r\n" \
+    b"Cache-Control: max-age=1800\r\n" \
+    b"Location: http://192.168.1.2:1400/xml/device_description.xml\r\n" \
+    b"NT: urn:schemas-upnp-org:service:AVTransport:1\r\n" \
+    b"NTS: ssdp:alive\r\n" \
+    b"Server: Linux UPnP/1.0 Sonos/26.1-76230 (ZPS1)\r\n" \
+    b"USN: uuid:RINCON_000E58000000001400::" \
+    b"urn:schemas-upnp-org:service:AVTransport:1\r\n" \
+    b"X-RINCON-HOUSEHOLD: Sonos_0123456789\r\n" \
+    b"X-RINCON-BOOTSEQ: 42\r\n" \
+    b"BOOTID.UPNP.ORG: 42\r\n" \
+    b"CONFIGID.UPNP.ORG: 1\r\n" \
+    b"\r\n"
+
+def istartswith(line, prefix):
+    return line[0:len(prefix)].upper() == prefix
+
+def parse_lines(data):
+    lines = data.decode("utf-8").splitlines()
+    res = type("", (), {})()
+    for line in lines[1:]:
+        if istartswith(line, "CACHE-CONTROL:"):
+            s = line.split(":", 1)[1].strip()
+            setattr(res, "max_age", int(s.split("=", 1)[1].strip()))
+        elif istartswith(line, "LOCATION:"):
+            setattr(res, "location", line.split(":", 1)[1].strip())
+        elif istartswith(line, "NT:"):
+            setattr(res, "notification_type", 
+                    line.split(":", 1)[1].strip())
+        elif istartswith(line, "ST:"):
+            setattr(res, "notification_type", 
+                    line.split(":", 1)[1].strip())
+        elif istartswith(line, "NTS:"):
+            setattr(res, "sub_type", line.split(":", 1)[1].strip())
+        elif istartswith(line, "SERVER:"):
+            setattr(res, "server", line.split(":", 1)[1].strip())
+        elif istartswith(line, "USN:"):
+            setattr(res, "usn", line.split(":", 1)[1].strip())
+    return res
+
+def main(number=100000):
+    previous = timeit(lambda: parse_lines(MESSAGE), number=number)
+    current = timeit(lambda: parse_ssdp_message(MESSAGE), number=number)
+    six.print_("Previous parser: %.2f us/message" % (previous / number * 1e6))
+    six.print_("Current parser:  %.2f us/message" % (current / number * 1e6))
+    six.print_("Speedup:         %.1fx" % (previous / current))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+Sends bursts of SSDP datagrams through an
+:class:`cocy.upnp.ssdp.SSDPInterfaceServer` for the loopback
+interface, with the event loop running. A burst is one announcement
+of a media renderer (3 device and 3 service notifications) as
+rendered by :class:`cocy.upnp.ssdp.SSDPSender`, addressed to a
+local receiver. The "per event" variant fires a ``write`` event for 
+every datagram, which sends one datagram per poll of the event loop. 
+The "batched" variant fires a single 
+:class:`cocy.upnp.ssdp.WriteBatch` event.
+
+.. codeauthor:: mnl
+"""
+from circuits.core.manager import Manager
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.net.sockets import Write
+from cocy.upnp.ssdp import SSDPInterfaceServer, SSDPSender, WriteBatch
+import threading
+import socket
+import time
+import six
+
+INTERFACE = "127.0.0.1"
+
+class ServiceStub(object):
+
+    def __init__(self, type_ver):
+        self.type_ver = type_ver
+
+
+class RendererStub(object):
+
+    uuid = "4d696e69-444c-164e-9d41-001ec92f0ac9"
+    root_device = True
+    type_ver = "MediaRenderer:1"
+    services = [ServiceStub(type_ver) for type_ver in
+                ["RenderingControl:1", "ConnectionManager:1",
+                 "AVTransport:1"]]
+    config_id = 1
+    web_server_port = 8080
+
+
+class ReadyWaiter(BaseComponent):
+
+    def __init__(self, channel):
+        super(ReadyWaiter, self).__init__(channel=channel)
+        self.ready = threading.Event()
+
+    @handler("ready")
+    def _on_ready(self, *args):
+        self.ready.set()
+
+
+def burst(address):
+    sender = SSDPSender([INTERFACE])
+    sender._send_notifications(RendererStub(), "available",
+                               sender._field_values())
+    return [(address, data) for to, data in sender._output[INTERFACE]]
+
+def measure(batched, bursts=2000):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    receiver.bind((INTERFACE, 0))
+    receiver.settimeout(5)
+    datagrams = burst(receiver.getsockname())
+    manager = Manager()
+    server = SSDPInterfaceServer(INTERFACE).register(manager)
+    waiter = ReadyWaiter(server.channel).register(manager)
+    manager.start()
+    waiter.ready.wait(5)
+    latency = 0
+    started = time.time()
+    for i in range(bursts):
+        burst_started = time.time()
+        if batched:
+            manager.fire(WriteBatch(datagrams), server.channel)
+        else:
+            for address, data in datagrams:
+                manager.fire(Write(address, data), server.channel)
+        for j in range(len(datagrams)):
+            receiver.recv(1500)
+        latency += time.time() - burst_started
+    duration = time.time() - started
+    manager.stop()
+    receiver.close()
+    return (bursts * len(datagrams) / duration, latency / bursts)
+
+def main():
+    for name, batched in [("per event", False), ("batched", True)]:
+        throughput, latency = measure(batched)
+        six.print_("%-12s %9.0f datagrams/s, %6.1f us/burst" 
+                   % (name + ":", throughput, latency * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.control_point import UPnPControlPoint, UPnPActionError, \
+    build_action_request, parse_action_response
+from cocy.upnp.device_directory import UPnPDeviceDirectory
+from cocy.upnp.description import parse_description, parse_scpd
+from cocy.upnp import UPNP_ROOTDEVICE
+from unittest import TestCase
+from xml.etree.ElementTree import XML
+import os
+
+SWITCH_POWER = "urn:schemas-upnp-org:service:SwitchPower:1"
+
+DESCRIPTION = b"""<?xml version="1.0"?>
+<root xmlns="urn:schemas-upnp-org:device-1-0">
+  <specVersion><major>1</major><minor>1</minor></specVersion>
+  <device>
+    <deviceType>urn:schemas-upnp-org:device:BinaryLight:1</deviceType>
+    <friendlyName>Light</friendlyName>
+    <UDN>uuid:1</UDN>
+    <serviceList>
+      <service>
+        <serviceType>urn:schemas-upnp-org:service:SwitchPower:1</serviceType>
+        <serviceId>urn:upnp-org:serviceId:SwitchPower</serviceId>
+        <SCPDURL>/SwitchPower_1/service.xml</SCPDURL>
+        <controlURL>/1/SwitchPower/control</controlURL>
+        <eventSubURL>/1/SwitchPower/sub</eventSubURL>
+      </service>
+    </serviceList>
+  </device>
+</root>
+"""
+
+SCPD_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "cocy",
+                         "upnp", "services", "SwitchPower_1.xml")
+
+RESPONSE = b"""<?xml version="1.0"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+<s:Body><u:GetStatusResponse 
+xmlns:u="urn:schemas-upnp-org:service:SwitchPower:1">
+<ResultStatus>1</ResultStatus></u:GetStatusResponse></s:Body></s:Envelope>
+"""
+
+FAULT = b"""<?xml version="1.0"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">
+<s:Body><s:Fault><faultcode>s:Client</faultcode>
+<faultstring>UPnPError</faultstring><detail>
+<UPnPError xmlns="urn:schemas-upnp-org:control-1-0">
+<errorCode>402</errorCode><errorDescription>Invalid Args</errorDescription>
+</UPnPError></detail></s:Fault></s:Body></s:Envelope>
+"""
+
+class ResponseStub(object):
+
+    def __init__(self, status, body):
+        self.status = status
+        self._body = body
+
+    def read(self):
+        return self._body
+
+
+class TestControlPoint(TestCase):
+
+    def setUp(self):
+        self.directory = UPnPDeviceDirectory()
+        usn = "uuid:1::" + UPNP_ROOTDEVICE
+        self.directory._on_device_alive \
+            ("http://192.168.1.1:4711/description.xml", UPNP_ROOTDEVICE,
+             1800, "Test", usn, 1)
+        self.device = self.directory._root_devices[usn]
+        self.device._initialize(parse_description(DESCRIPTION))
+        self.service = self.device.description.services[0]
+        with open(SCPD_FILE, "rb") as f:
+            scpd = parse_scpd(f.read())
+        cache = self.directory.scpd_cache
+        cache._store(cache._by_key, cache._key(self.device, self.service),
+                     scpd)
+        self.control_point = UPnPControlPoint(self.directory)
+        self.submitted = []
+        self.control_point.pool.submit = lambda method, url, **kwargs: \
+            self.submitted.append((method, url, kwargs))
+        self.fired = []
+        self.control_point.fire = lambda event, *channels: \
+            self.fired.append((event.name, event.args, channels[0]))
+
+    def test_request(self):
+        body = build_action_request(SWITCH_POWER, "SetTarget",
+                                    [("newTargetValue", True)])
+        payload = XML(body).find \
+            ("{http://schemas.xmlsoap.org/soap/envelope/}Body")[0]
+        self.assertEqual(payload.tag, "{%s}SetTarget" % SWITCH_POWER)
+        self.assertEqual(payload.findtext("newTargetValue"), "1")
+
+    def test_response(self):
+        self.assertEqual(dict(parse_action_response(RESPONSE)),
+                         { "ResultStatus": "1" })
+        try:
+            parse_action_response(FAULT)
+            self.fail()
+        except UPnPActionError as error:
+            self.assertEqual((error.code, error.description),
+                             (402, "Invalid Args"))
+
+    def test_invoke(self):
+        self.control_point.invoke(self.device, self.service, "GetStatus",
+                                  {}, "me", tag="status")
+        method, url, kwargs = self.submitted[0]
+        self.assertEqual((method, url), 
+            ("POST", "http://192.168.1.1:4711/1/SwitchPower/control"))
+        self.assertEqual(kwargs["headers"]["SOAPACTION"],
+                         '"%s#GetStatus"' % SWITCH_POWER)
+        self.control_point._on_pooled_response \
+            (kwargs["tag"], ResponseStub(200, RESPONSE))
+        self.assertEqual(self.fired[0][0], "action_result")
+        self.assertEqual(self.fired[0][1][0], "status")
+        self.assertEqual(dict(self.fired[0][1][1]), { "ResultStatus": "1" })
+        self.assertEqual(self.control_point.pending, 0)
+
+    def test_invalid(self):
+        self.control_point.invoke(self.device, self.service, "SetTarget",
+                                  {}, "me", tag="set")
+        self.control_point.invoke(self.device, self.service, "Dim",
+                                  {}, "me", tag="dim")
+        self.assertEqual(self.submitted, [])
+        self.assertEqual([(f[1][0], f[1][1].code) for f in self.fired],
+                         [("set", 402), ("dim", 401)])
+
+    def test_scpd_kept(self):
+        requested = []
+        scpd = self.directory.scpd
+        self.directory.scpd = lambda *args: \
+            requested.append(args) or scpd(*args)
+        for i in range(3):
+            self.control_point.invoke(self.device, self.service, "GetStatus",
+                                      {}, "me")
+        self.assertEqual(len(requested), 1)
+        self.assertEqual(len(self.submitted), 3)
+        # A new configuration requires the SCPD from the directory
+        self.device.config_id = 2
+        self.control_point.invoke(self.device, self.service, "GetStatus",
+                                  {}, "me")
+        self.assertEqual(len(requested), 2)
+        # As does a device that has left
+        self.device.config_id = 1
+        self.control_point._on_device_bye_bye(self.device.usn)
+        self.control_point.invoke(self.device, self.service, "GetStatus",
+                                  {}, "me")
+        self.assertEqual(len(requested), 3)
+
+    def test_no_retries(self):
+        self.assertEqual(self.control_point.pool._retries, 0)
@@ -0,0 +1,117 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.device_directory import UPnPDeviceDirectory
+from cocy.upnp.description import parse_description
+from cocy.upnp import UPNP_ROOTDEVICE
+from unittest import TestCase
+import tempfile
+import shutil
+
+DESCRIPTION = b"""<?xml version="1.0"?>
+<root xmlns="urn:schemas-upnp-org:device-1-0">
+  <specVersion><major>1</major><minor>1</minor></specVersion>
+  <device>
+    <deviceType>urn:schemas-upnp-org:device:MediaRenderer:1</deviceType>
+    <friendlyName>Renderer</friendlyName>
+    <UDN>uuid:11111111-2222-3333-4444-555555555555</UDN>
+    <iconList>
+      <icon>
+        <mimetype>image/png</mimetype>
+        <width>32</width><height>32</height><depth>24</depth>
+        <url>/icons/32.png</url>
+      </icon>
+    </iconList>
+    <serviceList>
+      <service>
+        <serviceType>urn:schemas-upnp-org:service:RenderingControl:1</serviceType>
+        <serviceId>urn:upnp-org:serviceId:RenderingControl</serviceId>
+        <SCPDURL>/rc.xml</SCPDURL>
+        <controlURL>/rc/control</controlURL>
+        <eventSubURL>/rc/events</eventSubURL>
+      </service>
+    </serviceList>
+    <deviceList>
+      <device>
+        <deviceType>urn:schemas-upnp-org:device:BinaryLight:1</deviceType>
+        <friendlyName>Light</friendlyName>
+        <UDN>uuid:11111111-2222-3333-4444-666666666666</UDN>
+      </device>
+    </deviceList>
+  </device>
+</root>
+"""
+
+USN = "uuid:11111111-2222-3333-4444-555555555555::" + UPNP_ROOTDEVICE
+
+class TestDescriptionCache(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_parse(self):
+        description = parse_description(DESCRIPTION)
+        self.assertEqual(description.friendly_name, "Renderer")
+        self.assertEqual([(i.width, i.height, i.url) 
+                          for i in description.icons],
+                         [(32, 32, "/icons/32.png")])
+        self.assertEqual([d.device_type for d in description.all_devices()],
+                         ["urn:schemas-upnp-org:device:MediaRenderer:1",
+                          "urn:schemas-upnp-org:device:BinaryLight:1"])
+        self.assertEqual(description.devices[0].udn,
+                         "uuid:11111111-2222-3333-4444-666666666666")
+        service = description.services[0]
+        self.assertEqual((service.scpd_url, service.control_url,
+                          service.event_sub_url),
+                         ("/rc.xml", "/rc/control", "/rc/events"))
+
+    def test_cached(self):
+        directory = UPnPDeviceDirectory(self.path)
+        directory._on_device_alive("http://192.168.1.2:8080/desc.xml",
+                                   UPNP_ROOTDEVICE, 1800, "Test", USN, 7)
+        device = directory._root_devices[USN]
+        self.assertFalse(device.ready)
+        self.assertEqual(directory.fetch_pool.queue_depth
+                         + directory.fetch_pool.in_flight, 1)
+        description = parse_description(DESCRIPTION)
+        directory._cache_description(device.udn, 7, description)
+        # Stopping closes (and thus writes) the database
+        directory._on_stopped(None)
+        self.assertEqual(directory._description_db, None)
+        directory._cache_description(device.udn, 7, description)
+
+        # A restarted directory gets the description from the cache
+        directory = UPnPDeviceDirectory(self.path)
+        directory._on_device_alive("http://192.168.1.3:8080/desc.xml",
+                                   UPNP_ROOTDEVICE, 1800, "Test", USN, 7)
+        device = directory._root_devices[USN]
+        self.assertTrue(device.ready)
+        self.assertEqual(device.friendly_name, "Renderer")
+        self.assertEqual(device.icons[0].url,
+                         "http://192.168.1.3:8080/icons/32.png")
+        self.assertEqual(directory.fetch_pool.queue_depth
+                         + directory.fetch_pool.in_flight, 0)
+
+        # ... unless the configuration has changed
+        self.assertEqual(directory._cached_description(device.udn, 8), None)
+        directory._description_db.close()
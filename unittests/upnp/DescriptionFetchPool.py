@@ -0,0 +1,142 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from circuits.core.manager import Manager
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from circuits.web.servers import BaseServer
+from circuits.web.controllers import Controller
+from circuits_bricks.web import ScopeDispatcher, ScopedChannel
+from cocy.upnp.http_pool import HTTPClientPool
+from unittest import TestCase
+from six.moves import http_client
+import time
+
+DESCRIPTION = """<?xml version="1.0"?>
+<root xmlns="urn:schemas-upnp-org:device-1-0">
+  <specVersion><major>1</major><minor>0</minor></specVersion>
+  <device>
+    <deviceType>urn:schemas-upnp-org:device:BinaryLight:1</deviceType>
+    <friendlyName>Light %d</friendlyName>
+    <UDN>uuid:00000000-0000-0000-0000-%012d</UDN>
+  </device>
+</root>
+"""
+
+class Descriptions(Controller):
+    """
+    Stand-in for the devices, serves a generated description for
+    every device number.
+    """
+
+    channel = ScopedChannel("descriptions", "/")
+
+    def __init__(self):
+        super(Descriptions, self).__init__()
+        self.requests = 0
+
+    def device(self, number):
+        self.requests += 1
+        self.response.headers["Content-Type"] = "text/xml"
+        return DESCRIPTION % (int(number), int(number))
+
+
+class ResultRecorder(BaseComponent):
+
+    channel = "fetch-results"
+
+    def __init__(self):
+        super(ResultRecorder, self).__init__()
+        self.responses = dict()
+        self.status = dict()
+        self.failures = dict()
+        self.connects = 0
+
+    @handler("pooled_response")
+    def _on_pooled_response(self, tag, response):
+        self.status[tag] = response.status
+        self.responses[tag] = response.read()
+
+    @handler("connect", channel="descriptions")
+    def _on_connect(self, sock, *args):
+        self.connects += 1
+
+    @handler("pooled_request_failed")
+    def _on_pooled_request_failed(self, tag, error):
+        self.failures[tag] = error
+
+
+class TestDescriptionFetchPool(TestCase):
+
+    def setUp(self):
+        self.manager = Manager()
+        self.server = BaseServer(("localhost", 8123), channel="descriptions")
+        self.server.register(self.manager)
+        ScopeDispatcher(channel="descriptions").register(self.server)
+        self.descriptions = Descriptions().register(self.manager)
+        self.recorder = ResultRecorder().register(self.manager)
+        self.pool = HTTPClientPool(max_connections=2, retries=2,
+                                   backoff=0.05).register(self.manager)
+        self.manager.start()
+
+    def tearDown(self):
+        self.manager.stop()
+        self.server.server.close()
+
+    def _wait_for(self, count):
+        for i in range(100):
+            if len(self.recorder.responses) \
+                + len(self.recorder.failures) >= count:
+                break
+            time.sleep(0.05)
+
+    def test_fetch(self):
+        for number in range(50):
+            self.pool.submit("GET", "http://localhost:8123/device/%d"
+                             % number, channel="fetch-results", tag=number)
+        # All requests go to the same host and are queued on its
+        # connection
+        self.assertTrue(self.pool.in_flight <= 1)
+        self._wait_for(50)
+        self.assertEqual(len(self.recorder.responses), 50)
+        self.assertEqual(len(self.recorder.failures), 0)
+        self.assertEqual(set(self.recorder.status.values()),
+                         set([http_client.OK]))
+        for number, body in self.recorder.responses.items():
+            self.assertTrue(("<friendlyName>Light %d</friendlyName>"
+                             % number).encode("utf-8") in body)
+        self.assertEqual(self.descriptions.requests, 50)
+        self.assertEqual(self.pool.queue_depth, 0)
+        self.assertEqual(self.pool.in_flight, 0)
+        self.assertEqual(self.pool.completed, 50)
+        self.assertEqual(self.pool.connections, 1)
+        # ... and that connection was used for all requests
+        self.assertEqual(self.recorder.connects, 1)
+
+    def test_retry(self):
+        # Nothing listens on this port
+        self.pool.submit("GET", "http://localhost:8124/device/1",
+                         channel="fetch-results", tag="unreachable")
+        self._wait_for(1)
+        self.assertEqual(list(self.recorder.failures.keys()),
+                         ["unreachable"])
+        self.assertEqual(self.pool.retried, 2)
+        self.assertEqual(self.pool.failed, 1)
+        self.assertEqual(self.pool.queue_depth, 0)
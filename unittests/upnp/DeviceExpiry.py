@@ -0,0 +1,74 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.device_directory import UPnPDeviceDirectory
+from cocy.upnp import UPNP_ROOTDEVICE
+from unittest import TestCase
+import time
+
+class GenerateEventsStub(object):
+
+    def __init__(self):
+        self.time_left = None
+
+    def reduce_time_left(self, time_left):
+        if self.time_left is None or time_left < self.time_left:
+            self.time_left = time_left
+
+
+class TestDeviceExpiry(TestCase):
+
+    def setUp(self):
+        self.directory = UPnPDeviceDirectory()
+        self.byebyes = []
+        self.directory.fire = lambda event, *channels: \
+            self.byebyes.append(event.args[0])
+
+    def _alive(self, number, max_age):
+        self.directory._on_device_alive \
+            ("http://localhost/%d" % number, UPNP_ROOTDEVICE, max_age,
+             "Test", "uuid:%d::%s" % (number, UPNP_ROOTDEVICE))
+
+    def test_expiry(self):
+        for number in range(10):
+            self._alive(number, 0.05 if number % 2 == 0 else 60)
+        usn = "uuid:2::" + UPNP_ROOTDEVICE
+        self.assertTrue(self.directory.valid_until(usn) > time.time())
+        event = GenerateEventsStub()
+        self.directory._on_generate_events(event)
+        self.assertEqual(self.byebyes, [])
+        self.assertTrue(event.time_left <= 0.05)
+        # Renew device 2 only
+        self._alive(2, 60)
+        time.sleep(0.1)
+        event = GenerateEventsStub()
+        self.directory._on_generate_events(event)
+        self.assertEqual(sorted(self.byebyes),
+                         ["uuid:%d::%s" % (number, UPNP_ROOTDEVICE)
+                          for number in (0, 4, 6, 8)])
+        self.assertEqual(self.directory.valid_until
+                         ("uuid:0::" + UPNP_ROOTDEVICE), None)
+        self.assertTrue(self.directory.valid_until(usn) > time.time() + 50)
+        self.assertTrue(event.time_left > 50)
+
+    def test_heap_compaction(self):
+        for i in range(1000):
+            self._alive(1, 60)
+        self.assertTrue(len(self.directory._expiry_heap) <= 68)
@@ -0,0 +1,127 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.device_directory import UPnPDeviceDirectory
+from cocy.upnp.description import parse_description
+from cocy.upnp import UPNP_ROOTDEVICE
+from unittest import TestCase
+
+LIGHT = "urn:schemas-upnp-org:device:BinaryLight:1"
+SWITCH_POWER = "urn:schemas-upnp-org:service:SwitchPower:1"
+
+DESCRIPTION = """<?xml version="1.0"?>
+<root xmlns="urn:schemas-upnp-org:device-1-0">
+  <specVersion><major>1</major><minor>0</minor></specVersion>
+  <device>
+    <deviceType>urn:schemas-upnp-org:device:BinaryLight:1</deviceType>
+    <friendlyName>%s</friendlyName>
+    <UDN>uuid:%d</UDN>
+    <serviceList>
+      <service>
+        <serviceType>urn:schemas-upnp-org:service:SwitchPower:1</serviceType>
+        <serviceId>urn:upnp-org:serviceId:SwitchPower</serviceId>
+        <SCPDURL>/scpd.xml</SCPDURL>
+        <controlURL>/control</controlURL>
+        <eventSubURL>/events</eventSubURL>
+      </service>
+    </serviceList>
+    <deviceList>
+      <device>
+        <deviceType>urn:test:device:Embedded:1</deviceType>
+        <friendlyName>Embedded</friendlyName>
+        <UDN>uuid:%d-embedded</UDN>
+      </device>
+    </deviceList>
+  </device>
+</root>
+"""
+
+def description(number, name, embedded=None):
+    return parse_description(DESCRIPTION % (name, number, embedded or number))
+
+
+class TestDeviceIndex(TestCase):
+
+    def setUp(self):
+        self.directory = UPnPDeviceDirectory()
+        self.feed = self.directory.change_feed()
+
+    def _add(self, number, name, host="192.168.1.2", embedded=None):
+        usn = "uuid:%d::%s" % (number, UPNP_ROOTDEVICE)
+        self.directory._on_device_alive \
+            ("http://%s:8080/%d.xml" % (host, number), UPNP_ROOTDEVICE,
+             1800, "Test", usn)
+        device = self.directory._root_devices[usn]
+        device._initialize(description(number, name, embedded))
+        return device
+
+    def test_lookup(self):
+        kitchen = self._add(1, "Kitchen Light")
+        hall = self._add(2, "Hall Light", host="192.168.1.3")
+        kettle = self._add(3, "Kettle")
+        index = self.directory.index
+        self.assertEqual(len(index), 3)
+        self.assertEqual(self.directory.devices, [hall, kettle, kitchen])
+        self.assertTrue(index.by_usn(kitchen.usn) is kitchen)
+        self.assertTrue(index.by_udn("uuid:2") is hall)
+        self.assertTrue(index.by_udn("uuid:2-embedded") is hall)
+        self.assertEqual(len(index.by_device_type(LIGHT)), 3)
+        self.assertEqual(len(index.by_service_type(SWITCH_POWER)), 3)
+        self.assertEqual(index.by_host("192.168.1.3"), [hall])
+        services = index.services_by_type(SWITCH_POWER)
+        self.assertEqual(len(services), 3)
+        self.assertEqual(services[0][1].control_url, "/control")
+        self.assertEqual(index.by_name_prefix("k"), [kettle, kitchen])
+        self.assertEqual(index.by_name_prefix("KITCHEN"), [kitchen])
+        self.assertEqual(index.by_name_prefix("x"), [])
+
+    def test_change_feed(self):
+        kitchen = self._add(1, "Kitchen Light")
+        self.assertEqual([(c.kind, c.device) for c in self.feed],
+                         [("added", kitchen)])
+        self.assertEqual(list(self.feed), [])
+        kitchen._initialize(description(1, "Kitchen"))
+        kitchen._remove()
+        self.assertEqual([(c.kind, c.device) for c in self.feed],
+                         [("updated", kitchen), ("removed", kitchen)])
+        self.assertEqual(len(self.directory.index), 0)
+        self.assertEqual(self.directory.index.by_name_prefix("k"), [])
+        self.assertEqual(self.directory.index.by_service_type
+                         (SWITCH_POWER), [])
+
+    def test_overflow(self):
+        feed = self.directory.index.change_feed(max_changes=2)
+        for number in range(3):
+            self._add(number, "Light %d" % number)
+        self.assertTrue(feed.overflowed)
+        self.assertEqual(len(feed), 2)
+
+    def test_shared_udn(self):
+        # The embedded device has moved to another root device
+        first = self._add(1, "First")
+        second = self._add(2, "Second", embedded=1)
+        index = self.directory.index
+        self.assertTrue(index.by_udn("uuid:1-embedded") is second)
+        first._remove()
+        self.assertTrue(index.by_udn("uuid:1-embedded") is second)
+        self.assertEqual(index.by_udn("uuid:1"), None)
+        second._remove()
+        self.assertEqual(index.by_udn("uuid:1-embedded"), None)
+        self.assertEqual(len(index._by_udn), 0)
@@ -0,0 +1,96 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.device_server import UPnPDeviceServer
+from cocy.providers import Provider, Manifest
+from circuits.core.components import BaseComponent
+from unittest import TestCase
+import tempfile
+import shutil
+
+class ProviderStub(Provider):
+
+    def __init__(self, unique_id):
+        super(ProviderStub, self).__init__(Manifest(unique_id, unique_id))
+
+
+class ServiceStub(object):
+
+    def __init__(self, type_ver):
+        self.type_ver = type_ver
+
+
+class DeviceStub(object):
+
+    def __init__(self, uuid, provider):
+        self.uuid = uuid
+        self.provider = provider
+        self.root_device = True
+        self.type_ver = "BinaryLight:1"
+        self.services = [ServiceStub("SwitchPower:1")]
+        self.registered = True
+
+    def unregister(self):
+        self.registered = False
+
+
+class TestDeviceUnregister(TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.server = UPnPDeviceServer(self.path)
+        self.fired = []
+        self.server.fireEvent = lambda event, *channels: \
+            self.fired.append((event.name, event.args[0].uuid))
+        self.providers = [ProviderStub("p1"), ProviderStub("p2")]
+        self.devices = [DeviceStub(str(number), provider)
+                        for number, provider in enumerate(self.providers)]
+        for device in self.devices:
+            self.server._devices.append(device)
+            self.server._search_index.add(device)
+        self.server._started = True
+
+    def tearDown(self):
+        self.server._uuid_db.close()
+        shutil.rmtree(self.path)
+
+    def test_unregister(self):
+        self.server._on_unregister(self.providers[0], None)
+        self.assertEqual(self.server.providers, [self.providers[1]])
+        self.assertFalse(self.devices[0].registered)
+        self.assertTrue(self.devices[1].registered)
+        self.assertEqual(self.fired, [("device_unavailable", "0")])
+        # No more search responses for the removed device
+        self.assertEqual(set(device.uuid for device, nt in 
+                             self.server._search_index.resolve("ssdp:all")),
+                         set(["1"]))
+
+    def test_other_component(self):
+        self.server._on_unregister(BaseComponent(), None)
+        self.assertEqual(self.server.providers, self.providers)
+        self.assertEqual(self.fired, [])
+
+    def test_not_started(self):
+        self.server._started = False
+        self.server._on_unregister(self.providers[1], None)
+        self.assertEqual(self.server.providers, [self.providers[0]])
+        self.assertEqual(self.fired, [])
+        self.assertEqual(len(self.server._search_index.resolve("ssdp:all")),
+                         4)
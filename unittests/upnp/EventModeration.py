@@ -0,0 +1,149 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.adapters.adapter import UPnPServiceController, upnp_state, \
+    Moderation
+from cocy.upnp.adapters.audio_video import \
+    UPnPCombinedEventsServiceController, RenderingController
+from cocy.upnp.gena import parse_propertyset, parse_last_change
+from cocy.upnp import UPNP_RCS_EVENT_NS
+import cocy.upnp.adapters.adapter as adapter_module
+import cocy.upnp.adapters.audio_video as audio_video_module
+from unittest import TestCase
+
+class ProviderStub(object):
+    channel = "renderer"
+    volume = 0.5
+
+
+class AdapterStub(object):
+    uuid = "1"
+    notify_pool = None
+    provider = ProviderStub()
+
+
+class ClockStub(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class GenerateEventsStub(object):
+
+    def reduce_time_left(self, time_left):
+        self.time_left = time_left
+
+
+class Controller(UPnPServiceController):
+
+    @upnp_state(evented_by="volume", max_rate=2, min_delta=5)
+    def Volume(self):
+        return 0
+
+    @upnp_state(evented_by="state")
+    def Status(self):
+        return False
+
+
+class CombinedController(UPnPCombinedEventsServiceController):
+
+    @upnp_state(evented_by=None, max_rate=5,
+                moderated={ "Volume": Moderation(min_delta=5) })
+    def LastChange(self):
+        return super(CombinedController, self).LastChange()
+
+
+class TestEventModeration(TestCase):
+
+    def setUp(self):
+        self.clock = ClockStub()
+        self._saved = adapter_module.time, audio_video_module.time
+        adapter_module.time = self.clock
+        audio_video_module.time = self.clock.time
+        self.events = []
+
+    def tearDown(self):
+        adapter_module.time, audio_video_module.time = self._saved
+
+    def _controller(self, cls, *args):
+        controller = cls(AdapterStub(), "/1", None, "service", *args)
+        controller.fire = lambda event, *channels: \
+            self.events.append(parse_propertyset(event.args[1]()))
+        return controller
+
+    def _generate_events(self, controller):
+        event = GenerateEventsStub()
+        controller._on_generate_events(event)
+        return getattr(event, "time_left", None)
+
+    def test_plain_variable(self):
+        controller = self._controller(Controller)
+        controller._on_provider_updated({ "volume": 10 })
+        self.assertEqual(self.events[-1]["Volume"], "10")
+        # Too early, held back and replaced
+        self.clock.now += 0.1
+        controller._on_provider_updated({ "volume": 20, "state": True })
+        self.assertEqual(dict(self.events[-1]), { "Status": "1" })
+        controller._on_provider_updated({ "volume": 30 })
+        self.assertEqual(len(self.events), 2)
+        self.assertAlmostEqual(self._generate_events(controller), 0.4)
+        self.clock.now += 0.4
+        self.assertEqual(self._generate_events(controller), None)
+        self.assertEqual(dict(self.events[-1]), { "Volume": "30" })
+        self.assertEqual(controller.moderator.dropped, 1)
+        # Delta too small
+        self.clock.now += 1
+        controller._on_provider_updated({ "volume": 33 })
+        self.assertEqual(len(self.events), 3)
+        self.assertEqual(controller.moderator.dropped, 2)
+
+    def test_last_change(self):
+        controller = self._controller(CombinedController, UPNP_RCS_EVENT_NS)
+        controller.addChange("Volume", 10)
+        self.assertEqual(len(self.events), 1)
+        controller.addChange("Volume", 12)
+        controller.addChange("Mute", 1)
+        # LastChange is limited to 5 events per second
+        self.assertEqual(len(self.events), 1)
+        self.clock.now += 0.1
+        controller.addChange("Volume", 20)
+        self.assertAlmostEqual(self._generate_events(controller), 0.1)
+        self.clock.now += 0.1
+        self._generate_events(controller)
+        self.assertEqual(len(self.events), 2)
+        self.assertEqual(dict(parse_last_change(self.events[-1]["LastChange"])
+                              ["0"]), { "Mute": "1", "Volume": "20" })
+
+    def test_volume(self):
+        controller = self._controller(RenderingController)
+        for volume in range(40, 50):
+            controller._map_changes({ "volume": volume / 100.0 })
+            self.clock.now += 0.05
+        # First change sent, the others held back by the rule for
+        # Volume (LastChange alone would allow three more events)
+        self.assertEqual(len(self.events), 1)
+        self.clock.now = 1000.5
+        self._generate_events(controller)
+        self.assertEqual(len(self.events), 2)
+        self.assertEqual(dict(parse_last_change(self.events[-1]["LastChange"])
+                              ["0"]), { "Volume": "49" })
@@ -0,0 +1,169 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.adapters.adapter import UPnPSubscription, Notification
+from cocy.upnp.gena import parse_propertyset, parse_last_change
+from unittest import TestCase
+from xml.etree.ElementTree import XML
+
+LAST_CHANGE = '<Event xmlns="urn:schemas-upnp-org:metadata-1-0/RCS/">' \
+    '<InstanceID val="0"><%s val="%s"/></InstanceID></Event>'
+CHANNEL_CHANGE = '<Event xmlns="urn:schemas-upnp-org:metadata-1-0/RCS/">' \
+    '<InstanceID val="0"><%s channel="%s" val="%s"/></InstanceID></Event>'
+
+class ResponseStub(object):
+
+    def __init__(self, status):
+        self.status = status
+
+
+class PoolStub(object):
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, method, url, channel, tag=None, body=None, headers={}):
+        self.submitted.append((url, tag, body, headers))
+
+
+class TestGENANotification(TestCase):
+
+    def setUp(self):
+        self.pool = PoolStub()
+
+    def _subscription(self, *callbacks):
+        subscription = UPnPSubscription(list(callbacks), 0, "HTTP/1.1",
+                                        self.pool)
+        subscription.fire = lambda event, *channels: None
+        subscription.unregister = lambda: self.evicted.append(subscription)
+        self.evicted = []
+        return subscription
+
+    def test_shared_body(self):
+        subscriptions = [self._subscription("http://127.0.0.1:%d/cb"
+                                            % (5000 + number))
+                         for number in range(3)]
+        notification = Notification({ "Status": True, "Target": 1 })
+        # Not serialized before it is sent
+        self.assertEqual(notification.args[1]._body, None)
+        for subscription in subscriptions:
+            subscription._on_notification(*notification.args)
+        sent = self.pool.submitted
+        self.assertEqual(len(sent), 3)
+        body = notification.args[1]()
+        self.assertTrue(all(s[2] is body for s in sent))
+        self.assertEqual(dict(parse_propertyset(body)),
+                         { "Status": "1", "Target": "1" })
+        # Only SID and SEQ differ
+        self.assertEqual(len(set(s[3]["SID"] for s in sent)), 3)
+        self.assertEqual([s[3]["SEQ"] for s in sent], ["0", "0", "0"])
+        subscriptions[0]._on_pooled_response(sent[0][1], ResponseStub(200))
+        subscriptions[0]._on_notification(*notification.args)
+        self.assertEqual(sent[-1][3]["SEQ"], "1")
+
+    def test_failover(self):
+        subscription = self._subscription("http://10.0.0.1/cb",
+                                          "http://10.0.0.2/cb")
+        notification = Notification({ "Status": True })
+        subscription._on_notification(*notification.args)
+        url, delivery, body, headers = self.pool.submitted[-1]
+        self.assertEqual(url, "http://10.0.0.1/cb")
+        subscription._on_pooled_request_failed(delivery, "refused")
+        url, delivery, body, headers = self.pool.submitted[-1]
+        self.assertEqual((url, headers["SEQ"]), ("http://10.0.0.2/cb", "0"))
+        subscription._on_pooled_response(delivery, ResponseStub(200))
+        # Later messages use the working URL
+        subscription._on_notification(*notification.args)
+        self.assertEqual(self.pool.submitted[-1][0], "http://10.0.0.2/cb")
+        self.assertEqual(self.evicted, [])
+
+    def test_eviction(self):
+        subscription = self._subscription("http://10.0.0.1/cb")
+        notification = Notification({ "Status": True })
+        for i in range(UPnPSubscription.max_failures):
+            self.assertEqual(self.evicted, [])
+            subscription._on_notification(*notification.args)
+            subscription._on_pooled_request_failed \
+                (self.pool.submitted[-1][1], "timeout")
+        self.assertEqual(self.evicted, [subscription])
+        # Rejected event messages cause immediate eviction
+        subscription = self._subscription("http://10.0.0.1/cb")
+        subscription._on_notification(*notification.args)
+        subscription._on_pooled_response(self.pool.submitted[-1][1],
+                                         ResponseStub(412))
+        self.assertEqual(self.evicted, [subscription])
+
+    def test_ordered_and_coalesced(self):
+        subscription = self._subscription("http://10.0.0.1/cb")
+        subscription._on_notification(*Notification({ "Status": 0 }).args)
+        # Queued while the first message is being delivered
+        for value in range(1, 4):
+            subscription._on_notification \
+                (*Notification({ "Status": value, "Target": value }).args)
+        subscription._on_notification \
+            (*Notification({ "LastChange": LAST_CHANGE % ("Volume", 10) })
+             .args)
+        subscription._on_notification \
+            (*Notification({ "LastChange": LAST_CHANGE % ("Volume", 20) })
+             .args)
+        subscription._on_notification \
+            (*Notification({ "LastChange": LAST_CHANGE % ("Mute", 1) })
+             .args)
+        self.assertEqual(len(self.pool.submitted), 1)
+        self.assertEqual(subscription.queue_length, 6)
+        subscription._on_pooled_response(self.pool.submitted[0][1],
+                                         ResponseStub(200))
+        self.assertEqual(len(self.pool.submitted), 2)
+        self.assertEqual(subscription.queue_length, 0)
+        self.assertEqual(subscription.coalesced, 5)
+        # Status and Target twice each, Volume once
+        self.assertEqual(subscription.dropped, 5)
+        url, delivery, body, headers = self.pool.submitted[1]
+        self.assertEqual(headers["SEQ"], "1")
+        properties = parse_propertyset(body)
+        self.assertEqual((properties["Status"], properties["Target"]),
+                         ("3", "3"))
+        self.assertEqual(dict(parse_last_change(properties["LastChange"])
+                              ["0"]), { "Volume": "20", "Mute": "1" })
+
+    def test_coalesced_channels(self):
+        subscription = self._subscription("http://10.0.0.1/cb")
+        subscription._on_notification(*Notification({ "Status": 0 }).args)
+        for channel, value in [("Master", 10), ("LF", 20), ("Master", 30)]:
+            subscription._on_notification \
+                (*Notification({ "LastChange": CHANNEL_CHANGE
+                                 % ("Volume", channel, value) }).args)
+        subscription._on_pooled_response(self.pool.submitted[0][1],
+                                         ResponseStub(200))
+        # Only the first Master volume is superseded
+        self.assertEqual(subscription.dropped, 1)
+        properties = parse_propertyset(self.pool.submitted[1][2])
+        instance = XML(properties["LastChange"].encode("utf-8"))[0]
+        self.assertEqual([(var.get("channel"), var.get("val"))
+                          for var in instance],
+                         [("Master", "30"), ("LF", "20")])
+
+    def test_queue_limit(self):
+        subscription = self._subscription("http://10.0.0.1/cb")
+        for value in range(UPnPSubscription.max_queued * 3):
+            subscription._on_notification \
+                (*Notification({ "Status": value }).args)
+        self.assertTrue(subscription.queue_length
+                        <= UPnPSubscription.max_queued)
@@ -0,0 +1,207 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.gena import GENASubscriber, parse_propertyset, \
+    parse_last_change
+from cocy.upnp.device_directory import UPnPRootDevice
+from cocy.upnp.description import parse_description
+from cocy.upnp import UPNP_ROOTDEVICE
+from unittest import TestCase
+import cocy.upnp.gena as gena_module
+
+DESCRIPTION = b"""<?xml version="1.0"?>
+<root xmlns="urn:schemas-upnp-org:device-1-0">
+  <specVersion><major>1</major><minor>1</minor></specVersion>
+  <device>
+    <deviceType>urn:schemas-upnp-org:device:MediaRenderer:1</deviceType>
+    <friendlyName>Renderer</friendlyName>
+    <UDN>uuid:1</UDN>
+    <serviceList>
+      <service>
+        <serviceType>urn:schemas-upnp-org:service:AVTransport:1</serviceType>
+        <serviceId>urn:upnp-org:serviceId:AVTransport</serviceId>
+        <SCPDURL>/AVTransport_1/service.xml</SCPDURL>
+        <controlURL>/1/AVTransport/control</controlURL>
+        <eventSubURL>/1/AVTransport/sub</eventSubURL>
+      </service>
+    </serviceList>
+  </device>
+</root>
+"""
+
+PROPERTYSET = b"""<?xml version="1.0"?>
+<e:propertyset xmlns:e="urn:schemas-upnp-org:event-1-0">
+<e:property><LastChange>&lt;Event
+xmlns="urn:schemas-upnp-org:metadata-1-0/AVT/"&gt;&lt;InstanceID
+val="0"&gt;&lt;TransportState val="PLAYING"/&gt;&lt;/InstanceID&gt;&lt;/Event&gt;
+</LastChange></e:property>
+<e:property><Status>1</Status></e:property>
+</e:propertyset>
+"""
+
+class HeadersStub(dict):
+    pass
+
+
+class ResponseStub(object):
+
+    def __init__(self, status, headers):
+        self.status = status
+        self.headers = HeadersStub(headers)
+
+
+class GenerateEventsStub(object):
+
+    def __init__(self):
+        self.time_left = None
+
+    def reduce_time_left(self, time_left):
+        self.time_left = time_left
+
+
+class ClockStub(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TestGENASubscriber(TestCase):
+
+    def setUp(self):
+        self.clock = ClockStub()
+        self._saved = gena_module.time
+        gena_module.time = self.clock
+        self.subscriber = GENASubscriber(renewal_window=60)
+        self.submitted = []
+        self.subscriber._pool.submit = lambda method, url, **kwargs: \
+            self.submitted.append((method, url, kwargs))
+        self.fired = []
+        self.subscriber.fire = lambda event, *channels: \
+            self.fired.append((event.name, event.args, channels[0]))
+
+    def tearDown(self):
+        gena_module.time = self._saved
+
+    def _device(self, number):
+        device = UPnPRootDevice("http://127.0.0.1:%d/description.xml"
+                                % (5000 + number),
+                                "uuid:%d::%s" % (number, UPNP_ROOTDEVICE))
+        device._initialize(parse_description(DESCRIPTION))
+        return device, device.description.services[0]
+
+    def test_parse(self):
+        properties = parse_propertyset(PROPERTYSET)
+        self.assertEqual(list(properties.keys()), ["LastChange", "Status"])
+        self.assertEqual(dict(parse_last_change(properties["LastChange"])
+                              ["0"]), { "TransportState": "PLAYING" })
+
+    def test_batched_renewals(self):
+        subscriptions = []
+        for number in range(10):
+            device, service = self._device(number)
+            subscriptions.append(self.subscriber.subscribe(device, service,
+                                                           "me"))
+        self.assertEqual(len(self.submitted), 10)
+        method, url, kwargs = self.submitted[0]
+        self.assertEqual((method, url),
+            ("SUBSCRIBE", "http://127.0.0.1:5000/1/AVTransport/sub"))
+        self.assertTrue(kwargs["headers"]["CALLBACK"]
+                        .startswith("<http://127.0.0.1:"))
+        # Confirm with timeouts from 100 to 190 seconds
+        for number, (method, url, kwargs) in enumerate(self.submitted):
+            self.subscriber._on_pooled_response \
+                (kwargs["tag"], ResponseStub(200, { "SID": "uuid:s%d" % number,
+                                 "TIMEOUT": "Second-%d"
+                                 % (100 + number * 10) }))
+        self.assertEqual(self.subscriber.subscriptions, 10)
+        del self.submitted[:]
+        # Renewals are due after 40, 50, 60 ... seconds. Make the first 
+        # subscription due, the next two are within the renewal window.
+        self.subscriber._schedule_renewal(subscriptions[0], 0)
+        self.subscriber._on_generate_events(GenerateEventsStub())
+        self.assertEqual(sorted([kwargs["headers"]["SID"]
+                                 for method, url, kwargs in self.submitted]),
+                         ["uuid:s%d" % number for number in range(3)])
+        self.assertEqual(self.subscriber.renewed, 3)
+
+    def test_notify(self):
+        device, service = self._device(1)
+        subscription = self.subscriber.subscribe(device, service, "me")
+        self.subscriber._on_pooled_response \
+            (self.submitted[0][2]["tag"],
+             ResponseStub(200, { "SID": "uuid:s1",
+                                 "TIMEOUT": "Second-1800" }))
+        self.subscriber._on_notify(subscription, 0, PROPERTYSET)
+        name, args, channel = self.fired[0]
+        self.assertEqual((name, channel), ("properties_changed", "me"))
+        self.assertTrue(args[0] is subscription)
+        self.assertEqual(args[1]["LastChange"]["0"]["TransportState"],
+                         "PLAYING")
+
+    def test_short_timeout(self):
+        device, service = self._device(1)
+        subscription = self.subscriber.subscribe(device, service, "me")
+        # Granted timeout is shorter than the renewal window
+        self.subscriber._on_pooled_response \
+            (self.submitted[0][2]["tag"],
+             ResponseStub(200, { "SID": "uuid:s1", "TIMEOUT": "Second-30" }))
+        del self.submitted[:]
+        self.assertEqual(subscription.renew_at, 1015.0)
+        event = GenerateEventsStub()
+        self.subscriber._on_generate_events(event)
+        self.assertEqual(self.submitted, [])
+        self.assertEqual(event.time_left, 15.0)
+        self.clock.now = 1015.0
+        self.subscriber._on_generate_events(GenerateEventsStub())
+        self.assertEqual(len(self.submitted), 1)
+        self.subscriber._on_pooled_response \
+            (self.submitted[0][2]["tag"],
+             ResponseStub(200, { "SID": "uuid:s1", "TIMEOUT": "Second-30" }))
+        self.assertEqual(subscription.renew_at, 1030.0)
+        self.subscriber._on_generate_events(GenerateEventsStub())
+        self.assertEqual(self.subscriber.renewed, 1)
+
+    def test_notify_before_response(self):
+        device, service = self._device(1)
+        subscription = self.subscriber.subscribe(device, service, "me")
+        # Initial event message overtakes the response
+        self.assertTrue(self.subscriber._on_notify_received
+                        ("uuid:s1", 0, PROPERTYSET))
+        self.assertTrue(self.subscriber._on_notify_received
+                        ("uuid:s1", 1, PROPERTYSET.replace(b"<Status>1",
+                                                           b"<Status>0")))
+        self.assertEqual(self.fired, [])
+        self.subscriber._on_pooled_response \
+            (self.submitted[0][2]["tag"],
+             ResponseStub(200, { "SID": "uuid:s1",
+                                 "TIMEOUT": "Second-1800" }))
+        self.assertEqual([args[1]["Status"] for name, args, channel
+                          in self.fired], ["1", "0"])
+        self.assertEqual(subscription.seq, 1)
+        self.assertTrue(self.subscriber._on_notify_received
+                        ("uuid:s1", 2, PROPERTYSET))
+        self.assertEqual(len(self.fired), 3)
+        # Nothing pending, unknown SIDs are rejected
+        self.assertFalse(self.subscriber._on_notify_received
+                         ("uuid:s2", 0, PROPERTYSET))
+        self.assertEqual(len(self.subscriber._early), 0)
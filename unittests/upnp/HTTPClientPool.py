@@ -0,0 +1,82 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.http_pool import HTTPClientPool
+from unittest import TestCase
+
+class ResponseStub(object):
+
+    status = 200
+
+
+class TestHTTPClientPool(TestCase):
+
+    def setUp(self):
+        self.pool = HTTPClientPool(retries=0)
+        self.fired = []
+        self.pool.fire = lambda event, *channels: \
+            self.fired.append((event.name, event.args[0]))
+
+    def _connection(self):
+        return list(self.pool._connections.values())[0]
+
+    def _submit(self, tag):
+        self.pool.submit("GET", "http://192.168.1.2:8080/%s" % tag,
+                         channel="me", tag=tag)
+
+    def test_idle_disconnected(self):
+        self._submit("1")
+        connection = self._connection()
+        connection._on_response(ResponseStub())
+        self.assertEqual(self.fired, [("pooled_response", "1")])
+        self.assertEqual(self.pool.connections, 1)
+        # Closed by the host while idle
+        connection._on_disconnected()
+        self.assertEqual(self.pool.connections, 0)
+        self._submit("2")
+        self.assertFalse(self._connection() is connection)
+        self.assertEqual(self.pool.in_flight, 1)
+
+    def test_resend_on_reused(self):
+        self._submit("1")
+        connection = self._connection()
+        connection._on_response(ResponseStub())
+        self._submit("2")
+        self.assertTrue(connection.reused)
+        # Fails although no retries are configured, resent at once
+        connection._on_disconnected()
+        self.assertEqual(self.fired, [("pooled_response", "1")])
+        self.assertEqual(self.pool.retried, 1)
+        resent = self._connection()
+        self.assertFalse(resent is connection)
+        self.assertEqual(resent._request.tag, "2")
+        self.assertEqual(resent._request.attempts, 1)
+        # But only once
+        resent._on_socket_error(OSError("Connection refused"))
+        self.assertEqual(self.fired[-1][0], "pooled_request_failed")
+        self.assertEqual(self.pool.failed, 1)
+        self.assertEqual(self.pool.connections, 0)
+        self.assertEqual(self.pool.in_flight, 0)
+
+    def test_no_resend_on_new(self):
+        self._submit("1")
+        self._connection()._on_socket_error(OSError("Connection refused"))
+        self.assertEqual(self.fired[-1], ("pooled_request_failed", "1"))
+        self.assertEqual(self.pool.retried, 0)
@@ -0,0 +1,66 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.adapters.audio_video import build_last_change
+from cocy.upnp import UPNP_AVT_EVENT_NS, UPNP_RCS_EVENT_NS
+from cocy import misc
+from xml.etree.ElementTree import Element, QName, ElementTree, SubElement
+from collections import OrderedDict
+from io import BytesIO
+from unittest import TestCase
+
+METADATA = '<DIDL-Lite xmlns="urn:schemas-upnp-org:metadata-1-0/DIDL-Lite/">' \
+    '<item id="1" parentID="0" restricted="1">\n\t<dc:title>Rock &amp; ' \
+    'Roll\r\n</dc:title></item></DIDL-Lite>'
+
+def build_with_element_tree(event_ns, changes):
+    root = Element(QName(event_ns, "Event"))
+    inst = SubElement(root, QName(event_ns, "InstanceID"), { "val": "0" })
+    for name, value in changes.items():
+        SubElement(inst, QName(event_ns, name), { "val": value })
+    misc.set_ns_prefixes(root, { "": event_ns })
+    writer = BytesIO()
+    ElementTree(root).write(writer, encoding="utf-8")
+    return writer.getvalue().decode("utf-8")
+
+
+class TestLastChangeWriter(TestCase):
+
+    def _check(self, event_ns, changes):
+        self.assertEqual(build_last_change(event_ns, changes),
+                         build_with_element_tree(event_ns, changes))
+
+    def test_empty(self):
+        self._check(UPNP_RCS_EVENT_NS, {})
+
+    def test_simple(self):
+        self._check(UPNP_RCS_EVENT_NS, { "Volume": "50" })
+        self.assertEqual(build_last_change(UPNP_RCS_EVENT_NS,
+                                           { "Volume": "50" }),
+                         '<Event xmlns="%s"><InstanceID val="0">'
+                         '<Volume val="50" /></InstanceID></Event>'
+                         % UPNP_RCS_EVENT_NS)
+
+    def test_escaping(self):
+        self._check(UPNP_AVT_EVENT_NS, OrderedDict
+                    ([("TransportState", "PLAYING"),
+                      ("AVTransportURI", "http://host/a?b=1&c=\"2\""),
+                      ("AVTransportURIMetaData", METADATA),
+                      ("CurrentTrackURI", u"http://host/Müller <1>")]))
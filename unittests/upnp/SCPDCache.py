@@ -0,0 +1,143 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.device_directory import UPnPDeviceDirectory
+from cocy.upnp.description import parse_description
+from cocy.upnp import UPNP_ROOTDEVICE
+from unittest import TestCase
+import os
+
+DESCRIPTION = b"""<?xml version="1.0"?>
+<root xmlns="urn:schemas-upnp-org:device-1-0">
+  <specVersion><major>1</major><minor>1</minor></specVersion>
+  <device>
+    <deviceType>urn:schemas-upnp-org:device:BinaryLight:1</deviceType>
+    <friendlyName>Light</friendlyName>
+    <UDN>uuid:1</UDN>
+    <serviceList>
+      <service>
+        <serviceType>urn:schemas-upnp-org:service:SwitchPower:1</serviceType>
+        <serviceId>urn:upnp-org:serviceId:SwitchPower</serviceId>
+        <SCPDURL>/SwitchPower_1/service.xml</SCPDURL>
+        <controlURL>/control</controlURL>
+        <eventSubURL>/events</eventSubURL>
+      </service>
+    </serviceList>
+  </device>
+</root>
+"""
+
+SCPD_FILE = os.path.join(os.path.dirname(__file__), "..", "..", "cocy",
+                         "upnp", "services", "SwitchPower_1.xml")
+
+class ResponseStub(object):
+
+    def __init__(self, body):
+        self.status = 200
+        self._body = body
+
+    def read(self):
+        return self._body
+
+
+class TestSCPDCache(TestCase):
+
+    def setUp(self):
+        self.directory = UPnPDeviceDirectory()
+        self.cache = self.directory.scpd_cache
+        self.submitted = []
+        # Record the SCPD requests (their tags) only
+        self.cache._fetch_pool.submit = lambda method, url, **kwargs: \
+            kwargs["channel"] == self.cache.channel \
+            and self.submitted.append(kwargs["tag"])
+        self.fired = []
+        self.cache.fire = lambda event, *channels: \
+            self.fired.append((event.name, event.args[0], channels[0]))
+        with open(SCPD_FILE, "rb") as f:
+            self.scpd_body = f.read()
+
+    def _device(self, number, config_id):
+        usn = "uuid:%d::%s" % (number, UPNP_ROOTDEVICE)
+        self.directory._on_device_alive \
+            ("http://192.168.1.%d/description.xml" % number, UPNP_ROOTDEVICE,
+             1800, "Test", usn, config_id)
+        device = self.directory._root_devices[usn]
+        device._initialize(parse_description(DESCRIPTION))
+        return device, device.description.services[0]
+
+    def _respond(self, tag):
+        self.cache._on_pooled_response(tag, ResponseStub(self.scpd_body))
+
+    def test_cached_by_url(self):
+        device, service = self._device(1, None)
+        for i in range(0, 50):
+            self.assertEqual(self.directory.scpd(device, service, "me"),
+                             None)
+        self.assertEqual(self.submitted,
+                         [("http://192.168.1.1/SwitchPower_1/service.xml",
+                           None)])
+        self._respond(self.submitted[0])
+        self.assertEqual(len(self.fired), 50)
+        self.assertEqual(set(f[0] for f in self.fired),
+                         set(["scpd_available"]))
+        self.assertEqual(self.cache.parsed, 1)
+        # Cached without configuration id
+        scpd = self.directory.scpd(device, service, "me")
+        self.assertTrue("SetTarget" in scpd.actions)
+        self.assertEqual(scpd.state_variables["Status"].data_type, "boolean")
+        self.assertEqual(len(self.submitted), 1)
+
+    def test_not_shared_by_config_id(self):
+        # Same service type, configuration id and relative URL, but
+        # different devices (possibly from different vendors)
+        devices = [self._device(number, 42) for number in range(1, 3)]
+        for device, service in devices:
+            self.directory.scpd(device, service, "me")
+        self.assertEqual(self.submitted,
+                         [("http://192.168.1.1/SwitchPower_1/service.xml", 42),
+                          ("http://192.168.1.2/SwitchPower_1/service.xml", 42)])
+        # Another configuration requires another fetch
+        device, service = devices[0]
+        self._respond(self.submitted[0])
+        self.assertNotEqual(self.directory.scpd(device, service, "me"), None)
+        device.config_id = 43
+        self.assertEqual(self.directory.scpd(device, service, "me"), None)
+        self.assertEqual(len(self.submitted), 3)
+
+    def test_forget_removed(self):
+        device, service = self._device(1, 42)
+        self.directory.scpd(device, service, "me")
+        self._respond(self.submitted[0])
+        self.assertNotEqual(self.directory.scpd(device, service, "me"), None)
+        device._on_device_bye_bye(device.usn)
+        self.assertEqual(len(self.cache._by_key), 0)
+        device, service = self._device(1, 42)
+        self.assertEqual(self.directory.scpd(device, service, "me"), None)
+        self.assertEqual(len(self.submitted), 2)
+
+    def test_shared_by_content(self):
+        devices = [self._device(number, None) for number in range(1, 4)]
+        for device, service in devices:
+            self.directory.scpd(device, service, "me")
+        self.assertEqual(len(self.submitted), 3)
+        for tag in self.submitted:
+            self._respond(tag)
+        self.assertEqual(self.cache.fetched, 3)
+        self.assertEqual(self.cache.parsed, 1)
@@ -0,0 +1,126 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.adapters.adapter import UPnPServiceController, \
+    UPnPServiceError, upnp_service
+from cocy.upnp.adapters.audio_video import AVTransportController
+from cocy.upnp.service import UPnPService
+from xml.etree.ElementTree import XML
+from unittest import TestCase
+
+RCS = "urn:schemas-upnp-org:service:RenderingControl:1"
+AVT = "urn:schemas-upnp-org:service:AVTransport:1"
+
+class ProviderStub(object):
+    channel = "renderer"
+
+
+class AdapterStub(object):
+    uuid = "1"
+    notify_pool = None
+    provider = ProviderStub()
+
+
+class RenderingController(UPnPServiceController):
+
+    @upnp_service
+    def SetVolume(self, **kwargs):
+        self.invoked = kwargs
+        return []
+
+    @upnp_service
+    def GetVolume(self, **kwargs):
+        self.invoked = kwargs
+        return [("CurrentVolume", 50)]
+
+
+class TestSOAPDispatch(TestCase):
+
+    def setUp(self):
+        self.controller = RenderingController \
+            (AdapterStub(), "/1", UPnPService(1, "RenderingControl:1"),
+             "RenderingControl")
+        self.controller.fire = lambda event, *channels: None
+        self.controller._bind_actions()
+
+    def _invoke(self, action, args, ns=RCS):
+        return self.controller._invoke \
+            (XML('<u:%s xmlns:u="%s">%s</u:%s>'
+                 % (action, ns, "".join(["<%s>%s</%s>" % (name, value, name)
+                                         for name, value in args]), action)))
+
+    def _error(self, action, args, ns=RCS):
+        try:
+            self._invoke(action, args, ns)
+        except UPnPServiceError as error:
+            return error.code
+        return None
+
+    def test_table_shared(self):
+        other = RenderingController \
+            (AdapterStub(), "/2", self.controller._service, "RenderingControl")
+        self.assertTrue(other._dispatch_table(other._service)
+                        is self.controller._dispatch_table
+                        (self.controller._service))
+
+    def test_converted(self):
+        self._invoke("SetVolume", [("InstanceID", "0"), ("Channel", "Master"),
+                                   ("DesiredVolume", "42")])
+        self.assertEqual(self.controller.invoked,
+                         { "InstanceID": 0, "Channel": "Master",
+                           "DesiredVolume": 42 })
+        # Other order and other version of the service type
+        self._invoke("SetVolume", [("DesiredVolume", "43"),
+                                   ("InstanceID", "0"), ("Channel", "Master")],
+                     ns=RCS[:-1] + "2")
+        self.assertEqual(self.controller.invoked["DesiredVolume"], 43)
+
+    def test_invalid(self):
+        self.assertEqual(self._error("Play", []), 401)
+        self.assertEqual(self._error("GetVolume", [("InstanceID", "0")]), 402)
+        self.assertEqual(self._error("GetVolume", [("InstanceID", "0"),
+                                                   ("Volume", "Master")]), 402)
+        self.assertEqual(self._error("GetVolume", [("InstanceID", "x"),
+                                                   ("Channel", "Master")]),
+                         600)
+        self.assertEqual(self._error("GetVolume", [("InstanceID", "0"),
+                                                   ("Channel", "Left")]), 600)
+        self.assertEqual(self._error("SetVolume", [("InstanceID", "0"),
+                                                   ("Channel", "Master"),
+                                                   ("DesiredVolume", "101")]),
+                         601)
+
+    def test_service_error_code(self):
+        self.controller = AVTransportController \
+            (AdapterStub(), "/1", UPnPService(1, "AVTransport:1"),
+             "AVTransport")
+        self.controller.fire = lambda event, *channels: None
+        self.controller._bind_actions()
+        # Not in the allowed values
+        self.assertEqual(self._error("Seek", [("InstanceID", "0"),
+                                              ("Unit", "ABS_TIME"),
+                                              ("Target", "1")], AVT), 710)
+        # Allowed, but not supported by the handler
+        self.assertEqual(self._error("Seek", [("InstanceID", "0"),
+                                              ("Unit", "TRACK_NR"),
+                                              ("Target", "1")], AVT), 710)
+        self.assertEqual(self._error("Seek", [("InstanceID", "x"),
+                                              ("Unit", "REL_TIME"),
+                                              ("Target", "1")], AVT), 600)
@@ -0,0 +1,98 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.misc import parseSoapRequest
+from cocy import misc
+from cocy.soaplib.soap import from_soap
+from xml.etree.ElementTree import tostring
+from io import BytesIO
+from unittest import TestCase
+
+AVT = "urn:schemas-upnp-org:service:AVTransport:1"
+
+ENVELOPE = '<?xml version="1.0" encoding="utf-8"?>' \
+    '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" ' \
+    's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">' \
+    '%s<s:Body>%s</s:Body></s:Envelope>'
+
+SET_URI = '<u:SetAVTransportURI xmlns:u="%s"><InstanceID>0</InstanceID>' \
+    '<CurrentURI>http://host/M\xfcller.mp3?a=1&amp;b=2</CurrentURI>' \
+    '<CurrentURIMetaData>&lt;DIDL-Lite&gt;&lt;/DIDL-Lite&gt;' \
+    '</CurrentURIMetaData></u:SetAVTransportURI>' % AVT
+
+class RequestStub(object):
+
+    def __init__(self, body, content_type='text/xml; charset="utf-8"'):
+        self.headers = { "SOAPAction": '"%s#Action"' % AVT,
+                         "Content-Type": content_type }
+        self.body = BytesIO(body)
+
+
+class TestSOAPParser(TestCase):
+
+    def setUp(self):
+        self.full_parsed = 0
+        def from_soap_counted(*args):
+            self.full_parsed += 1
+            return from_soap(*args)
+        misc.from_soap = from_soap_counted
+
+    def tearDown(self):
+        misc.from_soap = from_soap
+
+    def _parse(self, body, header=""):
+        data = (ENVELOPE % (header, body)).encode("utf-8")
+        return parseSoapRequest(RequestStub(data)), data
+
+    def test_fast_path(self):
+        (action, header, payload), data = self._parse(SET_URI)
+        self.assertEqual(action, "{%s}SetAVTransportURI" % AVT)
+        self.assertEqual(header, None)
+        self.assertEqual(self.full_parsed, 0)
+        # Same result as the full parser
+        full_payload, full_header = from_soap(data, "utf-8")
+        self.assertEqual(tostring(payload), tostring(full_payload))
+        self.assertEqual(payload.findtext("CurrentURI"),
+                         u"http://host/M\xfcller.mp3?a=1&b=2")
+
+    def test_header(self):
+        (action, header, payload), data = self._parse \
+            (SET_URI, '<s:Header><h:Token xmlns:h="urn:test">1</h:Token>'
+             '</s:Header>')
+        self.assertEqual(header.tag, "{urn:test}Token")
+        self.assertEqual(payload.tag, "{%s}SetAVTransportURI" % AVT)
+        self.assertEqual(self.full_parsed, 0)
+
+    def test_href_fallback(self):
+        (action, header, payload), data = self._parse \
+            ('<u:Play xmlns:u="%s"><InstanceID href="#id1"/></u:Play>'
+             '<InstanceID id="id1">0</InstanceID>' % AVT)
+        self.assertEqual(self.full_parsed, 1)
+        self.assertEqual(payload.findtext("InstanceID"), "0")
+
+    def test_charset_fallback(self):
+        data = (ENVELOPE % ("", SET_URI)) \
+            .replace('encoding="utf-8"', 'encoding="iso-8859-1"') \
+            .encode("iso-8859-1")
+        request = RequestStub(data, 'text/xml; charset="iso-8859-1"')
+        action, header, payload = parseSoapRequest(request)
+        self.assertEqual(self.full_parsed, 1)
+        self.assertEqual(payload.findtext("CurrentURI"),
+                         u"http://host/M\xfcller.mp3?a=1&b=2")
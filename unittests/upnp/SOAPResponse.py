@@ -0,0 +1,75 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.misc import buildSoapResponse, buildSoapActionResponse
+from xml.etree.ElementTree import Element, SubElement
+from unittest import TestCase
+
+AVT = "urn:schemas-upnp-org:service:AVTransport:1"
+
+GOLDEN = "<?xml version='1.0' encoding='utf-8'?>" \
+    '<ns0:Envelope xmlns:ns0="http://schemas.xmlsoap.org/soap/envelope/" ' \
+    'xmlns:ns1="urn:schemas-upnp-org:service:AVTransport:1">' \
+    '<ns0:Body><ns1:GetTransportInfoResponse>' \
+    '<CurrentTransportState>PLAYING</CurrentTransportState>' \
+    '<CurrentTransportStatus>OK</CurrentTransportStatus>' \
+    '<CurrentSpeed>1</CurrentSpeed>' \
+    '</ns1:GetTransportInfoResponse></ns0:Body></ns0:Envelope>'
+
+class ResponseStub(object):
+
+    def __init__(self):
+        self.headers = dict()
+
+
+def build_with_element_tree(action, out_args):
+    result = Element("{%s}%sResponse" % (AVT, action))
+    for name, value in out_args:
+        SubElement(result, name).text = str(value)
+    return buildSoapResponse(ResponseStub(), result)
+
+
+class TestSOAPResponse(TestCase):
+
+    def _check(self, action, out_args):
+        response = ResponseStub()
+        body = buildSoapActionResponse(response, AVT, action, out_args)
+        self.assertEqual(body, build_with_element_tree(action, out_args))
+        self.assertEqual(response.headers["Content-Type"],
+                         "text/xml; charset=utf-8")
+        return body
+
+    def test_golden(self):
+        out_args = [("CurrentTransportState", "PLAYING"),
+                    ("CurrentTransportStatus", "OK"), ("CurrentSpeed", "1")]
+        self.assertEqual(self._check("GetTransportInfo", out_args), GOLDEN)
+        # Template is reused
+        self.assertEqual(self._check("GetTransportInfo", out_args), GOLDEN)
+
+    def test_values(self):
+        self._check("GetPositionInfo",
+                    [("Track", 1), ("TrackDuration", "0:03:45"),
+                     ("TrackMetaData", '<DIDL-Lite a="1">R&B</DIDL-Lite>'),
+                     ("TrackURI", u"http://host/M\xfcller.mp3?a=1&b=2"),
+                     ("RelTime", ""), ("AbsTime", None),
+                     ("RelCount", 2147483647), ("AbsCount", True)])
+
+    def test_no_out_args(self):
+        self._check("Play", [])
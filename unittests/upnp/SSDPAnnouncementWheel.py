@@ -0,0 +1,109 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.ssdp import SSDPAnnouncementWheel
+from unittest import TestCase
+import cocy.upnp.ssdp as ssdp_module
+
+class DeviceStub(object):
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+class ClockStub(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class GenerateEventsStub(object):
+
+    def __init__(self):
+        self.time_left = None
+
+    def reduce_time_left(self, time_left):
+        if self.time_left is None or time_left < self.time_left:
+            self.time_left = time_left
+
+
+class TestSSDPAnnouncementWheel(TestCase):
+
+    def setUp(self):
+        self.clock = ClockStub()
+        self._saved = ssdp_module.time
+        ssdp_module.time = self.clock
+        self.wheel = SSDPAnnouncementWheel()
+        self.due = []
+        self.wheel.fire = lambda event, *channels: \
+            self.due.append([device.uuid for device in event.args[0]])
+
+    def tearDown(self):
+        ssdp_module.time = self._saved
+
+    def _advance(self, seconds):
+        self.clock.now += seconds
+        event = GenerateEventsStub()
+        self.wheel._on_generate_events(event)
+        return event.time_left
+
+    def test_same_tick(self):
+        for uuid in ["1", "2", "3"]:
+            self.wheel.schedule(DeviceStub(uuid), 0.25)
+        self.assertAlmostEqual(self._advance(0.1), 0.15)
+        self.assertEqual(self.due, [])
+        self.assertEqual(self._advance(0.15), 0)
+        self.assertEqual([sorted(uuids) for uuids in self.due],
+                         [["1", "2", "3"]])
+        self.assertEqual(len(self.wheel._entries), 0)
+
+    def test_rounds(self):
+        # 100 seconds are 400 ticks, more than one rotation
+        self.wheel.schedule(DeviceStub("1"), 100)
+        self.wheel.schedule(DeviceStub("2"), 1)
+        self.assertEqual(self.wheel._entries, { "1": 144, "2": 4 })
+        self._advance(1)
+        self.assertEqual(self.due, [["2"]])
+        # Slot 144 is passed the first time, but a round is left
+        self._advance(40)
+        self.assertEqual(len(self.due), 1)
+        self.assertEqual(self.wheel._wheel[144]["1"][0], 0)
+        self._advance(58.75)
+        self.assertEqual(len(self.due), 1)
+        self._advance(0.25)
+        self.assertEqual(self.due[1], ["1"])
+        self.assertEqual(self.wheel._cursor, 400 % 256)
+
+    def test_reschedule_and_cancel(self):
+        device = DeviceStub("1")
+        self.wheel.schedule(device, 0.25)
+        self.wheel.schedule(device, 1)
+        self._advance(0.5)
+        self.assertEqual(self.due, [])
+        self._advance(0.5)
+        self.assertEqual(self.due, [["1"]])
+        self.wheel.schedule(device, 0.25)
+        self.wheel.cancel("1")
+        self.assertEqual(self._advance(1), None)
+        self.assertEqual(len(self.due), 1)
+        self.assertEqual(sum(len(slot) for slot in self.wheel._wheel), 0)
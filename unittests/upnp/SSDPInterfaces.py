@@ -0,0 +1,90 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from circuits.core.manager import Manager
+from circuits.core.components import BaseComponent
+from circuits.core.handlers import handler
+from cocy.upnp import SSDP_ADDR, SSDP_PORT
+from cocy.upnp.ssdp import SSDPTranceiver, UPnPSearchRequest
+from unittest import TestCase
+import socket
+import time
+
+class SearchRecorder(BaseComponent):
+    
+    channel = "upnp"
+    
+    def __init__(self):
+        super(SearchRecorder, self).__init__()
+        self.searches = []
+
+    @handler("upnp_device_search")
+    def _on_device_search(self, inquirer, search_target, mx=0, 
+                          interface=None):
+        self.searches.append((search_target, interface))
+
+
+class TestSSDPInterfaces(TestCase):
+    """
+    Uses the loopback interface as stand-in for a real network interface.
+    """
+    
+    def setUp(self):
+        self.manager = Manager()
+        self.recorder = SearchRecorder().register(self.manager)
+        self.tranceiver = SSDPTranceiver(interfaces=["127.0.0.1"]) \
+            .register(self.manager)
+        self.manager.start()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('', SSDP_PORT))
+        loopback = socket.inet_aton("127.0.0.1")
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                             socket.inet_aton(SSDP_ADDR) + loopback)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                             loopback)
+        self.sock.settimeout(2)
+
+    def tearDown(self):
+        self.sock.close()
+        self.manager.stop()
+
+    def test_search_received(self):
+        self.assertEqual(self.tranceiver.interfaces, ["127.0.0.1"])
+        self.sock.sendto(b"M-SEARCH * HTTP/1.1\r\n"
+                         b"Host: 239.255.255.250:1900\r\n"
+                         b"MAN: \"ssdp:discover\"\r\n"
+                         b"MX: 1\r\n"
+                         b"ST: ssdp:all\r\n\r\n", (SSDP_ADDR, SSDP_PORT))
+        for i in range(20):
+            if len(self.recorder.searches) > 0:
+                break
+            time.sleep(0.1)
+        self.assertEqual(self.recorder.searches, 
+                         [("ssdp:all", "127.0.0.1")])
+
+    def test_search_sent(self):
+        self.manager.fire(UPnPSearchRequest("ssdp:all"), "ssdp")
+        while True:
+            data, address = self.sock.recvfrom(1500)
+            if data.startswith(b"M-SEARCH "):
+                break
+        self.assertEqual(address[0], "127.0.0.1")
+        self.assertTrue(b"ST: ssdp:all\r\n" in data)
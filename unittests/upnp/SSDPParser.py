@@ -0,0 +1,90 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+   
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+   
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from unittest import TestCase
+from cocy.upnp.ssdp import parse_ssdp_message, SSDPReceiver
+
+ALIVE = b"NOTIFY * HTTP/1.1\r\n" \
+    b"Host: 239.255.255.250:1900\r\n" \
+    b"Cache-Control: max-age=1800\r\n" \
+    b"Location: http://192.168.1.2:49152/description.xml\r\n" \
+    b"NT: upnp:rootdevice\r\n" \
+    b"NTS: ssdp:alive\r\n" \
+    b"Server: Linux/3.2 UPnP/1.1 Test/1.0\r\n" \
+    b"USN: uuid:1234::upnp:rootdevice\r\n" \
+    b"BOOTID.UPNP.ORG: 17\r\n" \
+    b"CONFIGID.UPNP.ORG: 3\r\n" \
+    b"\r\n"
+
+SEARCH = b"M-SEARCH * HTTP/1.1\r\n" \
+    b"Host: 239.255.255.250:1900\r\n" \
+    b"MAN: \"ssdp:discover\"\r\n" \
+    b"mx: 3\r\n" \
+    b"st: ssdp:all\r\n" \
+    b"\r\n"
+
+class TestSSDPParser(TestCase):
+
+    def test_alive(self):
+        message = parse_ssdp_message(ALIVE)
+        self.assertEqual(message.start_line, "NOTIFY * HTTP/1.1")
+        self.assertEqual(message.max_age, 1800)
+        self.assertEqual(message.location, 
+                         "http://192.168.1.2:49152/description.xml")
+        self.assertEqual(message.notification_type, "upnp:rootdevice")
+        self.assertEqual(message.sub_type, "ssdp:alive")
+        self.assertEqual(message.server, "Linux/3.2 UPnP/1.1 Test/1.0")
+        self.assertEqual(message.usn, "uuid:1234::upnp:rootdevice")
+        self.assertEqual(message.boot_id, 17)
+        self.assertEqual(message.config_id, 3)
+        self.assertEqual(message.search_target, None)
+
+    def test_search(self):
+        message = parse_ssdp_message(SEARCH)
+        self.assertEqual(message.start_line, "M-SEARCH * HTTP/1.1")
+        self.assertEqual(message.search_target, "ssdp:all")
+        self.assertEqual(message.mx, 3)
+
+    def test_missing_and_invalid(self):
+        message = parse_ssdp_message(b"NOTIFY * HTTP/1.1\n"
+                                     b"Cache-Control: no-cache\n"
+                                     b"BOOTID.UPNP.ORG: x\n"
+                                     b"garbage\n")
+        self.assertEqual(message.start_line, "NOTIFY * HTTP/1.1")
+        self.assertEqual(message.max_age, None)
+        self.assertEqual(message.boot_id, None)
+        self.assertEqual(message.usn, None)
+        self.assertEqual(parse_ssdp_message(b""), None)
+
+    def test_incomplete_alive(self):
+        receiver = SSDPReceiver()
+        fired = []
+        receiver.fire = lambda event, *channels: fired.append(event)
+        receiver._on_read(("192.168.1.2", 1900), 
+                          ALIVE.replace(b"Location: http://192.168.1.2:49152"
+                                        b"/description.xml\r\n", b""))
+        self.assertEqual(fired, [])
+        receiver._on_read(("192.168.1.2", 1900), 
+                          ALIVE.replace(b"max-age=1800", b"no-cache"))
+        self.assertEqual(len(fired), 1)
+        self.assertEqual(fired[0].name, "upnp_device_alive")
+        location, notification_type, max_age = fired[0].args[:3]
+        self.assertEqual(location, "http://192.168.1.2:49152/description.xml")
+        self.assertEqual(max_age, 1800)
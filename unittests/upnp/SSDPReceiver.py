@@ -0,0 +1,124 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.ssdp import SSDPReceiver
+from unittest import TestCase
+import cocy.upnp.ssdp as ssdp_module
+
+ALIVE = "NOTIFY * HTTP/1.1\r\n" \
+    "Host: 239.255.255.250:1900\r\n" \
+    "Cache-Control: max-age=%(max_age)d\r\n" \
+    "Location: http://192.168.1.2:49152/description.xml\r\n" \
+    "NT: upnp:rootdevice\r\n" \
+    "NTS: ssdp:alive\r\n" \
+    "Server: Linux/3.2 UPnP/1.1 Test/1.0\r\n" \
+    "USN: uuid:%(uuid)s::upnp:rootdevice\r\n" \
+    "BOOTID.UPNP.ORG: %(boot_id)d\r\n" \
+    "\r\n"
+
+BYEBYE = "NOTIFY * HTTP/1.1\r\n" \
+    "Host: 239.255.255.250:1900\r\n" \
+    "NT: upnp:rootdevice\r\n" \
+    "NTS: ssdp:byebye\r\n" \
+    "USN: uuid:%(uuid)s::upnp:rootdevice\r\n" \
+    "\r\n"
+
+class ClockStub(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TestSSDPReceiver(TestCase):
+
+    def setUp(self):
+        self.clock = ClockStub()
+        self._saved = ssdp_module.time
+        ssdp_module.time = self.clock
+        self.receiver = SSDPReceiver()
+        self.fired = []
+        self.receiver.fire = lambda event, *channels: \
+            self.fired.append((event.name, event.channels[0]))
+
+    def tearDown(self):
+        ssdp_module.time = self._saved
+
+    def _alive(self, uuid="1", max_age=1800, boot_id=1):
+        self.receiver._on_read(("192.168.1.2", 1900), (ALIVE % 
+            { "uuid": uuid, "max_age": max_age, "boot_id": boot_id })
+            .encode("ascii"))
+
+    def test_repeated(self):
+        self._alive()
+        self._alive()
+        self._alive()
+        self.assertEqual(len(self.fired), 1)
+        self.assertEqual((self.receiver.hits, self.receiver.misses), (2, 1))
+        # Changed max-age or boot id is forwarded
+        self._alive(max_age=900)
+        self._alive(max_age=900, boot_id=2)
+        self.assertEqual(len(self.fired), 3)
+        self.assertEqual((self.receiver.hits, self.receiver.misses), (2, 3))
+
+    def test_window(self):
+        self._alive()
+        self.clock.now += 9
+        self._alive()
+        self.assertEqual(len(self.fired), 1)
+        # The window starts with the forwarded message
+        self.clock.now += 1
+        self._alive()
+        self.assertEqual(len(self.fired), 2)
+        self.assertEqual((self.receiver.hits, self.receiver.misses), (1, 2))
+
+    def test_least_recently_used(self):
+        self.receiver._notify_cache_size = 2
+        self._alive("1")
+        self._alive("2")
+        # Makes "1" the most recently used entry
+        self._alive("1")
+        self._alive("3")
+        self.assertEqual(len(self.receiver._forwarded), 2)
+        self.assertEqual(sorted(self.receiver._usn_keys.keys()),
+                         ["uuid:1::upnp:rootdevice",
+                          "uuid:3::upnp:rootdevice"])
+        self._alive("1")
+        self.assertEqual(len(self.fired), 3)
+        # "2" has been evicted
+        self._alive("2")
+        self.assertEqual(len(self.fired), 4)
+        self.assertEqual((self.receiver.hits, self.receiver.misses), (2, 4))
+
+    def test_bye_bye(self):
+        self._alive("1")
+        self._alive("1", boot_id=2)
+        self._alive("2")
+        self.receiver._on_read(("192.168.1.2", 1900),
+                               (BYEBYE % { "uuid": "1" }).encode("ascii"))
+        self.assertEqual(self.fired[-1],
+                         ("upnp_device_bye_bye", "uuid:1::upnp:rootdevice"))
+        self.assertEqual(len(self.receiver._forwarded), 1)
+        self.assertEqual(list(self.receiver._usn_keys.keys()),
+                         ["uuid:2::upnp:rootdevice"])
+        self._alive("1")
+        self.assertEqual(len(self.fired), 5)
@@ -0,0 +1,120 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.ssdp import SSDPResponseScheduler
+from unittest import TestCase
+import cocy.upnp.ssdp as ssdp_module
+
+class DeviceStub(object):
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+
+
+class ClockStub(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class RandomStub(object):
+    """Always picks the earliest time."""
+
+    def uniform(self, a, b):
+        return a
+
+
+class GenerateEventsStub(object):
+
+    def __init__(self):
+        self.time_left = None
+
+    def reduce_time_left(self, time_left):
+        if self.time_left is None or time_left < self.time_left:
+            self.time_left = time_left
+
+
+class TestSSDPResponseScheduler(TestCase):
+
+    def setUp(self):
+        self.clock = ClockStub()
+        self._saved = ssdp_module.time, ssdp_module.random
+        ssdp_module.time = self.clock
+        ssdp_module.random = RandomStub()
+        self.scheduler = SSDPResponseScheduler()
+        self.scheduler._rate_limit = 2
+        self.due = []
+        self.scheduler.fire = lambda event, *channels: \
+            self.due.append([device.uuid for device, nt, inquirer, interface
+                             in event.args[0]])
+
+    def tearDown(self):
+        ssdp_module.time, ssdp_module.random = self._saved
+
+    def _responses(self, count):
+        return [(DeviceStub(str(number)), "upnp:rootdevice")
+                for number in range(count)]
+
+    def _generate(self):
+        event = GenerateEventsStub()
+        self.scheduler._on_generate_events(event)
+        return event.time_left
+
+    def test_merged(self):
+        responses = self._responses(3)
+        self.scheduler.schedule(responses, ("10.0.0.1", 1900), 3)
+        self.scheduler.schedule(responses[1:], ("10.0.0.1", 1900), 3)
+        self.assertEqual(self.scheduler.pending, 3)
+        self.assertEqual(self.scheduler.merged, 2)
+        # Another inquirer gets its own responses
+        self.scheduler.schedule(responses, ("10.0.0.2", 1900), 3)
+        self.assertEqual(self.scheduler.pending, 6)
+
+    def test_rate_limit_defers(self):
+        self.scheduler.schedule(self._responses(5), ("10.0.0.1", 1900), 3)
+        self.assertEqual(self._generate(), 0)
+        self.assertEqual(self.due, [["0", "1"]])
+        self.assertEqual(self.scheduler.deferred, 3)
+        self.assertEqual(self.scheduler.pending, 3)
+        # Nothing is sent before the next window
+        self.clock.now = 1000.5
+        self.assertEqual(self._generate(), 0.5)
+        self.assertEqual(len(self.due), 1)
+        self.clock.now = 1001.0
+        self._generate()
+        self.assertEqual(self.due[1], ["2", "3"])
+        self.clock.now = 1002.0
+        self._generate()
+        self.assertEqual(self.due[2], ["4"])
+        self.assertEqual(self.scheduler.deferred, 4)
+        self.assertEqual(self.scheduler.dropped, 0)
+        self.assertEqual(self.scheduler.pending, 0)
+
+    def test_rate_limit_drops(self):
+        # Responses that cannot be sent within MX are dropped
+        self.scheduler.schedule(self._responses(3), ("10.0.0.1", 1900), 0)
+        self.assertEqual(self._generate(), 0)
+        self.assertEqual(self.due, [["0", "1"]])
+        self.assertEqual(self.scheduler.dropped, 1)
+        self.assertEqual(self.scheduler.deferred, 0)
+        self.assertEqual(self.scheduler.pending, 0)
@@ -0,0 +1,117 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.ssdp import SSDPSender, parse_ssdp_message
+from cocy.upnp import UPNP_ROOTDEVICE
+from unittest import TestCase
+import cocy.upnp.ssdp as ssdp_module
+
+class ServiceStub(object):
+
+    def __init__(self, type_ver):
+        self.type_ver = type_ver
+
+
+class DeviceStub(object):
+
+    def __init__(self, uuid):
+        self.uuid = uuid
+        self.root_device = True
+        self.type_ver = "BinaryLight:1"
+        self.services = [ServiceStub("SwitchPower:1")]
+        self.config_id = 1
+        self.web_server_port = 8080
+
+
+class ClockStub(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TestSSDPSender(TestCase):
+
+    def setUp(self):
+        self.clock = ClockStub()
+        self._saved = ssdp_module.time
+        ssdp_module.time = self.clock
+        self.sender = SSDPSender(["192.168.1.2", "10.0.0.2"])
+        self.batches = []
+        self.sender.fire = lambda event, *channels: \
+            self.batches.append((channels[0], event.args[0]))
+        self.rendered = []
+        render = self.sender._render
+        def counting_render(template, data):
+            self.rendered.append(data)
+            return render(template, data)
+        self.sender._render = counting_render
+
+    def tearDown(self):
+        ssdp_module.time = self._saved
+
+    def test_notifications(self):
+        device = DeviceStub("1")
+        self.sender._on_device_available(device)
+        self.assertEqual([channel for channel, datagrams in self.batches],
+                         ["ssdp:192.168.1.2", "ssdp:10.0.0.2"])
+        channel, datagrams = self.batches[0]
+        messages = [parse_ssdp_message(data) for to, data in datagrams]
+        self.assertEqual([message.usn for message in messages],
+                         ["uuid:1::" + UPNP_ROOTDEVICE, "uuid:1",
+                          "uuid:1::urn:schemas-upnp-org:device:BinaryLight:1",
+                          "uuid:1::urn:schemas-upnp-org:service:"
+                          "SwitchPower:1"])
+        self.assertEqual(set(message.location for message in messages),
+                         set(["http://192.168.1.2:8080/1/description.xml"]))
+        self.assertEqual(set(message.boot_id for message in messages),
+                         set([SSDPSender._boot_id]))
+        self.assertEqual(messages[0].config_id, 1)
+        self.assertTrue(b"\0" not in datagrams[0][1])
+        # One datagram per NT and interface
+        self.assertEqual(len(self.rendered), 8)
+
+    def test_cached(self):
+        device = DeviceStub("1")
+        self.sender._on_device_available(device)
+        first = self.batches[0][1]
+        del self.batches[:]
+        self.sender._on_announcements_due([device])
+        self.assertEqual(len(self.rendered), 8)
+        self.assertEqual(self.batches[0][1], first)
+        # A new configuration invalidates the cached datagrams
+        device.config_id = 2
+        self.sender._on_announcements_due([device])
+        self.assertEqual(len(self.rendered), 16)
+        self.assertEqual(parse_ssdp_message(self.batches[-1][1][0][1])
+                         .config_id, 2)
+
+    def test_dropped_when_unavailable(self):
+        device = DeviceStub("1")
+        self.sender._on_device_available(device)
+        self.assertTrue("1" in self.sender._datagram_cache)
+        self.sender._on_device_unavailable(device)
+        self.assertFalse("1" in self.sender._datagram_cache)
+        channel, datagrams = self.batches[-1]
+        self.assertEqual(set(parse_ssdp_message(data).sub_type
+                             for to, data in datagrams),
+                         set(["ssdp:byebye"]))
@@ -0,0 +1,89 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.ssdp import SSDPInterfaceServer, send_datagrams
+from unittest import TestCase
+from errno import EWOULDBLOCK
+import socket
+
+class SocketStub(object):
+    """Accepts *capacity* datagrams, then reports a full buffer."""
+
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.sent = []
+
+    def sendto(self, data, address):
+        if self.capacity is not None and len(self.sent) >= self.capacity:
+            raise socket.error(EWOULDBLOCK, "Would block")
+        self.sent.append((address, data))
+        return len(data)
+
+
+class ServerStub(SSDPInterfaceServer):
+    """Records the datagrams queued for sending later."""
+
+    def __init__(self, sock):
+        self._stub_sock = sock
+        self.queued = []
+        super(ServerStub, self).__init__("192.168.1.2")
+
+    def _create_socket(self):
+        return self._stub_sock
+
+    def write(self, address, data):
+        self.queued.append((address, data))
+
+
+DATAGRAMS = [(("239.255.255.250", 1900), b"NOTIFY 1"),
+             (("192.168.1.10", 50000), b"HTTP/1.1 200 OK 2"),
+             (("192.168.1.11", 50001), b"HTTP/1.1 200 OK 3"),
+             (("239.255.255.250", 1900), b"NOTIFY 4")]
+
+class TestSSDPWriteBatch(TestCase):
+
+    def test_send_datagrams(self):
+        sock = SocketStub()
+        self.assertEqual(send_datagrams(sock, DATAGRAMS), 4)
+        self.assertEqual(sock.sent, DATAGRAMS)
+        sock = SocketStub(capacity=1)
+        self.assertEqual(send_datagrams(sock, DATAGRAMS), 1)
+
+    def test_batch(self):
+        server = ServerStub(SocketStub())
+        self.assertEqual(server.channel, "ssdp:192.168.1.2")
+        server.write_batch(DATAGRAMS)
+        self.assertEqual(server._sock.sent, DATAGRAMS)
+        self.assertEqual(server.queued, [])
+
+    def test_buffer_full(self):
+        server = ServerStub(SocketStub(capacity=2))
+        server.write_batch(DATAGRAMS)
+        self.assertEqual(server._sock.sent, DATAGRAMS[:2])
+        # The remaining datagrams are queued with their addresses
+        self.assertEqual(server.queued, DATAGRAMS[2:])
+
+    def test_queued_before(self):
+        # Datagrams must not overtake datagrams already queued
+        server = ServerStub(SocketStub())
+        server._buffers[server._sock].append(DATAGRAMS[0])
+        server.write_batch(DATAGRAMS[1:])
+        self.assertEqual(server._sock.sent, [])
+        self.assertEqual(server.queued, DATAGRAMS[1:])
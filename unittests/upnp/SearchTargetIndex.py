@@ -0,0 +1,91 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.ssdp import SearchTargetIndex
+from cocy.upnp import UPNP_ROOTDEVICE
+from unittest import TestCase
+
+class ServiceStub(object):
+
+    def __init__(self, type_ver):
+        self.type_ver = type_ver
+
+
+class DeviceStub(object):
+
+    def __init__(self, uuid, type_ver, services, root_device=True):
+        self.uuid = uuid
+        self.root_device = root_device
+        self.type_ver = type_ver
+        self.services = [ServiceStub(service) for service in services]
+
+
+DEVICE = "urn:schemas-upnp-org:device:"
+SERVICE = "urn:schemas-upnp-org:service:"
+
+class TestSearchTargetIndex(TestCase):
+
+    def setUp(self):
+        self.index = SearchTargetIndex()
+        self.light = DeviceStub("1", "BinaryLight:1", ["SwitchPower:1"])
+        self.renderer = DeviceStub("2", "MediaRenderer:2",
+                                   ["RenderingControl:2", "AVTransport:2"])
+        self.embedded = DeviceStub("3", "DimmableLight:1",
+                                   ["SwitchPower:1", "Dimming:1"], False)
+        for device in [self.light, self.renderer, self.embedded]:
+            self.index.add(device)
+
+    def _resolve(self, search_target):
+        return sorted((device.uuid, nt) for device, nt
+                      in self.index.resolve(search_target))
+
+    def test_all(self):
+        self.assertEqual(len(self.index.resolve("ssdp:all")), 13)
+
+    def test_root_device_and_uuid(self):
+        self.assertEqual(self._resolve(UPNP_ROOTDEVICE),
+                         [("1", UPNP_ROOTDEVICE), ("2", UPNP_ROOTDEVICE)])
+        self.assertEqual(self._resolve("uuid:3"), [("3", "uuid:3")])
+        self.assertEqual(self._resolve("uuid:4"), [])
+
+    def test_versions(self):
+        # Same or higher versions match, the NT has the actual version
+        self.assertEqual(self._resolve(SERVICE + "SwitchPower:1"),
+                         [("1", SERVICE + "SwitchPower:1"),
+                          ("3", SERVICE + "SwitchPower:1")])
+        self.assertEqual(self._resolve(DEVICE + "MediaRenderer:1"),
+                         [("2", DEVICE + "MediaRenderer:2")])
+        self.assertEqual(self._resolve(DEVICE + "MediaRenderer:3"), [])
+        self.assertEqual(self._resolve(SERVICE + "Dimming:x"), [])
+
+    def test_remove_and_update(self):
+        self.index.remove(self.light)
+        self.assertEqual(self._resolve(SERVICE + "SwitchPower:1"),
+                         [("3", SERVICE + "SwitchPower:1")])
+        self.assertEqual(self._resolve(DEVICE + "BinaryLight:1"), [])
+        self.index.remove(self.light)
+        # Adding again replaces the old entries
+        self.renderer.services = [ServiceStub("AVTransport:2")]
+        self.index.add(self.renderer)
+        self.assertEqual(self._resolve(SERVICE + "RenderingControl:1"), [])
+        self.assertEqual(self._resolve(SERVICE + "AVTransport:1"),
+                         [("2", SERVICE + "AVTransport:2")])
+        self.assertEqual(len(self.index.resolve("ssdp:all")), 8)
+        self.assertFalse(DEVICE + "BinaryLight" in self.index._index)
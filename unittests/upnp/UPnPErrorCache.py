@@ -0,0 +1,61 @@
+"""
+..
+   This file is part of the CoCy program.
+   Copyright (C) 2012 Michael N. Lipp
+
+   This program is free software: you can redistribute it and/or modify
+   it under the terms of the GNU General Public License as published by
+   the Free Software Foundation, either version 3 of the License, or
+   (at your option) any later version.
+
+   This program is distributed in the hope that it will be useful,
+   but WITHOUT ANY WARRANTY; without even the implied warranty of
+   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+   GNU General Public License for more details.
+
+   You should have received a copy of the GNU General Public License
+   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+.. codeauthor:: mnl
+"""
+from cocy.upnp.device_server import UPnPError
+from cocy.upnp.control_point import parse_action_response, UPnPActionError
+from unittest import TestCase
+
+class ResponseStub(object):
+
+    def __init__(self):
+        self.headers = dict()
+
+
+class TestUPnPErrorCache(TestCase):
+
+    def _error(self, *args):
+        response = ResponseStub()
+        error = UPnPError(None, response, *args)
+        self.assertEqual(response.headers["Content-Type"],
+                         "text/xml; charset=utf-8")
+        return str(error)
+
+    def _parsed(self, fault):
+        try:
+            parse_action_response(fault.encode("utf-8"))
+        except UPnPActionError as error:
+            return error.code, error.description
+        return None
+
+    def test_prewarmed(self):
+        for code, desc in UPnPError._error_descs.items():
+            self.assertTrue((code, desc) in UPnPError._faults)
+        fault = self._error(401)
+        self.assertTrue(fault is UPnPError._faults[(401, "Invalid Action")])
+        self.assertTrue(self._error(401) is fault)
+        self.assertEqual(self._parsed(fault), (401, "Invalid Action"))
+
+    def test_other_codes(self):
+        fault = self._error(701)
+        self.assertEqual(self._parsed(fault), (701, "Unknown"))
+        self.assertTrue(self._error(701) is fault)
+        fault = self._error(710, "Seek mode not supported")
+        self.assertEqual(self._parsed(fault),
+                         (710, "Seek mode not supported"))